@@ -0,0 +1,210 @@
+import unicodedata
+from functools import lru_cache
+
+# The standard analyzer of Elasticsearch without the network round trip: Unicode word
+# segmentation (UAX #29, like Lucene's StandardTokenizer), tokens cut at MAX_TOKEN_LENGTH and
+# lowercased one code point at a time like Lucene's LowerCaseFilter. The Word_Break property is
+# derived from unicodedata, which is close but not identical to the Unicode data files Lucene
+# is built from. SearchGUI imports it from here. analyzer_cases.json holds hand-written cases
+# with the tokens the standard analyzer is expected to give, not outputs recorded from a
+# cluster. python check_analyzer.py --record replaces them with what _analyze returns.
+
+MAX_TOKEN_LENGTH = 255
+
+# Word_Break classes
+OTHER, CR, LF, NEWLINE, EXTEND, ZWJ, REGIONAL_INDICATOR, FORMAT, KATAKANA, HEBREW_LETTER, ALETTER, SINGLE_QUOTE, \
+    DOUBLE_QUOTE, MID_NUM_LET, MID_LETTER, MID_NUM, NUMERIC, EXTEND_NUM_LET, WSEG_SPACE, PICTOGRAPHIC, \
+    IDEOGRAPHIC, HIRAGANA, SOUTHEAST_ASIAN, TEXT_PICTOGRAPHIC = range(24)
+
+MID_LETTER_CHARS = set("\u003a\u00b7\u0387\u055f\u05f4\u2027\ufe13\ufe55\uff1a")
+MID_NUM_LET_CHARS = set("\u002e\u2018\u2019\u2024\ufe52\uff07\uff0e")
+MID_NUM_CHARS = set("\u002c\u003b\u037e\u0589\u060c\u060d\u066c\u07f8\u2044\ufe10\ufe14\ufe50\ufe54\uff0c\uff1b")
+NEWLINE_CHARS = set("\u000b\u000c\u0085\u2028\u2029")
+
+AHLETTER = (ALETTER, HEBREW_LETTER)
+MID_NUM_LET_Q = (MID_NUM_LET, SINGLE_QUOTE)
+# Segments made of these are tokens, everything else (spaces, punctuation, symbols) is dropped
+TOKEN_CLASSES = {ALETTER, HEBREW_LETTER, NUMERIC, KATAKANA, IDEOGRAPHIC, HIRAGANA, SOUTHEAST_ASIAN, PICTOGRAPHIC, REGIONAL_INDICATOR}
+
+
+def _in(code, ranges):
+    return any(low <= code <= high for low, high in ranges)
+
+
+IDEOGRAPHIC_RANGES = ((0x3400, 0x4dbf), (0x4e00, 0x9fff), (0xf900, 0xfaff), (0x20000, 0x3134f), (0x3005, 0x3005), (0x3007, 0x3007), (0x3021, 0x3029), (0x3038, 0x303b))
+KATAKANA_RANGES = ((0x3031, 0x3035), (0x309b, 0x309c), (0x30a0, 0x30ff), (0x31f0, 0x31ff), (0x32d0, 0x32fe), (0x3300, 0x3357), (0xff66, 0xff9d))
+HIRAGANA_RANGES = ((0x3040, 0x309f),)
+SOUTHEAST_ASIAN_RANGES = ((0x0e00, 0x0eff), (0x1000, 0x109f), (0x1780, 0x17ff), (0x1950, 0x19df), (0x1a20, 0x1aaf), (0xaa60, 0xaadf))
+HEBREW_LETTER_RANGES = ((0x05d0, 0x05ea), (0x05ef, 0x05f2), (0xfb1d, 0xfb4f))
+PICTOGRAPHIC_RANGES = ((0x1f000, 0x1f0ff), (0x1f200, 0x1faff))
+TEXT_PICTOGRAPHIC_RANGES = ((0x00a9, 0x00a9), (0x00ae, 0x00ae), (0x2190, 0x21ff), (0x2300, 0x23ff), (0x25a0, 0x27bf), (0x2b00, 0x2bff))
+
+
+@lru_cache(maxsize=8192)
+def word_break_class(char):
+    code = ord(char)
+    if char == "\r":
+        return CR
+    if char == "\n":
+        return LF
+    if char in NEWLINE_CHARS:
+        return NEWLINE
+    if code == 0x200d:
+        return ZWJ
+    if 0x1f1e6 <= code <= 0x1f1ff:
+        return REGIONAL_INDICATOR
+    if 0x1f3fb <= code <= 0x1f3ff:
+        return EXTEND # Skin tone modifiers
+    if char == "'":
+        return SINGLE_QUOTE
+    if char == '"':
+        return DOUBLE_QUOTE
+    if char in MID_LETTER_CHARS:
+        return MID_LETTER
+    if char in MID_NUM_LET_CHARS:
+        return MID_NUM_LET
+    if char in MID_NUM_CHARS:
+        return MID_NUM
+    if code == 0x202f:
+        return EXTEND_NUM_LET
+    if _in(code, IDEOGRAPHIC_RANGES):
+        return IDEOGRAPHIC
+    if _in(code, KATAKANA_RANGES):
+        return KATAKANA
+    if _in(code, HIRAGANA_RANGES):
+        return HIRAGANA
+
+    category = unicodedata.category(char)
+    if category in ("Mn", "Me", "Mc"):
+        return EXTEND
+    if _in(code, SOUTHEAST_ASIAN_RANGES) and category.startswith("L"):
+        return SOUTHEAST_ASIAN
+    if category == "Cf":
+        return FORMAT
+    if category == "Zs":
+        return WSEG_SPACE
+    if category == "Pc":
+        return EXTEND_NUM_LET
+    if category == "Nd":
+        return NUMERIC
+    if _in(code, HEBREW_LETTER_RANGES):
+        return HEBREW_LETTER
+    if category.startswith("L") or category == "Nl":
+        return ALETTER
+    if _in(code, PICTOGRAPHIC_RANGES):
+        return PICTOGRAPHIC
+    if _in(code, TEXT_PICTOGRAPHIC_RANGES):
+        return TEXT_PICTOGRAPHIC
+    return OTHER
+
+
+def _breaks(classes):
+    """True at every position i (0 < i < len) where a word boundary falls before classes[i]."""
+    n = len(classes)
+    ignore = (EXTEND, FORMAT, ZWJ)
+    breaks = [False] * n
+
+    def next_significant(i):
+        """Index of the first class from i on that WB4 does not skip."""
+        while i < n and classes[i] in ignore:
+            i += 1
+        return i
+
+    # prev is the last class before the current position that WB4 did not skip, prev2 the one before that
+    prev = prev2 = None
+    regional_run = 0
+    for i in range(n):
+        c = classes[i]
+        if i == 0:
+            prev = c
+            regional_run = 1 if c == REGIONAL_INDICATOR else 0
+            continue
+        before = classes[i - 1]
+
+        if before == CR and c == LF:
+            continue # WB3
+        if before in (CR, LF, NEWLINE) or c in (CR, LF, NEWLINE):
+            breaks[i] = True # WB3a, WB3b
+            prev2, prev = prev, c
+            regional_run = 0
+            continue
+        if before == ZWJ and c == PICTOGRAPHIC:
+            prev2, prev = prev, c
+            continue # WB3c
+        if before == WSEG_SPACE and c == WSEG_SPACE:
+            continue # WB3d
+        if c in ignore:
+            continue # WB4, attached to what came before
+
+        after_index = next_significant(i + 1)
+        after = classes[after_index] if after_index < n else None
+        join = False
+        if prev in AHLETTER and c in AHLETTER:
+            join = True # WB5
+        elif prev in AHLETTER and c in (MID_LETTER,) + MID_NUM_LET_Q and after in AHLETTER:
+            join = True # WB6
+        elif prev2 in AHLETTER and prev in (MID_LETTER,) + MID_NUM_LET_Q and c in AHLETTER:
+            join = True # WB7
+        elif prev == HEBREW_LETTER and c == SINGLE_QUOTE:
+            join = True # WB7a
+        elif prev == HEBREW_LETTER and c == DOUBLE_QUOTE and after == HEBREW_LETTER:
+            join = True # WB7b
+        elif prev2 == HEBREW_LETTER and prev == DOUBLE_QUOTE and c == HEBREW_LETTER:
+            join = True # WB7c
+        elif prev == NUMERIC and c == NUMERIC:
+            join = True # WB8
+        elif prev in AHLETTER and c == NUMERIC:
+            join = True # WB9
+        elif prev == NUMERIC and c in AHLETTER:
+            join = True # WB10
+        elif prev2 == NUMERIC and prev in (MID_NUM,) + MID_NUM_LET_Q and c == NUMERIC:
+            join = True # WB11
+        elif prev == NUMERIC and c in (MID_NUM,) + MID_NUM_LET_Q and after == NUMERIC:
+            join = True # WB12
+        elif prev == KATAKANA and c == KATAKANA:
+            join = True # WB13
+        elif prev in AHLETTER + (NUMERIC, KATAKANA, EXTEND_NUM_LET) and c == EXTEND_NUM_LET:
+            join = True # WB13a
+        elif prev == EXTEND_NUM_LET and c in AHLETTER + (NUMERIC, KATAKANA):
+            join = True # WB13b
+        elif prev == REGIONAL_INDICATOR and c == REGIONAL_INDICATOR and regional_run % 2 == 1:
+            join = True # WB15, WB16
+        elif prev == SOUTHEAST_ASIAN and c == SOUTHEAST_ASIAN:
+            join = True # Lucene keeps runs of Southeast Asian letters together
+
+        breaks[i] = not join
+        regional_run = regional_run + 1 if c == REGIONAL_INDICATOR else 0
+        prev2, prev = prev, c
+    return breaks
+
+
+def _lowercase(token):
+    # Code point by code point like Java's Character.toLowerCase, no final sigma and İ -> i
+    return "".join("i" if char == "İ" else char.lower() if len(char.lower()) == 1 else char for char in token)
+
+
+def tokenize(text):
+    """Tokens of the standard tokenizer, before lowercasing."""
+    if len(text) == 0:
+        return []
+    classes = [word_break_class(char) for char in text]
+    # Arrows, dingbats and the like are only emoji in emoji presentation, with U+FE0F after them
+    for i, c in enumerate(classes):
+        if c == TEXT_PICTOGRAPHIC:
+            classes[i] = PICTOGRAPHIC if text[i + 1:i + 2] == "\ufe0f" else OTHER
+    breaks = _breaks(classes)
+    tokens = []
+    start = 0
+    for end in range(1, len(text) + 1):
+        if end < len(text) and not breaks[end]:
+            continue
+        if any(c in TOKEN_CLASSES for c in classes[start:end]):
+            token = text[start:end]
+            tokens.extend(token[i:i + MAX_TOKEN_LENGTH] for i in range(0, len(token), MAX_TOKEN_LENGTH))
+        start = end
+    return tokens
+
+
+def analyze(text):
+    """Tokens of the standard analyzer, what the analyze API returns for analyzer "standard"."""
+    return [_lowercase(token) for token in tokenize(text)]
@@ -1,20 +1,188 @@
-from elasticsearch import Elasticsearch, helpers
-import time
-from multiprocessing.pool import ThreadPool
+import argparse
+import contextlib
+import gzip
+import hashlib
 import json
+import multiprocessing as mp
+import os
+import time
+import traceback
+from datetime import datetime, timezone
+import numpy as np
+from elasticsearch import Elasticsearch
 from tqdm import tqdm
-from setup import ADDRESS, API_KEY, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS
+from setup import ADDRESS, API_KEY, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS, BACKUP_FOLDER, BACKUP_WORKERS, BACKUP_PAGE_SIZE
+from vector_codec import NpyWriter, unpack_vector
 
+# Backs up indices with a point in time and sliced search, one process per slice. Every slice
+# writes <index>/slice_<n>.ndjson.gz with {"_id", "_source"} per line and, for every dense_vector
+# field, <index>/slice_<n>.<field>.npy where row i is the vector of line i (NaN if it has none).
+# Every page of a slice is a gzip member of its own, so a restore can start reading at any page.
+# manifest.json lists the mappings, the files, their number of documents, their sha256 and the
+# byte offset and first line of every member. A slice writes its files as .tmp and they only get
+# their names once the manifest that lists them is written, so an unfinished backup never leaves
+# files behind that look complete.
 
-def backup_index(index, total):
-    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=120)
+PIT_KEEP_ALIVE = "30m"
+MANIFEST_NAME = "manifest.json"
+
+
+def vector_fields(mappings):
+    """Top level dense_vector fields of a mapping as {field: dims}."""
+    return {field: spec["dims"] for field, spec in mappings.get("properties", {}).items() if spec.get("type") == "dense_vector"}
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def slice_files(entry):
+    """The names of the files of a slice in the manifest."""
+    return [entry["file"]] + [spec["file"] for spec in entry["vectors"].values()]
+
+
+def publish_slices(folder, entry):
+    """Gives the .tmp files of the slices of a manifest entry their names, once the manifest is written."""
+    for slice_entry in entry["slices"]:
+        for name in slice_files(slice_entry):
+            os.replace(os.path.join(folder, name + ".tmp"), os.path.join(folder, name))
+
+
+def remove_tmp_files(folder, names):
+    for name in names:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(folder, name + ".tmp"))
 
-    filename = index + "_backup.json"
 
-    with open(filename, "w") as f:
-        for doc in tqdm(helpers.scan(client=client, scroll="6h", index=index, size=80), total=total):
-            json.dump(doc, f)
-            f.write("\n")
+def backup_slice(pit_id, slice_id, slices, folder, fields, page_size, progress):
+    """Writes one slice of the index as .tmp files and puts ("done", slice_id, entry) on progress when it is finished."""
+    name = f"slice_{slice_id:03d}"
+    docs_name = name + ".ndjson.gz"
+    vector_names = {field: f"{name}.{field}.npy" for field in fields}
+    try:
+        client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=300)
+        missing = {field: np.full(dims, np.nan, dtype=np.float32) for field, dims in fields.items()}
 
+        docs = 0
+        members = []
+        search_after = None
+        # Every file is closed if the slice fails half way, the files are removed below
+        with contextlib.ExitStack() as files:
+            vectors = {field: files.enter_context(NpyWriter(os.path.join(folder, vector_names[field] + ".tmp"), dims)) for field, dims in fields.items()}
+            f = files.enter_context(open(os.path.join(folder, docs_name + ".tmp"), "wb"))
+            while True:
+                response = client.search(
+                    pit={"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                    slice={"id": slice_id, "max": slices} if slices > 1 else None,
+                    sort=["_shard_doc"],
+                    search_after=search_after,
+                    size=page_size,
+                    track_total_hits=False,
+                    filter_path=["pit_id", "hits.hits._id", "hits.hits._source", "hits.hits.sort"],
+                )
+                hits = response.get("hits", {}).get("hits", [])
+                if len(hits) == 0:
+                    break
 
-backup_index(INDEX_TRANSCRIPTS, 8429540)
\ No newline at end of file
+                lines = []
+                for hit in hits:
+                    source = hit.get("_source", {})
+                    for field, writer in vectors.items():
+                        vector = unpack_vector(source.pop(field, None))
+                        writer.write(missing[field] if vector is None else vector)
+                    lines.append(json.dumps({"_id": hit["_id"], "_source": source}, separators=(",", ":")) + "\n")
+                members.append([f.tell(), docs])
+                f.write(gzip.compress("".join(lines).encode("utf-8"), compresslevel=3))
+                docs += len(hits)
+                progress.put(("progress", slice_id, len(hits)))
+                search_after = hits[-1]["sort"]
+                pit_id = response.get("pit_id", pit_id)
+
+        entry = {"file": docs_name, "docs": docs, "sha256": sha256_file(os.path.join(folder, docs_name + ".tmp")), "members": members, "vectors": {}}
+        for field, vector_name in vector_names.items():
+            entry["vectors"][field] = {"file": vector_name, "dims": fields[field], "sha256": sha256_file(os.path.join(folder, vector_name + ".tmp"))}
+        progress.put(("done", slice_id, entry))
+    except Exception:
+        remove_tmp_files(folder, [docs_name] + list(vector_names.values()))
+        progress.put(("error", slice_id, traceback.format_exc()))
+
+
+def backup_index(client, index, folder, workers=BACKUP_WORKERS, page_size=BACKUP_PAGE_SIZE):
+    """Backs up one index into folder/index, returns its manifest entry.
+
+    The files are left as .tmp, publish_slices names them once the entry is in the manifest.
+    """
+    index_folder = os.path.join(folder, index)
+    os.makedirs(index_folder, exist_ok=True)
+    # Keyed by the concrete index, which is not the name that was asked for if index is an alias
+    mappings = next(iter(client.indices.get_mapping(index=index).values()))["mappings"]
+    fields = vector_fields(mappings)
+    total = client.count(index=index)["count"]
+    pit_id = client.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+
+    progress = mp.Queue()
+    processes = [
+        mp.Process(target=backup_slice, args=(pit_id, i, workers, index_folder, fields, page_size, progress))
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+
+    slices = [None] * workers
+    errors = []
+    start = time.time()
+    try:
+        with tqdm(total=total, desc=f"Backing up {index}", unit="docs") as tqdm_bar:
+            running = workers
+            while running > 0:
+                (kind, slice_id, value) = progress.get()
+                if kind == "progress":
+                    tqdm_bar.update(value)
+                    tqdm_bar.set_postfix(docs_per_s=int(tqdm_bar.n / max(1e-9, time.time() - start)))
+                else:
+                    running -= 1
+                    if kind == "done":
+                        slices[slice_id] = value
+                    else:
+                        errors.append(value)
+    finally:
+        for p in processes:
+            p.join()
+        client.close_point_in_time(id=pit_id)
+
+    if (len(errors) > 0):
+        for entry in slices:
+            if entry is not None:
+                remove_tmp_files(index_folder, slice_files(entry))
+        raise RuntimeError(f"Backup of {index} failed in {len(errors)} slices:\n" + "\n".join(errors))
+
+    docs = sum(s["docs"] for s in slices)
+    elapsed = time.time() - start
+    print(f"{index}: {docs} documents in {elapsed:.0f}s ({docs / max(1e-9, elapsed):.0f} docs/s)")
+    if (docs != total):
+        print(f"Warning: {index} counted {total} documents before the backup but {docs} were written")
+    return {"count": docs, "mappings": mappings, "slices": slices}
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("indices", nargs="*", default=[INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS])
+    parser.add_argument("--folder", default=BACKUP_FOLDER)
+    parser.add_argument("--workers", type=int, default=BACKUP_WORKERS, help="Slices, each backed up by its own process")
+    parser.add_argument("--page-size", type=int, default=BACKUP_PAGE_SIZE)
+    args = parser.parse_args()
+
+    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=120)
+    os.makedirs(args.folder, exist_ok=True)
+    manifest = {"created": datetime.now(timezone.utc).isoformat(), "indices": {}}
+    for index in args.indices:
+        manifest["indices"][index] = backup_index(client, index, args.folder, args.workers, args.page_size)
+        # Written after every index so the finished ones are usable if a later one fails
+        with open(os.path.join(args.folder, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+        publish_slices(os.path.join(args.folder, index), manifest["indices"][index])
+    print(f"Wrote {os.path.join(args.folder, MANIFEST_NAME)}")
@@ -0,0 +1,296 @@
+"""Recall and latency of the knn search for a grid of vector settings.
+
+The exact top k of every query is computed with NumPy on the full vectors in float32. Every
+setting is then measured against it: recall@k and the p50/p99 latency of single queries.
+The grid covers the Matryoshka dimension, the quantization (index_options.type), m,
+ef_construction and num_candidates.
+
+--target es builds a temporary index per setting on the cluster in setup.py, force merged to
+one segment like index_versions.finish_build, and deletes it afterwards unless --keep.
+--target local uses hnswlib as a stand-in, with num_candidates as ef. int8, int4 and bbq are
+approximated by quantizing the vectors before they are indexed, without any rescoring. Without
+hnswlib the local target searches exhaustively, so only dims and quantization are measured.
+
+The vectors come from .npy files, e.g. the transcript vectors of a backup, from the embedding
+model (--embed) or, without either, from a synthetic clustered set that is only good for
+trying the script. With --vectors, queries are held out rows unless --query-vectors is given.
+Run from the Indexer folder:
+python benchmarks/bench_ann.py --vectors elastic_backup/podcast_transcripts/*.vector.npy --target es
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from setup import ADDRESS, API_KEY, MATRYOSHKA_DIM, EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE
+from vector_codec import encode_vector
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+try:
+    from elasticsearch import Elasticsearch, helpers
+except ImportError:
+    Elasticsearch = None
+
+INDEX_PREFIX = "ann_bench"
+WARMUP_QUERIES = 20
+
+
+def normalize(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def truncate(vectors, dim):
+    """Matryoshka truncation of already normalized vectors."""
+    return normalize(vectors[:, :dim])
+
+
+def synthetic_vectors(count, dim, seed=0, clusters=64):
+    """Normalized vectors around random centers, closer to real embeddings than plain noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(clusters, size=count)] + 0.7 * rng.standard_normal((count, dim)).astype(np.float32)
+    return normalize(vectors)
+
+
+def load_vectors(paths):
+    """Rows of the .npy files, without the NaN rows backups use for documents without a vector."""
+    vectors = np.concatenate([np.load(path, mmap_mode="r") for path in paths]).astype(np.float32)
+    return normalize(vectors[~np.isnan(vectors).any(axis=1)])
+
+
+def embed_corpus(docs, queries, dim, folder=None):
+    from bench_embedding import load_corpus, QUERY_PREFIX
+    from embedding_backend import BACKENDS
+    from transcript_indexer import DOCUMENT_PREFIX
+
+    chunks, query_texts = load_corpus(docs, queries, folder)
+    backend = BACKENDS[EMBEDDING_BACKEND](dim=dim)
+    doc_vectors = np.concatenate([backend.encode([DOCUMENT_PREFIX + c for c in chunks[i:i + EMBEDDING_BATCH_SIZE]]) for i in range(0, len(chunks), EMBEDDING_BATCH_SIZE)])
+    query_vectors = backend.encode([QUERY_PREFIX + q for q in query_texts])
+    return doc_vectors.astype(np.float32), query_vectors.astype(np.float32)
+
+
+def exact_top_k(docs, queries, k, block=256):
+    """Ids of the k highest dot products of every query, best first."""
+    result = np.zeros((len(queries), k), dtype=np.int64)
+    for i in range(0, len(queries), block):
+        scores = queries[i:i + block] @ docs.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        result[i:i + block] = np.take_along_axis(top, order, axis=1)
+    return result
+
+
+def recall(results, truth, k):
+    return float(np.mean([len(set(r[:k]) & set(t[:k])) / k for r, t in zip(results, truth.tolist())]))
+
+
+def quantize(vectors, kind, lower=None, upper=None):
+    """Quantizes and dequantizes like Lucene's scalar quantizer (one range for all dimensions) or, for bbq, to one bit."""
+    if kind in ("hnsw", "flat"):
+        return vectors, None, None
+    if kind.startswith("bbq"):
+        center = vectors.mean(axis=0) if lower is None else lower
+        return normalize(np.sign(vectors - center)), center, None
+    levels = 255 if kind.startswith("int8") else 15
+    if lower is None:
+        (lower, upper) = np.quantile(vectors, [0.001, 0.999])
+    steps = np.round((np.clip(vectors, lower, upper) - lower) / (upper - lower) * levels)
+    return (steps / levels * (upper - lower) + lower).astype(np.float32), lower, upper
+
+
+def index_options(kind, m, ef_construction):
+    if kind.endswith("hnsw"):
+        return {"type": kind, "m": m, "ef_construction": ef_construction}
+    return {"type": kind}
+
+
+class LocalTarget:
+    """hnswlib, or an exhaustive NumPy search without it, on quantized copies of the vectors."""
+
+    def __init__(self, threads):
+        self.threads = threads
+        self.index = None
+
+    def build(self, docs, kind, m, ef_construction):
+        start = time.perf_counter()
+        (self.docs, self.lower, self.upper) = quantize(docs, kind)
+        self.kind = kind
+        if hnswlib is not None and kind.endswith("hnsw"):
+            self.index = hnswlib.Index(space="ip", dim=docs.shape[1])
+            self.index.init_index(max_elements=len(docs), M=m, ef_construction=ef_construction, random_seed=0)
+            self.index.add_items(self.docs, np.arange(len(docs)), num_threads=self.threads)
+        else:
+            self.index = None
+        return (time.perf_counter() - start, None)
+
+    def search(self, query, k, num_candidates):
+        query = quantize(query[None, :], self.kind, self.lower, self.upper)[0]
+        if self.index is not None:
+            self.index.set_ef(num_candidates)
+            return (self.index.knn_query(query, k=k, num_threads=1)[0][0].tolist(), None)
+        return (exact_top_k(self.docs, query, k)[0].tolist(), None)
+
+    def delete(self):
+        self.index = None
+
+
+class ElasticTarget:
+    """A temporary index per setting on the cluster."""
+
+    def __init__(self, keep):
+        self.client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=600)
+        self.keep = keep
+        self.index = None
+
+    def build(self, docs, kind, m, ef_construction):
+        self.index = f"{INDEX_PREFIX}_{docs.shape[1]}_{kind}_{m}_{ef_construction}"
+        if self.client.indices.exists(index=self.index):
+            self.client.indices.delete(index=self.index)
+        mappings = {"properties": {"vector": {"type": "dense_vector", "dims": docs.shape[1], "index": True, "similarity": "dot_product", "index_options": index_options(kind, m, ef_construction)}}}
+        self.client.indices.create(index=self.index, mappings=mappings, settings={"number_of_shards": 1, "number_of_replicas": 0, "refresh_interval": "-1"})
+
+        start = time.perf_counter()
+        actions = ({"_index": self.index, "_id": str(i), "vector": encode_vector(vector)} for i, vector in enumerate(docs))
+        helpers.bulk(self.client, actions, chunk_size=1000, max_retries=3)
+        self.client.indices.refresh(index=self.index)
+        self.client.options(request_timeout=3600).indices.forcemerge(index=self.index, max_num_segments=1)
+        build_s = time.perf_counter() - start
+        size = self.client.indices.stats(index=self.index, metric="store")["_all"]["primaries"]["store"]["size_in_bytes"]
+        return (build_s, size)
+
+    def search(self, query, k, num_candidates):
+        response = self.client.search(
+            index=self.index, knn={"field": "vector", "query_vector": query.tolist(), "k": k, "num_candidates": num_candidates},
+            size=k, source=False, filter_path=["took", "hits.hits._id"],
+        )
+        return ([int(hit["_id"]) for hit in response.get("hits", {}).get("hits", [])], response["took"])
+
+    def delete(self):
+        if self.index is not None and not self.keep:
+            self.client.indices.delete(index=self.index)
+
+
+def measure(target, queries, truth, k, num_candidates):
+    for query in queries[:WARMUP_QUERIES]:
+        target.search(query, k, num_candidates)
+    results = []
+    latencies = []
+    tooks = []
+    for query in queries:
+        start = time.perf_counter()
+        (ids, took) = target.search(query, k, num_candidates)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids)
+        if took is not None:
+            tooks.append(took)
+    return {
+        "recall": recall(results, truth, k),
+        "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99)),
+        "took_p50_ms": float(np.percentile(tooks, 50)) if tooks else None,
+    }
+
+
+def grid(args):
+    """Settings as (dim, type, m, ef_construction), m and ef_construction only vary for hnsw types."""
+    for dim in args.dims:
+        for kind in args.types:
+            if not kind.endswith("hnsw") or (args.target == "local" and hnswlib is None):
+                yield (dim, kind, None, None)
+                continue
+            for m in args.m:
+                for ef_construction in args.ef_construction:
+                    yield (dim, kind, m, ef_construction)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", choices=["local", "es"], default="local")
+    parser.add_argument("--vectors", nargs="+", help=".npy files with one normalized vector per row")
+    parser.add_argument("--query-vectors", help=".npy file with query vectors, held out rows of --vectors are used without it")
+    parser.add_argument("--embed", action="store_true", help="Embed transcript chunks and queries with the embedding model")
+    parser.add_argument("--folder", help="Folder with transcript files for --embed, synthetic transcripts without one")
+    parser.add_argument("--docs", type=int, default=100000, help="Corpus sample size")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, MATRYOSHKA_DIM])
+    parser.add_argument("--types", nargs="+", default=["hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw"])
+    parser.add_argument("--m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[100, 200])
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[50, 100, 200, 500])
+    parser.add_argument("--min-recall", type=float, default=0.95, help="Recall the suggested setting has to reach")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Build threads of the local target")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark indices on the cluster")
+    parser.add_argument("--csv", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.target == "es" and Elasticsearch is None:
+        parser.error("--target es needs the elasticsearch package")
+    rng = np.random.default_rng(0)
+    if args.embed:
+        (docs, queries) = embed_corpus(args.docs, args.queries, max(args.dims), args.folder)
+    else:
+        docs = load_vectors(args.vectors) if args.vectors else synthetic_vectors(args.docs + args.queries, max(args.dims))
+        rows = rng.permutation(len(docs))
+        if args.query_vectors:
+            queries = normalize(np.load(args.query_vectors).astype(np.float32))[:args.queries]
+            docs = docs[rows[:args.docs]]
+        else:
+            queries = docs[rows[:args.queries]]
+            docs = docs[rows[args.queries:args.queries + args.docs]]
+        if not args.vectors:
+            print("No --vectors or --embed, using synthetic vectors. The numbers say little about the real index")
+    if max(args.dims) > docs.shape[1]:
+        parser.error(f"The vectors only have {docs.shape[1]} dimensions")
+    if args.target == "local" and hnswlib is None:
+        print("hnswlib is not installed, the local target searches exhaustively and ignores m, ef_construction and num_candidates")
+
+    start = time.perf_counter()
+    truth = exact_top_k(docs, queries, args.k)
+    print(f"{len(docs)} documents, {len(queries)} queries of {docs.shape[1]} dimensions, exact top {args.k} in {time.perf_counter() - start:.1f}s")
+
+    target = ElasticTarget(args.keep) if args.target == "es" else LocalTarget(args.threads)
+    rows = []
+    print(f"{'dims':>5} {'type':>10} {'m':>4} {'ef_c':>5} {'cands':>6} {f'R@{args.k}':>7} {'p50 ms':>7} {'p99 ms':>7} {'took ms':>8} {'build s':>8} {'size MB':>8}")
+    for (dim, kind, m, ef_construction) in grid(args):
+        if kind.startswith("bbq") and dim < 64:
+            continue
+        (build_s, size) = target.build(truncate(docs, dim), kind, m, ef_construction)
+        try:
+            for num_candidates in args.num_candidates:
+                if num_candidates < args.k:
+                    continue
+                r = measure(target, truncate(queries, dim), truth, args.k, num_candidates)
+                r.update(dims=dim, type=kind, m=m, ef_construction=ef_construction, num_candidates=num_candidates, build_s=build_s, size_mb=size / 1024**2 if size else None)
+                rows.append(r)
+                took = f"{r['took_p50_ms']:>8.1f}" if r["took_p50_ms"] is not None else f"{'-':>8}"
+                size_mb = f"{r['size_mb']:>8.1f}" if r["size_mb"] is not None else f"{'-':>8}"
+                print(f"{dim:>5} {kind:>10} {m or '-':>4} {ef_construction or '-':>5} {num_candidates:>6} {r['recall']:>7.3f} {r['p50_ms']:>7.2f} {r['p99_ms']:>7.2f} {took} {build_s:>8.1f} {size_mb}")
+                if args.target == "local" and m is None:
+                    break # Exhaustive, num_candidates changes nothing
+        finally:
+            target.delete()
+
+    good = [r for r in rows if r["recall"] >= args.min_recall]
+    if good:
+        best = min(good, key=lambda r: r["p50_ms"])
+        print(f"Fastest setting with R@{args.k} >= {args.min_recall}: dims {best['dims']}, {best['type']}, m {best['m']}, ef_construction {best['ef_construction']}, num_candidates {best['num_candidates']} ({best['recall']:.3f}, p50 {best['p50_ms']:.2f} ms)")
+    else:
+        print(f"No setting reached R@{args.k} >= {args.min_recall}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["dims", "type", "m", "ef_construction", "num_candidates", "recall", "p50_ms", "p99_ms", "took_p50_ms", "build_s", "size_mb"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if (__name__ == "__main__"):
+    main()
@@ -0,0 +1,154 @@
+"""Parity check and micro-benchmark of chunker.chunk_transcript against the old get_transcripts.
+
+Run from the Indexer folder: python benchmarks/bench_chunker.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import TranscriptWords, chunk_transcript
+
+VOCABULARY = ["the", "podcast", "and", "I", "think", "that's", "really", "interesting", "so", "we", "talked", "about", "it", "yeah", "you", "know"]
+
+
+def synthetic_document(word_count, rng, max_result_words=60):
+    """A transcript in the Spotify format with results of random length and increasing word times."""
+    results = []
+    all_words = []
+    time_ms = 0
+    written = 0
+    while written < word_count:
+        n = min(rng.randint(1, max_result_words), word_count - written)
+        words = []
+        for _ in range(n):
+            start = time_ms
+            time_ms += rng.randint(1, 8) * 100
+            words.append({"startTime": f"{start/1000:.3f}s", "endTime": f"{time_ms/1000:.3f}s", "word": rng.choice(VOCABULARY)})
+        transcript = " ".join(w["word"] for w in words)
+        if written != 0 and rng.random() < 0.7:
+            transcript = " " + transcript
+        results.append({"alternatives": [{"transcript": transcript, "confidence": 0.9, "words": words}]})
+        all_words.extend(dict(w, speakerTag=1) for w in words)
+        written += n
+    results.append({"alternatives": [{"words": all_words}]})
+    return {"results": results}
+
+
+def legacy_get_transcripts(document, t_len):
+    """The chunker as it was before chunker.py, kept as the reference for the parity check."""
+    alternatives = document["results"]
+
+    episode_word_count = 0
+    for alt in alternatives:
+        try:
+            episode_word_count += len(alt["alternatives"][0]["transcript"].split())
+        except KeyError:
+            pass
+
+    remainder = 0
+    if(episode_word_count < t_len):
+        t_len = episode_word_count
+    else:
+        extra = (episode_word_count%t_len) // (episode_word_count//t_len)
+        remainder = episode_word_count % (t_len+extra)
+        t_len = t_len+extra
+
+    transcripts = []
+    starttimes = []
+    endtimes = []
+
+    transcriptbuilder_len = 0
+    transcriptbuilder = ""
+    final_t_iterator = 0
+    if(remainder == 0):
+        r = 0
+    else:
+        r = 1
+
+    starttimes.append(float(alternatives[-1]["alternatives"][0]["words"][0]["startTime"][:-1]))
+    for alt in alternatives:
+        try:
+            transcript = alt["alternatives"][0]["transcript"]
+            t_split = transcript.split()
+            transcript_len = len(t_split)
+            if(transcriptbuilder_len + transcript_len <= t_len+r):
+                transcriptbuilder_len += transcript_len
+                if(transcript[0] == " "):
+                    transcriptbuilder += transcript
+                else:
+                    transcriptbuilder += " " + transcript
+            else: # complete new transcript + extra
+                offset = (t_len+r - transcriptbuilder_len)
+                finaltranscript = transcriptbuilder + " " + " ".join(t_split[:offset])
+                endtime = alt["alternatives"][0]["words"][offset-1]["endTime"]
+                transcriptbuilder = " ".join(t_split[offset:]) #reset builder
+                transcriptbuilder_len = len(transcriptbuilder.split())
+                transcripts.append(finaltranscript)
+                endtimes.append(float(endtime[:-1]))
+                starttimes.append(float(endtime[:-1])) #good enough
+                final_t_iterator += 1
+                if(final_t_iterator >= remainder):
+                    r = 0
+
+                while(transcriptbuilder_len > t_len+r):
+                    builderExtraList = transcriptbuilder.split()
+                    transcripts.append(" ".join(builderExtraList[:(t_len+r)])) #extra bit of transcript that was too long
+                    offset = offset+t_len+r
+                    endtime = alt["alternatives"][0]["words"][offset-1]["endTime"]
+                    endtimes.append(float(endtime[:-1]))
+                    starttimes.append(float(endtime[:-1]))
+                    transcriptbuilder = " ".join(builderExtraList[(t_len+r):]) #reset builder
+                    transcriptbuilder_len = len(transcriptbuilder.split())
+                    final_t_iterator += 1
+                    if(final_t_iterator >= remainder):
+                        r = 0
+        except KeyError:
+            pass
+
+    transcripts.append(transcriptbuilder)
+    endtimes.append(float(alternatives[-1]["alternatives"][0]["words"][-1]["endTime"][:-1]))
+
+    return (transcripts, starttimes, endtimes)
+
+
+def new_get_transcripts(document, t_len):
+    return chunk_transcript(TranscriptWords.from_document(document), t_len)
+
+
+def check_parity(documents=500, seed=0):
+    rng = random.Random(seed)
+    for i in range(documents):
+        document = synthetic_document(rng.randint(1, 5000), rng, rng.choice([60, 600]))
+        t_len = rng.choice([5, 17, 50, 125, 250, 1000])
+        expected = legacy_get_transcripts(document, t_len)
+        actual = new_get_transcripts(document, t_len)
+        assert actual == expected, f"Document {i} with t_len {t_len} is chunked differently"
+    print(f"Parity: {documents} synthetic transcripts chunked identically")
+
+
+def benchmark(word_counts=(10_000, 50_000, 200_000), result_lengths=(60, 2_000, 20_000), t_len=125, repeats=3):
+    """Times both chunkers from a loaded document to finished chunks.
+
+    Results up to 60 words are what most Spotify transcripts look like, the old chunker
+    is quadratic in the length of results that are much longer than t_len.
+    """
+    rng = random.Random(1)
+    print(f"{'words':>8} {'result':>8} {'old (ms)':>10} {'new (ms)':>10} {'speedup':>8}")
+    for word_count, max_result_words in [(w, r) for r in result_lengths for w in word_counts]:
+        document = synthetic_document(word_count, rng, max_result_words)
+        timings = []
+        for chunk in (legacy_get_transcripts, new_get_transcripts):
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                chunk(document, t_len)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best * 1000)
+        print(f"{word_count:>8} {max_result_words:>8} {timings[0]:>10.1f} {timings[1]:>10.1f} {timings[0]/timings[1]:>7.1f}x")
+
+
+if (__name__ == "__main__"):
+    check_parity()
+    benchmark()
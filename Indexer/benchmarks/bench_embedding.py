@@ -0,0 +1,131 @@
+"""Latency, throughput, memory and agreement of the embedding backends.
+
+Every backend runs in its own process so the peak RSS of one does not hide another. The
+first backend is the reference, the others are compared to it by the cosine similarity of
+their document vectors and by recall@10 of query -> document search.
+Run from the Indexer folder:
+python benchmarks/bench_embedding.py [--docs 2000] [--backends torch onnx:onnx/model.onnx onnx:onnx/model_quantized.onnx]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_chunker import synthetic_document
+from chunker import TranscriptWords, chunk_transcript
+from transcript_reader import read_transcript
+from transcript_indexer import DOCUMENT_PREFIX
+from embedding_backend import BACKENDS
+from setup import TRANSCRIPT_LENGTH, EMBEDDING_BATCH_SIZE
+
+QUERY_PREFIX = "search_query: "
+
+
+def load_corpus(docs, queries, folder=None, seed=0):
+    """Transcript chunks from a folder of transcript files, or synthetic ones, and queries cut from them."""
+    rng = random.Random(seed)
+    chunks = []
+    if folder is not None:
+        for root, dirs, files in os.walk(folder):
+            for file_name in sorted(files):
+                if file_name.endswith(".json") and len(chunks) < docs:
+                    with open(os.path.join(root, file_name), "rb") as file:
+                        chunks.extend(chunk_transcript(read_transcript(file), TRANSCRIPT_LENGTH)[0])
+    while len(chunks) < docs:
+        chunks.extend(chunk_transcript(TranscriptWords.from_document(synthetic_document(5000, rng)), TRANSCRIPT_LENGTH)[0])
+    chunks = chunks[:docs]
+
+    query_texts = []
+    for _ in range(queries):
+        words = rng.choice(chunks).split()
+        start = rng.randrange(max(1, len(words) - 4))
+        query_texts.append(" ".join(words[start:start + 4]))
+    return chunks, query_texts
+
+
+def run_backend(spec, corpus_path, output_path):
+    with open(corpus_path) as f:
+        corpus = json.load(f)
+    name, _, model_file = spec.partition(":")
+
+    start = time.perf_counter()
+    backend = BACKENDS[name](model_file=model_file) if model_file else BACKENDS[name]()
+    load_s = time.perf_counter() - start
+
+    documents = [DOCUMENT_PREFIX + chunk for chunk in corpus["docs"]]
+    lengths = backend.token_lengths(documents)
+    order = sorted(range(len(documents)), key=lengths.__getitem__)
+    doc_vectors = np.zeros((len(documents), backend.dim), dtype=np.float32)
+    start = time.perf_counter()
+    for i in range(0, len(order), EMBEDDING_BATCH_SIZE):
+        batch = order[i:i + EMBEDDING_BATCH_SIZE]
+        doc_vectors[batch] = backend.encode([documents[j] for j in batch])
+    docs_per_s = len(documents) / (time.perf_counter() - start)
+
+    backend.encode([QUERY_PREFIX + "warm up"])
+    latencies = []
+    query_vectors = []
+    for query in corpus["queries"]:
+        start = time.perf_counter()
+        query_vectors.append(backend.encode([QUERY_PREFIX + query])[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    np.savez(output_path, docs=doc_vectors, queries=np.array(query_vectors))
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({
+        "backend": spec, "load_s": load_s, "docs_per_s": docs_per_s, "peak_rss_mb": peak_rss_mb,
+        "p50_ms": float(np.percentile(latencies, 50)), "p95_ms": float(np.percentile(latencies, 95)),
+    }))
+
+
+def agreement(reference, other, k=10):
+    """Mean and min cosine of the document vectors and recall@k of the other backend's top k."""
+    cosines = (reference["docs"] * other["docs"]).sum(axis=1)
+    expected = np.argsort(-reference["queries"] @ reference["docs"].T, axis=1)[:, :k]
+    actual = np.argsort(-other["queries"] @ other["docs"].T, axis=1)[:, :k]
+    recall = np.mean([len(set(e) & set(a)) / k for e, a in zip(expected.tolist(), actual.tolist())])
+    return float(cosines.mean()), float(cosines.min()), float(recall)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--folder", help="Folder with transcript files, synthetic transcripts are used without one")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx:onnx/model.onnx", "onnx:onnx/model_quantized.onnx"])
+    parser.add_argument("--run", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run is not None:
+        run_backend(*args.run)
+        return
+
+    docs, queries = load_corpus(args.docs, args.queries, args.folder)
+    with tempfile.TemporaryDirectory() as folder:
+        corpus_path = os.path.join(folder, "corpus.json")
+        with open(corpus_path, "w") as f:
+            json.dump({"docs": docs, "queries": queries}, f)
+
+        print(f"{len(docs)} documents, {len(queries)} queries, reference: {args.backends[0]}")
+        print(f"{'backend':>32} {'load s':>7} {'docs/s':>8} {'p50 ms':>7} {'p95 ms':>7} {'RSS MB':>7} {'cos mean':>9} {'cos min':>8} {'R@10':>6}")
+        reference = None
+        for i, spec in enumerate(args.backends):
+            output_path = os.path.join(folder, f"{i}.npz")
+            output = subprocess.run([sys.executable, __file__, "--run", spec, corpus_path, output_path], check=True, capture_output=True, text=True).stdout
+            r = json.loads(output.splitlines()[-1])
+            vectors = np.load(output_path)
+            if reference is None:
+                reference = vectors
+            cos_mean, cos_min, recall = agreement(reference, vectors)
+            print(f"{spec:>32} {r['load_s']:>7.1f} {r['docs_per_s']:>8.1f} {r['p50_ms']:>7.1f} {r['p95_ms']:>7.1f} {r['peak_rss_mb']:>7.0f} {cos_mean:>9.4f} {cos_min:>8.4f} {recall:>6.3f}")
+
+
+if (__name__ == "__main__"):
+    main()
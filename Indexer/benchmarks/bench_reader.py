@@ -0,0 +1,73 @@
+"""Throughput and peak RSS of the transcript readers on a synthetic corpus.
+
+Every reader runs in its own process so the peak RSS of one does not hide another.
+Run from the Indexer folder: python benchmarks/bench_reader.py [--files 200] [--words 8000]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_chunker import synthetic_document, legacy_get_transcripts
+from chunker import chunk_transcript
+from transcript_reader import available_backends, read_transcript
+
+T_LEN = 125
+
+
+def write_corpus(folder, files, words, seed=0):
+    rng = random.Random(seed)
+    for i in range(files):
+        with open(os.path.join(folder, f"episode_{i}.json"), "w") as f:
+            json.dump(synthetic_document(rng.randint(words // 2, words * 3 // 2), rng), f)
+
+
+def run_mode(mode, folder):
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder))
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    chunks = 0
+    start = time.perf_counter()
+    for path in paths:
+        if mode == "legacy":
+            with open(path, "r", encoding="utf-8") as file:
+                transcripts, _, _ = legacy_get_transcripts(json.load(file), T_LEN)
+        else:
+            with open(path, "rb") as file:
+                transcripts, _, _ = chunk_transcript(read_transcript(file, backend=mode), T_LEN)
+        chunks += len(transcripts)
+    elapsed = time.perf_counter() - start
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "files_per_s": len(paths) / elapsed, "mb_per_s": total_bytes / 2**20 / elapsed, "peak_rss_mb": peak_rss_mb, "chunks": chunks}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--words", type=int, default=8000, help="Average words per episode")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--folder", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        run_mode(args.mode, args.folder)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_corpus(folder, args.files, args.words)
+        corpus_mb = sum(os.path.getsize(os.path.join(folder, n)) for n in os.listdir(folder)) / 2**20
+        print(f"Corpus: {args.files} files, {corpus_mb:.1f} MB")
+        print(f"{'reader':>8} {'files/s':>9} {'MB/s':>7} {'peak RSS (MB)':>14} {'chunks':>8}")
+        for mode in ["legacy"] + available_backends():
+            output = subprocess.run([sys.executable, __file__, "--mode", mode, "--folder", folder], check=True, capture_output=True, text=True).stdout
+            r = json.loads(output)
+            print(f"{r['mode']:>8} {r['files_per_s']:>9.1f} {r['mb_per_s']:>7.1f} {r['peak_rss_mb']:>14.1f} {r['chunks']:>8}")
+
+
+if (__name__ == "__main__"):
+    main()
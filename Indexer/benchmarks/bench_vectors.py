@@ -0,0 +1,87 @@
+"""Size and JSON encode/decode cost of vectors as lists, as packed base64 and in a .npy sidecar.
+
+Run from the Indexer folder: python benchmarks/bench_vectors.py
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from setup import MATRYOSHKA_DIM
+from vector_codec import pack_vector, unpack_vector, NpyWriter
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+VOCABULARY = ["the", "podcast", "and", "I", "think", "that's", "really", "interesting", "so", "we", "talked", "about", "it", "yeah", "you", "know"]
+
+
+def synthetic_actions(count, rng, dim=MATRYOSHKA_DIM, t_len=125):
+    vectors = np.random.default_rng(0).standard_normal((count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    actions = []
+    for i in range(count):
+        actions.append({
+            "transcript": " ".join(rng.choice(VOCABULARY) for _ in range(t_len)),
+            "show_id": "show_2tBzZJJbBIyjj8FrjaQJbm",
+            "starttime": 12.3 * i,
+            "endtime": 12.3 * i + 45.6,
+        })
+    return actions, vectors
+
+
+def timed(function, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def check_roundtrip(vectors):
+    for vector in vectors[:100]:
+        assert np.array_equal(unpack_vector(pack_vector(vector)), vector)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "vectors.npy")
+        with NpyWriter(path, vectors.shape[1]) as writer:
+            for vector in vectors:
+                writer.write(vector)
+        assert np.array_equal(np.load(path, mmap_mode="r"), vectors)
+    print("Roundtrip: packed vectors and the .npy sidecar are bit exact")
+
+
+def benchmark(count=20_000):
+    rng = random.Random(0)
+    actions, vectors = synthetic_actions(count, rng)
+    encoders = [("json", lambda doc: json.dumps(doc).encode("utf-8"))]
+    if orjson is not None:
+        encoders.append(("orjson", orjson.dumps))
+
+    print(f"{count} transcript chunks of {MATRYOSHKA_DIM} dims")
+    print(f"{'encoder':>8} {'vector as':>10} {'vector B':>9} {'doc B':>7} {'encode ms':>10} {'decode ms':>10}")
+    for name, dumps in encoders:
+        loads = json.loads if name == "json" else orjson.loads
+        for kind, encode, decode in (("list", lambda v: v.tolist(), lambda v: np.asarray(v, dtype=np.float32)), ("base64", pack_vector, unpack_vector)):
+            vector_bytes = sum(len(dumps(encode(v))) for v in vectors[:1000]) / 1000
+            encode_time, lines = timed(lambda: [dumps(dict(action, vector=encode(vector))) for action, vector in zip(actions, vectors)])
+            decode_time, _ = timed(lambda: [decode(loads(line)["vector"]) for line in lines])
+            doc_bytes = sum(len(line) for line in lines) / count
+            print(f"{name:>8} {kind:>10} {vector_bytes:>9.0f} {doc_bytes:>7.0f} {encode_time*1000:>10.1f} {decode_time*1000:>10.1f}")
+
+    # Backups: the json line without the vector plus one float32 row in the sidecar
+    without_vector = sum(len(json.dumps(action)) for action in actions) / count
+    print(f"backup line with json vector: {without_vector + len(json.dumps(vectors[0].tolist())):.0f} B, "
+          f"json without vector + npy row: {without_vector:.0f} + {vectors.shape[1] * 4} B")
+
+
+if (__name__ == "__main__"):
+    _, vectors = synthetic_actions(100, random.Random(0))
+    check_roundtrip(vectors)
+    benchmark()
@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import helpers, ApiError
+from elastic_transport import ConnectionError, ConnectionTimeout
+
+from setup import BULK_MAX_BYTES, BULK_THREADS, BULK_MAX_RETRIES
+
+
+def is_rejection(status, error):
+    """True for items or requests the cluster turned down because it is overloaded."""
+    if status == 429:
+        return True
+    return isinstance(error, dict) and error.get("type") == "es_rejected_execution_exception"
+
+
+class BulkSink:
+    """Sends bulk requests to Elasticsearch from a pool of background threads.
+
+    Actions are serialized once when they are added and grouped into requests of about
+    max_bytes. At most max_in_flight requests are being sent or waiting at the same time,
+    add blocks while that limit is reached so the producer slows down to the speed of the
+    cluster. Items rejected with 429/EsRejectedExecution and requests that hit a connection
+    error are resent with exponential backoff, all other failed items end up in errors. Items
+    still failing after max_retries end up there with the last status or exception they got.
+    """
+
+    def __init__(self, client, index=None, max_bytes=BULK_MAX_BYTES, threads=BULK_THREADS, max_in_flight=None, max_retries=BULK_MAX_RETRIES, initial_backoff=2, max_backoff=120):
+        self.client = client
+        self.index = index
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.serializer = client.transport.serializers.get_serializer("application/json")
+
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.BoundedSemaphore(max_in_flight or threads * 2)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.errors = []
+        self.sent = 0
+        self.rejections = 0
+
+        # Every request gets a sequence number, checkpoints wait for all requests up to theirs
+        self.next_request = 0
+        self.pending_requests = set()
+        self.failed_requests = set()
+        self.checkpoints = deque()
+        self.checkpoint_start = 0
+
+    def add(self, action, index=None):
+        if index is not None:
+            action = dict(action, _index=index)
+        meta, data = helpers.expand_action(action)
+        item = [self.serializer.dumps(meta)]
+        if data is not None:
+            item.append(self.serializer.dumps(data))
+        self.add_lines(item)
+
+    def add_lines(self, item):
+        """Adds an action that is already serialized, the action line and the source line if it has one."""
+        item_bytes = sum(len(line) + 1 for line in item)
+
+        if len(self.buffer) != 0 and self.buffer_bytes + item_bytes > self.max_bytes:
+            self._submit()
+        self.buffer.append(item)
+        self.buffer_bytes += item_bytes
+
+    def extend(self, actions, index=None):
+        for action in actions:
+            self.add(action, index)
+
+    def checkpoint(self, callback):
+        """Calls callback once every action added before it has been acknowledged by the cluster.
+
+        The callback is skipped if a request holding any action added since the previous
+        checkpoint had failed items, those are reported through errors instead. Callbacks run
+        in the order they were registered, possibly from one of the sender threads.
+        """
+        with self.lock:
+            start = self.checkpoint_start
+            request = self.next_request if len(self.buffer) != 0 else self.next_request - 1
+            self.checkpoint_start = self.next_request
+            self.checkpoints.append((start, request, callback))
+            self._run_checkpoints()
+
+    def take_errors(self):
+        with self.lock:
+            errors = self.errors
+            self.errors = []
+        return errors
+
+    def flush(self):
+        """Sends what is buffered and waits until every request has been acknowledged."""
+        if len(self.buffer) != 0:
+            self._submit()
+        with self.lock:
+            while len(self.pending_requests) != 0:
+                self.idle.wait()
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Requests already being sent are finished so their checkpoints still run
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _lowest_pending(self):
+        if len(self.pending_requests) != 0:
+            return min(self.pending_requests)
+        return self.next_request
+
+    def _submit(self):
+        items = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+
+        self.slots.acquire()
+        with self.lock:
+            request = self.next_request
+            self.next_request += 1
+            self.pending_requests.add(request)
+        self.executor.submit(self._send, request, items)
+
+    def _send(self, request, items):
+        failed = False
+        last_errors = None # What every item in items failed with the last time it was sent
+        try:
+            attempt = 0
+            while len(items) != 0:
+                if attempt > self.max_retries:
+                    failed = True
+                    self._add_errors([{op: dict(info, retries=self.max_retries) for op, info in error.items()} for error in last_errors])
+                    break
+                if attempt > 0:
+                    time.sleep(min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1)))
+                attempt += 1
+
+                try:
+                    response = self.client.bulk(operations=[line for item in items for line in item], index=self.index)
+                except ApiError as e:
+                    if is_rejection(e.status_code, None):
+                        self._count_rejections(len(items))
+                        last_errors = [{"index": {"error": str(e), "status": e.status_code}}] * len(items)
+                        continue
+                    failed = True
+                    self._add_errors([{"index": {"error": str(e), "status": e.status_code}}] * len(items))
+                    break
+                except (ConnectionError, ConnectionTimeout) as e:
+                    last_errors = [{"index": {"error": repr(e)}}] * len(items)
+                    continue
+
+                retry = []
+                retry_errors = []
+                errors = []
+                for item, result in zip(items, response["items"]):
+                    info = next(iter(result.values()))
+                    status = info.get("status", 500)
+                    if 200 <= status < 300:
+                        continue
+                    if is_rejection(status, info.get("error")):
+                        retry.append(item)
+                        retry_errors.append(result)
+                    else:
+                        errors.append(result)
+
+                failed = failed or len(errors) != 0
+                self._add_errors(errors)
+                self._count_rejections(len(retry))
+                with self.lock:
+                    self.sent += len(items) - len(retry) - len(errors)
+                items = retry
+                last_errors = retry_errors
+        except Exception as e:
+            failed = True
+            self._add_errors([{"index": {"error": repr(e)}}] * len(items))
+        finally:
+            self._acknowledge(request, failed)
+
+    def _add_errors(self, errors):
+        if len(errors) != 0:
+            with self.lock:
+                self.errors.extend(errors)
+
+    def _count_rejections(self, count):
+        with self.lock:
+            self.rejections += count
+
+    def _acknowledge(self, request, failed):
+        self.slots.release()
+        with self.lock:
+            self.pending_requests.discard(request)
+            if failed:
+                self.failed_requests.add(request)
+            self._run_checkpoints()
+            self.idle.notify_all()
+
+    def _run_checkpoints(self):
+        lowest = self._lowest_pending()
+        while len(self.checkpoints) != 0 and self.checkpoints[0][1] < lowest:
+            (start, request, callback) = self.checkpoints.popleft()
+            if not any(start <= failed <= request for failed in self.failed_requests):
+                callback()
@@ -0,0 +1,47 @@
+"""Compares analyzer.analyze with the tokens of the standard analyzer of Elasticsearch.
+
+The cases in analyzer_cases.json were written by hand, only after --record do they hold what the
+cluster returned and does a passing check show that analyze agrees with Elasticsearch.
+
+python check_analyzer.py                            checks analyzer_cases.json, no cluster needed
+python check_analyzer.py --record                   records the cases again from the cluster in setup.py
+python check_analyzer.py --record --texts FILE      also records every line of FILE, e.g. top_queries.txt
+"""
+import argparse
+import json
+import sys
+from analyzer import analyze
+
+CASES_FILE = "analyzer_cases.json"
+
+
+def record(texts):
+    from elasticsearch import Elasticsearch
+    from setup import ADDRESS, API_KEY
+    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False)
+    return [{"text": text, "tokens": [t["token"] for t in client.indices.analyze(analyzer="standard", text=text)["tokens"]]} for text in texts]
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument("--texts", help="File with more texts to record, one per line")
+    args = parser.parse_args()
+
+    with open(CASES_FILE, encoding="utf-8") as f:
+        cases = json.load(f)
+    if (args.record):
+        texts = list(dict.fromkeys([case["text"] for case in cases] + ([line.rstrip("\n") for line in open(args.texts, encoding="utf-8")] if args.texts else [])))
+        cases = record(texts)
+        with open(CASES_FILE, "w", encoding="utf-8") as f:
+            json.dump(cases, f, ensure_ascii=False, indent=1)
+        print(f"Recorded {len(cases)} cases")
+
+    failed = 0
+    for case in cases:
+        tokens = analyze(case["text"])
+        if tokens != case["tokens"]:
+            failed += 1
+            print(f"{case['text']!r}\n  expected {case['tokens']}\n  got      {tokens}")
+    print(f"{len(cases) - failed}/{len(cases)} cases match")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,59 @@
+import os
+
+
+class CheckpointJournal:
+    """Append-only journal of finished items, one per line.
+
+    Items should only be recorded once the cluster has acknowledged them, then everything
+    in the journal can be skipped on a restart without asking the cluster. The journal is
+    read into a set once when it is opened so every lookup after that is O(1). A line cut
+    off by a crash is dropped.
+    """
+
+    def __init__(self, path, fsync_every=100):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.done = set()
+        self.unsynced = 0
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                data = f.read()
+            complete = data.rfind(b"\n") + 1
+            if complete != len(data):
+                with open(path, "r+b") as f:
+                    f.truncate(complete)
+            self.done.update(data[:complete].decode("utf-8").splitlines())
+            self.done.discard("")
+
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __contains__(self, item):
+        return item in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def record(self, item):
+        self.record_many((item,))
+
+    def record_many(self, items):
+        for item in items:
+            self.file.write(item + "\n")
+            self.done.add(item)
+        self.file.flush()
+        self.unsynced += len(items)
+        if self.unsynced >= self.fsync_every:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,149 @@
+from array import array
+from operator import itemgetter
+
+_word = itemgetter("word")
+_start_time = itemgetter("startTime")
+_end_time = itemgetter("endTime")
+
+
+def seconds(time_string):
+    """A Spotify time such as "12.300s" in seconds."""
+    return float(time_string[:-1])
+
+
+def _parse_times(time_strings):
+    """Spotify times such as "12.300s" as a float64 array, converted in one go and not one by one."""
+    return array("d", map(float, "".join(time_strings).split("s")[:-1]))
+
+
+class TranscriptWords:
+    """The parts of a Spotify transcript the chunker needs, stored as flat arrays.
+
+    texts holds the transcript string of every result that has one. words, starts and ends hold
+    the word, start time and end time of every word of those results one after another, the
+    times as float64 arrays in seconds. words[offsets[i]:offsets[i+1]] are the words of texts[i].
+    start and end are the first start time and last end time of the last result, which repeats
+    every word of the episode and is not kept.
+    """
+
+    __slots__ = ("texts", "words", "starts", "ends", "offsets", "start", "end")
+
+    def __init__(self, texts, words, starts, ends, offsets, start, end):
+        self.texts = texts
+        self.words = words
+        self.starts = starts
+        self.ends = ends
+        self.offsets = offsets
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def from_results(cls, results):
+        """From the results of a transcript in order, an iterator works so they can be streamed."""
+        texts = []
+        words = []
+        starts = []
+        ends = []
+        offsets = array("q", [0])
+        last_words = None
+        for result in results:
+            try:
+                alternative = result["alternatives"][0]
+            except KeyError:
+                continue
+            last_words = alternative.get("words", ())
+            text = alternative.get("transcript")
+            if text is None:
+                continue
+            # Only these three fields of every word are kept, the dicts are dropped with the result
+            words.extend(map(_word, last_words))
+            starts.extend(map(_start_time, last_words))
+            ends.extend(map(_end_time, last_words))
+            texts.append(text)
+            offsets.append(len(words))
+
+        return cls(texts, words, _parse_times(starts), _parse_times(ends), offsets, seconds(last_words[0]["startTime"]), seconds(last_words[-1]["endTime"]))
+
+    @classmethod
+    def from_document(cls, document):
+        return cls.from_results(document["results"])
+
+
+def chunk_transcript(transcript: TranscriptWords, t_len: int):
+    """Splits a transcript into chunks of about t_len words in a single pass over its words.
+
+    The word count of the episode is spread evenly over the chunks, the first (word_count % t_len)
+    chunks get one word extra. Returns (transcripts, starttimes, endtimes), a chunk starts where
+    the previous one ended.
+    """
+    texts = transcript.texts
+    ends = transcript.ends
+    offsets = transcript.offsets
+    tokens_per_text = [text.split() for text in texts]
+
+    episode_word_count = sum(len(tokens) for tokens in tokens_per_text)
+    remainder = 0
+    if(episode_word_count < t_len):
+        t_len = episode_word_count
+    else:
+        extra = (episode_word_count%t_len) // (episode_word_count//t_len)
+        remainder = episode_word_count % (t_len+extra)
+        t_len = t_len+extra
+    r = 0 if remainder == 0 else 1
+
+    transcripts = []
+    starttimes = [transcript.start]
+    endtimes = []
+
+    # The chunk being built is kept as a list of pieces and only joined once it is complete
+    pieces = []
+    builder_len = 0
+    final_t_iterator = 0
+
+    for i, (text, tokens) in enumerate(zip(texts, tokens_per_text)):
+        transcript_len = len(tokens)
+        if(builder_len + transcript_len <= t_len+r):
+            pieces.append(text if text[:1] == " " else " " + text)
+            builder_len += transcript_len
+            continue
+
+        first_word = offsets[i]
+        word_count = offsets[i+1] - first_word
+        if(word_count == 0):
+            continue # No word times to end the chunk with, the result is skipped
+
+        offset = t_len+r - builder_len
+        if(offset > word_count):
+            raise IndexError(f"Chunk ends at word {offset} but the result only has {word_count} words")
+        pieces.append(" ")
+        pieces.append(" ".join(tokens[:offset]))
+        transcripts.append("".join(pieces))
+        # A chunk that was already full when this result started ends with the result's last word
+        endtime = ends[first_word+offset-1] if offset > 0 else ends[first_word+word_count-1]
+        endtimes.append(endtime)
+        starttimes.append(endtime)
+        final_t_iterator += 1
+        if(final_t_iterator >= remainder):
+            r = 0
+
+        while(transcript_len - offset > t_len+r):
+            if(offset+t_len+r > word_count):
+                raise IndexError(f"Chunk ends at word {offset+t_len+r} but the result only has {word_count} words")
+            transcripts.append(" ".join(tokens[offset:offset+t_len+r]))
+            offset = offset+t_len+r
+            endtime = ends[first_word+offset-1]
+            endtimes.append(endtime)
+            starttimes.append(endtime)
+            final_t_iterator += 1
+            if(final_t_iterator >= remainder):
+                r = 0
+
+        pieces = [" ".join(tokens[offset:])]
+        builder_len = transcript_len - offset
+
+    transcripts.append("".join(pieces))
+    endtimes.append(transcript.end)
+
+    assert all((len(transcripts) == len(endtimes), len(transcripts) == len(starttimes))), f"Transcripts, endtimes and starttimes are not the same length! {len(transcripts)} {len(endtimes)} {len(starttimes)}"
+
+    return (transcripts, starttimes, endtimes)
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+
+from setup import EMBEDDING_MODEL, MATRYOSHKA_DIM, EMBEDDING_BACKEND, ONNX_MODEL_FILE
+
+# The libraries of a backend are imported when it is made, so a process that gets its vectors
+# from SearchGUI/embedding_server.py or uses the onnx backend never loads PyTorch.
+
+MAX_TOKENS = 8192 # Context length of nomic-embed-text-v1.5
+
+
+def postprocess(embeddings, dim):
+    """Layer norm, Matryoshka truncation to dim and L2 normalization, like the PyTorch path."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    mean = embeddings.mean(axis=-1, keepdims=True)
+    var = embeddings.var(axis=-1, keepdims=True)
+    embeddings = (embeddings - mean) / np.sqrt(var + 1e-5)
+    embeddings = embeddings[..., :dim]
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class TorchBackend:
+    """The model through SentenceTransformer and PyTorch in fp32."""
+
+    def __init__(self, model_name=EMBEDDING_MODEL, dim=MATRYOSHKA_DIM, threads=None):
+        try:
+            import torch
+            import torch.nn.functional as F
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("The torch backend needs torch and sentence_transformers")
+        self.F = F
+        if threads is not None:
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, trust_remote_code=True)
+        self.dim = dim
+        # Vectors of this backend are what the embedding cache was filled with first
+        self.cache_name = model_name
+
+    def token_lengths(self, texts):
+        return [len(ids) for ids in self.model.tokenizer(texts, add_special_tokens=False)["input_ids"]]
+
+    def encode(self, texts):
+        """Returns a float32 array with one normalized vector of dim values per text."""
+        embeddings = self.model.encode(texts, batch_size=len(texts), convert_to_tensor=True)
+        embeddings = self.F.layer_norm(embeddings, normalized_shape=(embeddings.shape[1],))
+        embeddings = embeddings[:, :self.dim]
+        return self.F.normalize(embeddings, p=2, dim=1).cpu().numpy()
+
+
+class OnnxBackend:
+    """The model exported to ONNX and run by onnxruntime on the CPU, no PyTorch needed.
+
+    model_file is a local .onnx file (see export_onnx.py) or a file in the model's repository,
+    the repository has onnx/model.onnx in fp32 and onnx/model_quantized.onnx with int8 weights.
+    Tokens are mean pooled the same way as the SentenceTransformer pooling layer.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, dim=MATRYOSHKA_DIM, threads=None, model_file=ONNX_MODEL_FILE):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+            from huggingface_hub import hf_hub_download
+        except ImportError:
+            raise ImportError("The onnx backend needs onnxruntime, tokenizers and huggingface_hub")
+        path = model_file if os.path.exists(model_file) else hf_hub_download(model_name, model_file)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_pretrained(model_name)
+        self.tokenizer.enable_truncation(MAX_TOKENS)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0)
+        self.dim = dim
+        self.cache_name = model_name + "@" + os.path.basename(model_file)
+
+    def token_lengths(self, texts):
+        return [sum(encoding.attention_mask) for encoding in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def encode(self, texts):
+        """Returns a float32 array with one normalized vector of dim values per text."""
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        tokens = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        embeddings = (tokens * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return postprocess(embeddings, self.dim)
+
+
+BACKENDS = {"torch": TorchBackend, "onnx": OnnxBackend}
+
+
+def load_embedding_backend(name=EMBEDDING_BACKEND, threads=None):
+    if name not in BACKENDS:
+        raise ValueError(f"{name} is not an embedding backend, use one of {list(BACKENDS)}")
+    return BACKENDS[name](threads=threads)
@@ -0,0 +1,193 @@
+import hashlib
+import os
+from array import array
+import numpy as np
+
+KEY_BYTES = 16
+MERGE_EVERY = 200_000 # New keys are merged into the sorted key array this often
+
+
+def cache_key(model_name, prefix, text, dim):
+    """Content address of an embedding, a 16 byte hash of everything the vector depends on."""
+    h = hashlib.blake2b(digest_size=KEY_BYTES)
+    for part in (model_name, prefix, text, str(dim)):
+        data = part.encode("utf-8")
+        h.update(len(data).to_bytes(4, "little"))
+        h.update(data)
+    return h.digest()
+
+
+class EmbeddingCache:
+    """Append-only on-disk cache of embeddings keyed by cache_key.
+
+    The cache folder holds one shard per writer: <name>.keys with the 16 byte keys and
+    <name>.vecs with float32 vectors in the same order. Every shard in the folder is
+    memory-mapped for reading but only the shard called name is appended to, so several
+    embedding workers can share one folder. When the own shard grows past max_bytes the
+    least recently used vectors are dropped from it.
+    """
+
+    def __init__(self, folder, name, dim, max_bytes):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.name = name
+        self.dim = dim
+        self.row_bytes = dim * 4
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._load()
+
+    def _path(self, name, extension):
+        return os.path.join(self.folder, name + extension)
+
+    def _load(self):
+        names = sorted(f[:-len(".keys")] for f in os.listdir(self.folder) if f.endswith(".keys"))
+        if self.name not in names:
+            names.append(self.name)
+        self.shard_names = names
+        self.own_shard = names.index(self.name)
+
+        all_keys = []
+        all_shards = []
+        all_rows = []
+        self.vectors = []
+        for shard, name in enumerate(names):
+            keys_path = self._path(name, ".keys")
+            vecs_path = self._path(name, ".vecs")
+            keys = np.fromfile(keys_path, dtype=f"S{KEY_BYTES}") if os.path.exists(keys_path) else np.empty(0, dtype=f"S{KEY_BYTES}")
+            vec_rows = os.path.getsize(vecs_path) // self.row_bytes if os.path.exists(vecs_path) else 0
+            # A writer that crashed can leave a key without its vector, such rows are ignored
+            rows = min(len(keys), vec_rows)
+            keys = keys[:rows]
+            if shard == self.own_shard:
+                self._truncate(rows)
+            self.vectors.append(np.memmap(vecs_path, dtype="<f4", mode="r", shape=(rows, self.dim)) if rows != 0 else None)
+            all_keys.append(keys)
+            all_shards.append(np.full(rows, shard, dtype=np.int32))
+            all_rows.append(np.arange(rows, dtype=np.int64))
+
+        self._set_index(np.concatenate(all_keys), np.concatenate(all_shards), np.concatenate(all_rows))
+        self.own_rows = len(all_keys[self.own_shard])
+        self.mapped_rows = self.own_rows
+        # Older rows count as less recently used, rows used during this run get newer stamps
+        self.last_used = array("q", range(self.own_rows))
+        self.clock = self.own_rows
+
+        self.keys_file = open(self._path(self.name, ".keys"), "ab")
+        self.vecs_file = open(self._path(self.name, ".vecs"), "ab")
+
+    def _truncate(self, rows):
+        for extension, row_bytes in ((".keys", KEY_BYTES), (".vecs", self.row_bytes)):
+            path = self._path(self.name, extension)
+            if os.path.exists(path) and os.path.getsize(path) != rows * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * row_bytes)
+
+    def _set_index(self, keys, shards, rows):
+        order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[order]
+        self.sorted_shards = shards[order]
+        self.sorted_rows = rows[order]
+        self.recent = {}
+
+    def _merge_recent(self):
+        keys = np.array(list(self.recent.keys()), dtype=f"S{KEY_BYTES}")
+        rows = np.array(list(self.recent.values()), dtype=np.int64)
+        shards = np.full(len(rows), self.own_shard, dtype=np.int32)
+        self._set_index(np.concatenate((self.sorted_keys, keys)), np.concatenate((self.sorted_shards, shards)), np.concatenate((self.sorted_rows, rows)))
+
+    def _find(self, keys):
+        """Returns (shard, row) of every key, shard is -1 for keys that are not cached."""
+        shards = np.full(len(keys), -1, dtype=np.int32)
+        rows = np.zeros(len(keys), dtype=np.int64)
+        if len(self.sorted_keys) != 0:
+            lookup = np.array(keys, dtype=f"S{KEY_BYTES}")
+            positions = np.minimum(np.searchsorted(self.sorted_keys, lookup), len(self.sorted_keys) - 1)
+            found = self.sorted_keys[positions] == lookup
+            shards[found] = self.sorted_shards[positions[found]]
+            rows[found] = self.sorted_rows[positions[found]]
+        for i, key in enumerate(keys):
+            if shards[i] == -1 and key in self.recent:
+                shards[i] = self.own_shard
+                rows[i] = self.recent[key]
+        return shards, rows
+
+    def get_many(self, keys):
+        """Returns a list with the cached vector of every key, or None where there is none."""
+        shards, rows = self._find(keys)
+        if len(rows) != 0 and (shards == self.own_shard).any() and rows[shards == self.own_shard].max() >= self.mapped_rows:
+            self._remap_own()
+
+        vectors = []
+        for shard, row in zip(shards.tolist(), rows.tolist()):
+            if shard == -1:
+                self.misses += 1
+                vectors.append(None)
+                continue
+            self.hits += 1
+            if shard == self.own_shard:
+                self.last_used[row] = self.clock
+                self.clock += 1
+            vectors.append(np.array(self.vectors[shard][row]))
+        return vectors
+
+    def put_many(self, keys, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        shards, _ = self._find(keys)
+        for key, shard, vector in zip(keys, shards.tolist(), vectors):
+            if shard != -1 or key in self.recent:
+                continue
+            # The vector is written before its key so a crash never leaves a key without a vector
+            self.vecs_file.write(vector.tobytes())
+            self.keys_file.write(key)
+            self.recent[key] = self.own_rows
+            self.last_used.append(self.clock)
+            self.clock += 1
+            self.own_rows += 1
+
+        if len(self.recent) >= MERGE_EVERY:
+            self._merge_recent()
+        if self.own_rows * self.row_bytes > self.max_bytes:
+            self._evict()
+
+    def _remap_own(self):
+        self.vecs_file.flush()
+        self.keys_file.flush()
+        self.vectors[self.own_shard] = np.memmap(self._path(self.name, ".vecs"), dtype="<f4", mode="r", shape=(self.own_rows, self.dim))
+        self.mapped_rows = self.own_rows
+
+    def _evict(self):
+        """Rewrites the own shard with the most recently used vectors that fit in 3/4 of max_bytes."""
+        self._remap_own()
+        keep_rows = int(self.max_bytes * 0.75) // self.row_bytes
+        last_used = np.frombuffer(self.last_used, dtype=np.int64)
+        keep = np.sort(np.argsort(last_used)[-keep_rows:]) if keep_rows > 0 else np.empty(0, dtype=np.int64)
+
+        keys = np.fromfile(self._path(self.name, ".keys"), dtype=f"S{KEY_BYTES}")
+        vectors = self.vectors[self.own_shard]
+        for extension, data in ((".keys", keys), (".vecs", vectors)):
+            with open(self._path(self.name, extension + ".tmp"), "wb") as f:
+                for start in range(0, len(keep), 100_000):
+                    f.write(np.ascontiguousarray(data[keep[start:start + 100_000]]).tobytes())
+
+        self.evicted += self.own_rows - len(keep)
+        new_last_used = last_used[keep]
+        self.keys_file.close()
+        self.vecs_file.close()
+        self.vectors = []
+        for extension in (".keys", ".vecs"):
+            os.replace(self._path(self.name, extension + ".tmp"), self._path(self.name, extension))
+
+        clock = self.clock
+        self._load()
+        self.last_used = array("q", new_last_used.tolist())
+        self.clock = clock
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evicted": self.evicted}
+
+    def close(self):
+        self.keys_file.close()
+        self.vecs_file.close()
@@ -0,0 +1,21 @@
+import argparse
+import os
+from huggingface_hub import hf_hub_download
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+from setup import EMBEDDING_MODEL
+
+# Makes an int8 copy of the fp32 ONNX export of the embedding model with dynamic quantization.
+# The model repository already has onnx/model_quantized.onnx, this is for quantizing with other
+# settings, point ONNX_MODEL_FILE in setup.py to the output to use it.
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default="nomic_embed_int8.onnx")
+    parser.add_argument("--source", default="onnx/model.onnx", help="fp32 model in the model repository or a local file")
+    parser.add_argument("--per-channel", action="store_true", help="One scale per output channel, slower to quantize but closer to fp32")
+    args = parser.parse_args()
+
+    source = args.source if os.path.exists(args.source) else hf_hub_download(EMBEDDING_MODEL, args.source)
+    quantize_dynamic(source, args.output, per_channel=args.per_channel, weight_type=QuantType.QInt8)
+    print(f"Wrote {args.output}")
@@ -0,0 +1,53 @@
+import argparse
+import gzip
+import os
+from collections import Counter
+from multiprocessing import Pool
+from tqdm import tqdm
+
+from setup import DATASET_FOLDER, TRANSCRIPT_LENGTH, PARSE_WORKERS, VOCABULARY_FILE, VOCABULARY_MIN_DF
+from transcript_reader import read_transcript
+from chunker import chunk_transcript
+from analyzer import analyze
+
+# Writes the term dictionary of the transcript index with the document frequency of every term,
+# as gzipped "term<TAB>df" lines with the most frequent terms first. The documents are the same
+# chunks index_dataset.py indexes and the terms are the tokens of the standard analyzer, so df is
+# what the transcript field has. SearchGUI/spelling.py corrects queries against it.
+
+
+def file_frequencies(path):
+    """Document frequencies of the words in the chunks of one transcript file."""
+    with open(path, "rb") as file:
+        chunks = chunk_transcript(read_transcript(file), TRANSCRIPT_LENGTH)[0]
+    df = Counter()
+    for chunk in chunks:
+        df.update(set(analyze(chunk)))
+    return df
+
+
+def export_vocabulary(folder, output, min_df=VOCABULARY_MIN_DF, workers=PARSE_WORKERS):
+    transcript_folder = os.path.join(folder, "podcasts-transcripts")
+    paths = [os.path.join(root, file_name) for root, dirs, files in os.walk(transcript_folder) for file_name in files if file_name.endswith(".json")]
+    df = Counter()
+    with Pool(workers) as pool:
+        for file_df in tqdm(pool.imap_unordered(file_frequencies, paths, chunksize=16), total=len(paths), desc="Counting terms"):
+            df.update(file_df)
+
+    # Terms that hardly occur are mostly transcription errors, they should not be suggested
+    terms = sorted(((term, count) for term, count in df.items() if count >= min_df), key=lambda t: (-t[1], t[0]))
+    with gzip.open(output + ".tmp", "wt", encoding="utf-8") as f:
+        for term, count in terms:
+            f.write(f"{term}\t{count}\n")
+    os.replace(output + ".tmp", output)
+    print(f"Wrote {len(terms)} of {len(df)} terms to {output}")
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folder", default=DATASET_FOLDER)
+    parser.add_argument("--output", default=VOCABULARY_FILE)
+    parser.add_argument("--min-df", type=int, default=VOCABULARY_MIN_DF)
+    parser.add_argument("--workers", type=int, default=PARSE_WORKERS)
+    args = parser.parse_args()
+    export_vocabulary(args.folder, args.output, args.min_df, args.workers)
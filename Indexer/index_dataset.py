@@ -1,174 +1,171 @@
-import json
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import Elasticsearch
 import os
-import xml.etree.ElementTree as ET
-from xml.etree.ElementTree import ParseError
-import pandas as pd
 import warnings
 from urllib3.exceptions import InsecureRequestWarning
-from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
-from elastic_transport import ConnectionTimeout
-import time
 
-from setup import ADDRESS, API_KEY, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS, DATASET_FOLDER, TRANSCRIPT_LENGTH, transcript_mappings, shows_mappings, episodes_mappings
-from transcript_indexer import get_transcript_actions
+from setup import ADDRESS, API_KEY, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS, DATASET_FOLDER, TRANSCRIPT_LENGTH, MATRYOSHKA_DIM, EMBEDDING_CACHE_FOLDER, EMBEDDING_CACHE_MAX_BYTES, CHECKPOINT_FILE, BUILD_STATE_FILE, OFFLINE_SHARD_FOLDER, PARSE_WORKERS, EMBED_WORKERS, QUEUE_DEPTH, EMBED_BUFFER
+from transcript_indexer import get_transcript_actions, embed_actions
+from metadata_store import load_metadata
+from rss_extract import load_show_feeds, ShowFeeds, SHOW_FEEDS_CACHE_NAME
+from pipeline import run_pipeline
+from bulk_sink import BulkSink
+from shard_writer import ShardWriter
+from embedding_cache import EmbeddingCache
+from embedding_backend import load_embedding_backend
+from checkpoint import CheckpointJournal
+from index_versions import start_builds, finish_builds
 
 # Filter out the specific warning about insecure HTTPS requests
 warnings.filterwarnings("ignore", category=InsecureRequestWarning)
 
 def index_transcripts_with_metadata_from_folder(folder_path, index_name, episode_index_name, show_index_name, transcript_length):
     transcript_file_path = os.path.join(folder_path, "podcasts-transcripts")
-    metadata_file_path = os.path.join(folder_path, "metadata.tsv")
-    
-    metadata_df = pd.read_csv(metadata_file_path, delimiter='\t', dtype="string")
-    
-    actions = []
-    actions_episodes = []
-    actions_shows = []
 
-    model = SentenceTransformer("nomic-ai/nomic-embed-text-v1.5", trust_remote_code=True)
+    # Build or refresh the metadata and show feed pickles once here so the workers only have to load them
+    load_show_feeds(folder_path, load_metadata(folder_path))
     
-    num_actions_cached = 2000 # will not be exactly N actions, but at least N
-
-    file_count = sum(len(files) for _, _, files in os.walk(transcript_file_path)) # Inefficient but only once so ok
-    with tqdm(total=file_count, desc="Indexing files") as tqdm_bar:
-        with tqdm(total=num_actions_cached*2, desc="Actions in buffer") as tqdm_buffer_bar:
-            for root, dirs, files in os.walk(transcript_file_path):
-                for file_name in files:
+    # Files in the journal have already been acknowledged by the cluster (or written to a shard) and are skipped
+    checkpoint_file = CHECKPOINT_FILE
+    if OFFLINE_SHARD_FOLDER is not None:
+        # The journal is opened before the ShardWriter that would make the folder
+        os.makedirs(OFFLINE_SHARD_FOLDER, exist_ok=True)
+        checkpoint_file = os.path.join(OFFLINE_SHARD_FOLDER, CHECKPOINT_FILE)
+    with CheckpointJournal(checkpoint_file) as journal:
+        print(f"{len(journal)} files already indexed according to {checkpoint_file}")
+
+        file_count = sum(1 for _, _, files in os.walk(transcript_file_path) for file_name in files if file_name.endswith('.json') and os.path.splitext(file_name)[0] not in journal) # Inefficient but only once so ok
+        tasks = ((root, file_name) for root, dirs, files in os.walk(transcript_file_path) for file_name in files if file_name.endswith('.json') and os.path.splitext(file_name)[0] not in journal)
+        parse_stage = (init_parse_worker, (folder_path, transcript_length), parse_file)
+        embed_stage = (init_embed_worker, (EMBED_WORKERS,), embed_files, count_file_actions, finish_embed_worker)
+        cache_stats = []
+        failed = False
+
+        with open_sink() as sink:
+            with tqdm(total=file_count, desc="Indexing files") as tqdm_bar:
+                for (episode_filename, new_actions, new_actions_episodes, new_actions_shows) in run_pipeline(tasks, parse_stage, embed_stage, PARSE_WORKERS, EMBED_WORKERS, QUEUE_DEPTH, EMBED_BUFFER, summaries=cache_stats):
                     tqdm_bar.update(1)
 
-                    if file_name.endswith('.json'):
-                        (new_actions, new_actions_episodes, new_actions_shows) = index_file(root, file_name, metadata_df, model, index_name, episode_index_name, show_index_name, transcript_length)
-                        
-                        tqdm_buffer_bar.update(len(new_actions))
-                        actions.extend(new_actions)
-                        actions_episodes.extend(new_actions_episodes)
-                        actions_shows.extend(new_actions_shows)
-
-                        #Submit all together
-                        if (len(actions) >= num_actions_cached):
-                            try:
-                                tqdm_buffer_bar.write(f"Sending to server! {len(actions)} actions")
-                                r1 = helpers.bulk(client, actions, index=index_name, stats_only=False)
-                                actions = []
-                                r2 = helpers.bulk(client, actions_episodes, index=episode_index_name, stats_only=False)
-                                actions_episodes = []
-                                r3 = helpers.bulk(client, actions_shows, index=show_index_name, stats_only=False)
-                                actions_shows = []
-
-                                tqdm_buffer_bar.reset()
-
-                                if (len(r1[1]) > 0 or len(r2[1]) > 0 or len(r3[1]) > 0):
-                                    tqdm_buffer_bar.write("Something went wrong indexing")
-                                    log_errors("Error sending to server: " + str(r1[1]))
-                                    log_errors("Error sending to server: " + str(r2[1]))
-                                    log_errors("Error sending to server: " + str(r3[1]))
-
-                            except KeyError:
-                                pass
-
-    if (len(actions) != 0):
-        try:
-            print("Emptying buffers!")
-            r1 = helpers.bulk(client, actions, index=index_name, stats_only=False)
-            r2 = helpers.bulk(client, actions_episodes, index=episode_index_name, stats_only=False)
-            r3 = helpers.bulk(client, actions_shows, index=show_index_name, stats_only=False)
-
-            if (len(r1[1]) > 0 or len(r2[1]) > 0 or len(r3[1]) > 0):
+                    sink.extend(new_actions, index=index_name)
+                    sink.extend(new_actions_episodes, index=episode_index_name)
+                    sink.extend(new_actions_shows, index=show_index_name)
+                    sink.checkpoint(lambda episode_filename=episode_filename: journal.record(episode_filename))
+
+                    errors = sink.take_errors()
+                    if (len(errors) > 0):
+                        failed = True
+                        tqdm_bar.write("Something went wrong indexing")
+                        log_errors("Error sending to server: " + str(errors))
+
+                    tqdm_bar.set_postfix(sent=sink.sent, rejected=sink.rejections)
+
+                print("Emptying buffers!")
+                sink.flush()
+
+            errors = sink.take_errors()
+            if (len(errors) > 0):
+                failed = True
                 print("Something went wrong indexing")
-                log_errors("Error sending to server: " + str(r1[1]))
-                log_errors("Error sending to server: " + str(r2[1]))
-                log_errors("Error sending to server: " + str(r3[1]))
-        except KeyError:
-            pass
+                log_errors("Error sending to server: " + str(errors))
 
-    print("DONE!")
-    return True
+    cache_stats = [stats for stats in cache_stats if stats is not None]
+    if (len(cache_stats) > 0):
+        hits = sum(stats["hits"] for stats in cache_stats)
+        misses = sum(stats["misses"] for stats in cache_stats)
+        evicted = sum(stats["evicted"] for stats in cache_stats)
+        print(f"Embedding cache: {hits} hits, {misses} misses ({hits / max(1, hits + misses):.1%} hit rate), {evicted} evicted")
 
-def index_file(root, file_name, metadata_df, model, transcript_index_name, episode_index_name, show_index_name, transcript_length):
-    ## TODO: Add the code from fix_show_links.py to include links to podcast and audio
-    ## This was not included here because this was added after indexing of the data
+    print("DONE!")
+    # Files that failed are not in the journal, running again sends them to the same build
+    return not failed
+
+def open_sink():
+    if OFFLINE_SHARD_FOLDER is not None:
+        return ShardWriter(OFFLINE_SHARD_FOLDER)
+    return BulkSink(client)
+
+def init_parse_worker(folder_path, transcript_length):
+    # Shows this worker has already sent, a show can still be sent once by every worker
+    indexed_shows = set()
+    # The parent made sure show_rss.pkl is up to date, every worker checking the feeds again would stat all of them
+    show_feeds = ShowFeeds.load(os.path.join(folder_path, SHOW_FEEDS_CACHE_NAME))
+    return (load_metadata(folder_path), show_feeds, indexed_shows, transcript_length)
+
+def parse_file(state, task):
+    (metadata, show_feeds, indexed_shows, transcript_length) = state
+    (root, file_name) = task
+    return index_file(root, file_name, metadata, show_feeds, indexed_shows, transcript_length)
+
+def init_embed_worker(embed_workers, worker_number):
+    # Share the cores between the embedding workers instead of every worker using all of them
+    model = load_embedding_backend(threads=max(1, (os.cpu_count() or 1) // embed_workers))
+    cache = None
+    if EMBEDDING_CACHE_FOLDER is not None:
+        cache = EmbeddingCache(EMBEDDING_CACHE_FOLDER, f"worker_{worker_number}", MATRYOSHKA_DIM, EMBEDDING_CACHE_MAX_BYTES)
+    return (model, cache)
+
+def embed_files(state, results):
+    (model, cache) = state
+    embed_actions(model, [action for (_, actions, _, _) in results for action in actions], cache=cache)
+    return results
+
+def finish_embed_worker(state):
+    (model, cache) = state
+    if cache is None:
+        return None
+    cache.close()
+    return cache.stats()
+
+def count_file_actions(result):
+    return len(result[1])
+
+def index_file(root, file_name, metadata, show_feeds, indexed_shows, transcript_length):
     actions = []
     actions_episodes = []
     actions_shows = []
     file_path = os.path.join(root, file_name)
-    with open(file_path, 'r', encoding='utf-8') as file:
+    with open(file_path, 'rb') as file:
         #Index episodes and shows
         episode_filename = os.path.splitext(file_name)[0]
-        episode_row = metadata_df[metadata_df['episode_filename_prefix'] == episode_filename]
-        showID = episode_row["show_filename_prefix"].item()
-
-        if (not client.exists(index=episode_index_name, id=episode_filename).body):
-            # We have already indexed this file        
-            episode = {
-                "_id": episode_filename,
-                "episode_name": episode_row["episode_name"].item(),
-                "episode_description": episode_row["episode_description"].item(),
-                "show": showID
-            }
-            actions_episodes.append(episode)
+        episode_row = metadata.get_episode(episode_filename)
+        showID = episode_row["show_filename_prefix"]
+
+        episode = {
+            "_id": episode_filename,
+            "episode_name": episode_row["episode_name"],
+            "episode_description": episode_row["episode_description"],
+            "show": showID,
+            "audio_link": show_feeds.get_audio_link(showID, episode_row["episode_name"])
+        }
+        actions_episodes.append(episode)
 
         #avoid duplicates (possibly not needed)
-        if (not client.exists(index=show_index_name, id=showID).body):
-            #ugly but should work (get image and podcast link)
-            #assuming "correct" directory names
-            pathlist = file_path.replace("/", os.path.sep).split(os.path.sep)[:-1]
-            pathlist[-4] = "show-rss"
-            show_rss_path = os.path.sep.join(pathlist) + ".xml"
-
-            try:
-                tree = ET.parse(show_rss_path)
-                xmlroot = tree.getroot()
-                imageurl = xmlroot[0].find('.//image')
-                if (imageurl is None):
-                    imageurl = ""
-                    print(f"No imageurl found for: {show_rss_path}")
-                    log_errors(f"No imageurl found for: {show_rss_path}")
-                else:
-                    imageurl = imageurl[0].text
-                link = xmlroot[0].find('.//link')
-                if (link is None):
-                    link = ""
-                    print(f"No link found for: {show_rss_path}")
-                    log_errors(f"No link found for: {show_rss_path}")
-                else:
-                    link = link.text
-            except ParseError as e:
-                print(f"Parse error at: {show_rss_path}, skipping adding data to show")
-                print(e)
-                log_errors(f"Parse error at: {show_rss_path}, skipping adding data to show")
-                imageurl = ""
-                link = ""
-
+        if (showID not in indexed_shows):
+            indexed_shows.add(showID)
+            feed = show_feeds.get_show(showID)
             show = {
                 "_id": showID,
-                "show_name": episode_row["show_name"].item(),
-                "show_description": episode_row["show_description"].item(),
-                "publisher": episode_row["publisher"].item(),
-                "image": imageurl,
-                "link": link
+                "show_name": episode_row["show_name"],
+                "show_description": episode_row["show_description"],
+                "publisher": episode_row["publisher"],
+                "image": feed["image"],
+                "link": feed["link"],
+                "pod_link": feed["pod_link"]
             }
             actions_shows.append(show)
 
         #Index transcripts
-        if (not client.exists(index=transcript_index_name, id=episode_filename + "_0").body):
-            actions = get_transcript_actions(file=file, model=model, episode_filename=episode_filename, showID=showID, transcript_length=transcript_length)
-
-    return (actions, actions_episodes, actions_shows)
+        actions = get_transcript_actions(file=file, episode_filename=episode_filename, showID=showID, transcript_length=transcript_length)
 
-def create_index(index_name, mappings):
-    if client.indices.exists(index=index_name):
-        print(f"Index: {index_name} already exists!")
-        r = input("You sure you want to continue [Y/N]?")
-        if (r.lower() != "y"):
-            exit(1)
-        return
-
-    # Create the index
-    client.indices.create(index=index_name, mappings=mappings)
-    print(f"Index '{index_name}' created successfully.")
+    return (episode_filename, actions, actions_episodes, actions_shows)
 
+def start_index_builds(client, state_file, checkpoint_file):
+    """start_builds, and the checkpoint journal is put aside when the builds are new."""
+    (builds, created) = start_builds(client, state_file)
+    if (created and os.path.exists(checkpoint_file)):
+        # The journal belongs to an earlier build, a new build needs every file again
+        os.replace(checkpoint_file, checkpoint_file + ".old")
+    return builds
 
 def log_errors(error):
     with open("logs.txt", "a") as f:
@@ -178,30 +175,24 @@ if (__name__ == "__main__"):
     # Initialize Elasticsearch client
     client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False)
 
-    # Create index
-    create_index(INDEX_TRANSCRIPTS, transcript_mappings)
-    create_index(INDEX_EPISODES, episodes_mappings)
-    create_index(INDEX_SHOWS, shows_mappings)
+    # Index into new versions of the indices and swap the aliases when done, in offline mode load_shards.py does this instead
+    if (OFFLINE_SHARD_FOLDER is None):
+        builds = start_index_builds(client, BUILD_STATE_FILE, CHECKPOINT_FILE)
+    else:
+        builds = {INDEX_TRANSCRIPTS: INDEX_TRANSCRIPTS, INDEX_EPISODES: INDEX_EPISODES, INDEX_SHOWS: INDEX_SHOWS}
+        print("Writing bulk shards to: " + OFFLINE_SHARD_FOLDER)
 
     # Index the entire dataset
     print("Indexing folder: " + DATASET_FOLDER)
 
-    attempts = 0
-    success = False
-    finished = False
-    while attempts < 5 and not success:
-        try:
-            finished = index_transcripts_with_metadata_from_folder(DATASET_FOLDER, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS, TRANSCRIPT_LENGTH)
-            success = True
-        except ConnectionTimeout as e:
-            print("Connection timed out! Retrying in 60 seconds...")
-            client.close()
-            time.sleep(60)
-            client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False)
-            attempts += 1
+    # Connection errors and timeouts are retried by the sink, documents that still fail make finished False
+    finished = index_transcripts_with_metadata_from_folder(DATASET_FOLDER, builds[INDEX_TRANSCRIPTS], builds[INDEX_EPISODES], builds[INDEX_SHOWS], TRANSCRIPT_LENGTH)
 
     if (finished):
         print("Completed indexing without any major errors!")
+        if (OFFLINE_SHARD_FOLDER is None):
+            finish_builds(client, BUILD_STATE_FILE)
+            os.replace(CHECKPOINT_FILE, CHECKPOINT_FILE + ".old")
     else:
         print("Something went wrong during indexing...")
         log_errors("Something went wrong during indexing...")
\ No newline at end of file
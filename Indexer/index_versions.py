@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import re
+import numpy as np
+from elasticsearch import Elasticsearch
+
+from setup import ADDRESS, API_KEY, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS, LIVE_REPLICAS, LIVE_REFRESH_INTERVAL, KEEP_VERSIONS, transcript_mappings, shows_mappings, episodes_mappings
+
+# Indices are built as <alias>_v<n> and searched through the alias <alias>. A build is created
+# with refresh off and no replicas, loaded, then finished (settings restored, force merged,
+# vectors warmed up) and swapped in atomically. Older versions are kept for rollback.
+#
+#   python index_versions.py list                          every alias with its versions
+#   python index_versions.py rollback podcast_transcripts  point the alias at the version before
+#   python index_versions.py prune podcast_transcripts     delete all but KEEP_VERSIONS versions
+#   python index_versions.py adopt podcast_transcripts     move an old fixed name index to _v1
+
+MAPPINGS = {INDEX_TRANSCRIPTS: transcript_mappings, INDEX_EPISODES: episodes_mappings, INDEX_SHOWS: shows_mappings}
+BUILD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+WARMUP_QUERIES = 50
+
+
+def versioned_name(alias, version):
+    return f"{alias}_v{version}"
+
+
+def list_versions(client, alias):
+    """Versions of an alias as [(version, index)], oldest first."""
+    pattern = re.compile(re.escape(alias) + r"_v(\d+)$")
+    indices = client.indices.get(index=f"{alias}_v*", ignore_unavailable=True, allow_no_indices=True)
+    return sorted((int(match.group(1)), index) for index in indices for match in [pattern.match(index)] if match)
+
+
+def live_index(client, alias):
+    """The index the alias points at, or None."""
+    if not client.indices.exists_alias(name=alias):
+        return None
+    return next(iter(client.indices.get_alias(name=alias)))
+
+
+def create_build(client, alias, mappings):
+    """Creates the next version of alias with bulk load settings and returns its name."""
+    versions = list_versions(client, alias)
+    index = versioned_name(alias, versions[-1][0] + 1 if len(versions) != 0 else 1)
+    client.indices.create(index=index, mappings=mappings, settings=BUILD_SETTINGS)
+    print(f"Index '{index}' created for building {alias}.")
+    return index
+
+
+def finish_build(client, index, replicas=LIVE_REPLICAS, refresh_interval=LIVE_REFRESH_INTERVAL):
+    """Makes a loaded build ready for searching, this can take a long time for big indices."""
+    client.indices.put_settings(index=index, settings={"refresh_interval": refresh_interval, "number_of_replicas": replicas})
+    client.indices.refresh(index=index)
+    print(f"Force merging {index}...")
+    client.options(request_timeout=6 * 3600).indices.forcemerge(index=index, max_num_segments=1)
+    client.options(request_timeout=3600).cluster.health(index=index, wait_for_status="green" if replicas > 0 else "yellow", timeout="1h")
+    warm_up(client, index)
+
+
+def warm_up(client, index, queries=WARMUP_QUERIES):
+    """Runs knn searches with random vectors so the HNSW graphs are read into memory before users come."""
+    mappings = next(iter(client.indices.get_mapping(index=index).values()))["mappings"]
+    rng = np.random.default_rng(0)
+    for field, spec in mappings.get("properties", {}).items():
+        if spec.get("type") != "dense_vector":
+            continue
+        for _ in range(queries):
+            vector = rng.standard_normal(spec["dims"])
+            vector /= np.linalg.norm(vector)
+            client.search(index=index, knn={"field": field, "query_vector": vector.tolist(), "k": 10, "num_candidates": 100}, source=False)
+        print(f"Warmed up {index}.{field} with {queries} searches")
+
+
+def swap_aliases(client, targets):
+    """Points every alias in targets ({alias: index}) at its index and away from all others, in one atomic update."""
+    actions = []
+    for alias, index in targets.items():
+        if client.indices.exists(index=alias) and not client.indices.exists_alias(name=alias):
+            raise RuntimeError(f"{alias} is an index, not an alias. Run: python index_versions.py adopt {alias}")
+        if client.indices.exists_alias(name=alias):
+            actions.extend({"remove": {"index": old, "alias": alias}} for old in client.indices.get_alias(name=alias))
+        actions.append({"add": {"index": index, "alias": alias}})
+    client.indices.update_aliases(actions=actions)
+    for alias, index in targets.items():
+        print(f"{alias} -> {index}")
+
+
+def swap_alias(client, alias, index):
+    swap_aliases(client, {alias: index})
+
+
+def rollback(client, alias):
+    versions = [index for _, index in list_versions(client, alias)]
+    live = live_index(client, alias)
+    if live not in versions or versions.index(live) == 0:
+        raise RuntimeError(f"No version of {alias} before {live}")
+    swap_alias(client, alias, versions[versions.index(live) - 1])
+
+
+def prune(client, alias, keep=KEEP_VERSIONS):
+    """Deletes the oldest versions of alias, never the live one or anything newer than it."""
+    versions = [index for _, index in list_versions(client, alias)]
+    live = live_index(client, alias)
+    for index in versions[:max(0, len(versions) - keep)]:
+        if index == live or (live in versions and versions.index(index) > versions.index(live)):
+            continue
+        client.indices.delete(index=index)
+        print(f"Deleted {index}")
+
+
+def adopt(client, alias):
+    """Turns an index called alias into alias_v1 behind an alias of the same name."""
+    if not client.indices.exists(index=alias) or client.indices.exists_alias(name=alias):
+        raise RuntimeError(f"{alias} is not an index that can be adopted")
+    index = versioned_name(alias, 1)
+    r = input(f"This clones {alias} into {index} and then DELETES {alias}. Continue [Y/N]?")
+    if (r.lower() != "y"):
+        exit(1)
+    client.indices.put_settings(index=alias, settings={"index.blocks.write": True})
+    client.options(request_timeout=6 * 3600).indices.clone(index=alias, target=index, wait_for_active_shards="1")
+    client.indices.put_settings(index=index, settings={"index.blocks.write": None})
+    client.indices.delete(index=alias)
+    swap_alias(client, alias, index)
+
+
+def start_builds(client, state_file, aliases=MAPPINGS):
+    """Creates a build for every alias, or continues the unfinished builds listed in state_file.
+
+    Returns ({alias: build index}, created), created is True when new builds were created because
+    there was no state file or the indices it lists are gone. Journals of what was loaded into
+    the builds before then belong to other indices and have to be started again.
+    """
+    for alias in aliases:
+        if client.indices.exists(index=alias) and not client.indices.exists_alias(name=alias):
+            raise RuntimeError(f"{alias} is an index, not an alias. Run: python index_versions.py adopt {alias}")
+
+    if os.path.exists(state_file):
+        with open(state_file) as f:
+            builds = json.load(f)
+        if all(client.indices.exists(index=index) for index in builds.values()):
+            print("Continuing builds: " + ", ".join(builds.values()))
+            return (builds, False)
+        print(f"The builds in {state_file} are gone, starting new ones")
+
+    builds = {alias: create_build(client, alias, mappings) for alias, mappings in aliases.items()}
+    with open(state_file, "w") as f:
+        json.dump(builds, f)
+    return (builds, True)
+
+
+def finish_builds(client, state_file):
+    """Finishes the builds in state_file and swaps them in."""
+    with open(state_file) as f:
+        builds = json.load(f)
+    for index in builds.values():
+        finish_build(client, index)
+    swap_aliases(client, builds)
+    os.remove(state_file)
+    return builds
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["list", "rollback", "prune", "adopt", "finish", "swap"])
+    parser.add_argument("alias", nargs="?")
+    parser.add_argument("index", nargs="?", help="Index to finish or swap in")
+    args = parser.parse_args()
+
+    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=120)
+    if (args.command == "list"):
+        for alias in ([args.alias] if args.alias else MAPPINGS):
+            live = live_index(client, alias)
+            print(alias + ": " + ", ".join(index + (" (live)" if index == live else "") for _, index in list_versions(client, alias)))
+    elif (args.alias is None):
+        parser.error(f"{args.command} needs an alias")
+    elif (args.command == "rollback"):
+        rollback(client, args.alias)
+    elif (args.command == "prune"):
+        prune(client, args.alias)
+    elif (args.command == "adopt"):
+        adopt(client, args.alias)
+    elif (args.index is None):
+        parser.error(f"{args.command} needs an index")
+    elif (args.command == "finish"):
+        finish_build(client, args.index)
+        swap_alias(client, args.alias, args.index)
+    elif (args.command == "swap"):
+        swap_alias(client, args.alias, args.index)
@@ -0,0 +1,115 @@
+import argparse
+import gzip
+import json
+import os
+import time
+from multiprocessing import Pool
+from elasticsearch import Elasticsearch
+from tqdm import tqdm
+
+from setup import ADDRESS, API_KEY, INDEX_TRANSCRIPTS, INDEX_EPISODES, INDEX_SHOWS, OFFLINE_SHARD_FOLDER, LOAD_WORKERS, transcript_mappings, shows_mappings, episodes_mappings
+from bulk_sink import BulkSink
+from shard_writer import list_shards
+from checkpoint import CheckpointJournal
+from index_versions import start_builds, finish_builds
+
+LOADED_SHARDS_FILE = "loaded_shards.txt"
+LOAD_BUILD_FILE = "load_build.json"
+
+client = None
+
+
+def init_worker():
+    global client
+    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=120)
+
+
+def read_shard(path, targets=None):
+    """Yields the actions of a shard as lists of lines, without parsing the documents.
+
+    targets maps index names in the shard to the index they should be sent to instead.
+    """
+    with gzip.open(path, "rb") as f:
+        lines = iter(f)
+        for line in lines:
+            item = [line.rstrip(b"\n")]
+            meta = json.loads(item[0])
+            (op, info) = next(iter(meta.items()))
+            if targets is not None and info.get("_index") in targets:
+                info["_index"] = targets[info["_index"]]
+                item[0] = json.dumps(meta).encode("utf-8")
+            if op != "delete":
+                item.append(next(lines).rstrip(b"\n"))
+            yield item
+
+
+def load_shard(task):
+    """Sends one shard, returns (name, sent, rejections, errors)."""
+    (path, targets) = task
+    with BulkSink(client) as sink:
+        for item in read_shard(path, targets):
+            sink.add_lines(item)
+        sink.flush()
+        return (os.path.basename(path), sink.sent, sink.rejections, sink.take_errors())
+
+
+def create_index(index_name, mappings):
+    if not client.indices.exists(index=index_name):
+        client.indices.create(index=index_name, mappings=mappings)
+        print(f"Index '{index_name}' created successfully.")
+
+
+def log_errors(error):
+    with open("logs.txt", "a") as f:
+        f.write(error + "\n\n")
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description="Sends the bulk shards written by index_dataset.py in offline mode to the cluster.")
+    parser.add_argument("folder", nargs="?", default=OFFLINE_SHARD_FOLDER)
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS)
+    parser.add_argument("--build", action="store_true", help="Load into new versions of the indices and swap the aliases when everything is loaded")
+    args = parser.parse_args()
+    if (args.folder is None):
+        parser.error("no shard folder given and OFFLINE_SHARD_FOLDER is not set")
+
+    init_worker()
+    targets = None
+    journal_file = LOADED_SHARDS_FILE
+    if (args.build):
+        (targets, _) = start_builds(client, os.path.join(args.folder, LOAD_BUILD_FILE))
+        journal_file = f"loaded_shards.{targets[INDEX_TRANSCRIPTS]}.txt"
+    else:
+        create_index(INDEX_TRANSCRIPTS, transcript_mappings)
+        create_index(INDEX_EPISODES, episodes_mappings)
+        create_index(INDEX_SHOWS, shows_mappings)
+
+    # Shards are only recorded when every action in them was accepted, loading again is safe since every action has an _id
+    with CheckpointJournal(os.path.join(args.folder, journal_file), fsync_every=1) as journal:
+        shards = [(os.path.join(args.folder, shard), targets) for shard in list_shards(args.folder) if shard not in journal]
+        print(f"{len(journal)} shards already loaded, {len(shards)} to go")
+
+        start = time.time()
+        sent = 0
+        rejected = 0
+        failed = 0
+        with Pool(args.workers, initializer=init_worker) as pool:
+            with tqdm(total=len(shards), desc="Loading shards") as tqdm_bar:
+                for (shard, shard_sent, rejections, errors) in pool.imap_unordered(load_shard, shards):
+                    tqdm_bar.update(1)
+                    sent += shard_sent
+                    rejected += rejections
+                    if (len(errors) > 0):
+                        failed += 1
+                        tqdm_bar.write(f"Something went wrong loading {shard}")
+                        log_errors(f"Error sending {shard} to server: " + str(errors))
+                    else:
+                        journal.record(shard)
+                    tqdm_bar.set_postfix(docs_per_s=int(sent / max(1e-9, time.time() - start)), rejected=rejected)
+
+    if (failed > 0):
+        print(f"{failed} shards had errors, run again to retry them")
+    else:
+        print(f"Loaded {sent} actions")
+        if (args.build):
+            finish_builds(client, os.path.join(args.folder, LOAD_BUILD_FILE))
@@ -0,0 +1,89 @@
+import os
+import pickle
+import pandas as pd
+
+# Only the columns the indexer actually uses are kept in the store
+METADATA_COLUMNS = [
+    "show_filename_prefix",
+    "episode_filename_prefix",
+    "show_name",
+    "show_description",
+    "publisher",
+    "episode_name",
+    "episode_description",
+]
+METADATA_CACHE_NAME = "metadata.pkl"
+
+
+class MetadataStore:
+    """Column oriented copy of metadata.tsv with O(1) lookups by episode and show.
+
+    Every column is stored as a plain list where row i belongs to the same episode,
+    episode_rows maps episode_filename_prefix -> row and show_rows maps
+    show_filename_prefix -> list of rows of that show.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.episode_rows = {}
+        self.show_rows = {}
+        for row, (episode, show) in enumerate(zip(columns["episode_filename_prefix"], columns["show_filename_prefix"])):
+            self.episode_rows[episode] = row
+            self.show_rows.setdefault(show, []).append(row)
+
+    def __len__(self):
+        return len(self.episode_rows)
+
+    def __contains__(self, episode_filename):
+        return episode_filename in self.episode_rows
+
+    def get_value(self, row, column):
+        return self.columns[column][row]
+
+    def get_episode(self, episode_filename):
+        """Returns the metadata row of an episode as a dict, raises KeyError if it is missing."""
+        row = self.episode_rows[episode_filename]
+        return {column: values[row] for column, values in self.columns.items()}
+
+    def get_show_episodes(self, show_id):
+        """Returns the episode_filename_prefix of every episode in a show."""
+        episodes = self.columns["episode_filename_prefix"]
+        return [episodes[row] for row in self.show_rows.get(show_id, [])]
+
+    def shows(self):
+        return self.show_rows.keys()
+
+    @classmethod
+    def from_tsv(cls, metadata_file_path):
+        metadata_df = pd.read_csv(metadata_file_path, delimiter='\t', dtype="string", usecols=METADATA_COLUMNS)
+        # Missing values become None instead of pd.NA so the store can be pickled without pandas types
+        columns = {column: [None if pd.isna(v) else v for v in metadata_df[column].tolist()] for column in METADATA_COLUMNS}
+        return cls(columns)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.columns, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+
+def load_metadata(folder_path):
+    """Loads the metadata store of a dataset folder.
+
+    The first call parses metadata.tsv and pickles the result next to it, later calls
+    load the pickle unless metadata.tsv has been modified since.
+    """
+    metadata_file_path = os.path.join(folder_path, "metadata.tsv")
+    cache_path = os.path.join(folder_path, METADATA_CACHE_NAME)
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(metadata_file_path):
+        return MetadataStore.load(cache_path)
+
+    store = MetadataStore.from_tsv(metadata_file_path)
+    store.save(cache_path)
+    return store
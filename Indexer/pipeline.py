@@ -0,0 +1,148 @@
+import multiprocessing as mp
+import pickle
+import queue
+import threading
+import traceback
+
+STOP = None
+# How long the main process waits for a result before it checks that the workers are still alive
+POLL_SECONDS = 5
+
+
+class WorkerSummary:
+    """Sent by an embed worker when it finishes, holds what the stage's finish function returned."""
+
+    def __init__(self, summary):
+        self.summary = summary
+
+
+class WorkerFailure:
+    """Sent through the queues when a worker crashes so the main process can re-raise the error."""
+
+    def __init__(self, error):
+        if not isinstance(error, Exception):
+            # exit() in a worker must fail the run and not exit the main process quietly
+            error = RuntimeError(f"Worker stopped with {error!r}")
+        try:
+            pickle.dumps(error)
+            self.error = error
+        except Exception:
+            self.error = RuntimeError(traceback.format_exc())
+
+
+def _parse_worker(initializer, initargs, parse, task_queue, result_queue):
+    try:
+        state = initializer(*initargs)
+        for task in iter(task_queue.get, STOP):
+            result_queue.put(parse(state, task))
+    except BaseException as e:
+        # BaseException so that exit() or KeyboardInterrupt in a worker is reported and not just lost
+        traceback.print_exc()
+        result_queue.put(WorkerFailure(e))
+
+
+def _embed_worker(initializer, initargs, embed, size, finish, batch_size, result_queue, output_queue):
+    try:
+        state = initializer(*initargs)
+        batch = []
+        batch_items = 0
+        for result in iter(result_queue.get, STOP):
+            if isinstance(result, WorkerFailure):
+                output_queue.put(result)
+                continue
+
+            batch.append(result)
+            batch_items += size(result)
+            if batch_items >= batch_size:
+                for embedded in embed(state, batch):
+                    output_queue.put(embedded)
+                batch = []
+                batch_items = 0
+
+        if len(batch) != 0:
+            for embedded in embed(state, batch):
+                output_queue.put(embedded)
+        output_queue.put(WorkerSummary(finish(state)))
+    except BaseException as e:
+        traceback.print_exc()
+        output_queue.put(WorkerFailure(e))
+    output_queue.put(STOP)
+
+
+def _feed(tasks, task_queue, result_queue, parse_processes, embed_workers):
+    for task in tasks:
+        task_queue.put(task)
+    for _ in parse_processes:
+        task_queue.put(STOP)
+    for p in parse_processes:
+        p.join()
+    for _ in range(embed_workers):
+        result_queue.put(STOP)
+
+
+def _check_workers(processes, stage):
+    for p in processes:
+        if p.exitcode is not None and p.exitcode != 0:
+            raise RuntimeError(f"A {stage} worker died with exit code {p.exitcode} without reporting an error")
+
+
+def run_pipeline(tasks, parse_stage, embed_stage, parse_workers, embed_workers, queue_depth, batch_size, summaries=None):
+    """Runs tasks through a parse stage and an embed stage and yields the results in the main process.
+
+    parse_stage is (initializer, initargs, parse) where parse(state, task) returns one result,
+    embed_stage is (initializer, initargs, embed, size, finish) where embed(state, results) returns
+    the embedded results and size(result) is how much a result adds towards batch_size. The embed
+    initializer gets the number of its worker as an extra last argument and what finish(state)
+    returns when a worker is done is appended to summaries. Every function must be defined at
+    module level so it can be sent to the worker processes. Results are yielded in the order
+    they finish, not in the order of tasks.
+
+    An error in a worker is raised again in the main process, and so is a worker that dies without
+    reporting anything (killed, out of memory), so a run never ends normally with tasks missing.
+    """
+    task_queue = mp.Queue(maxsize=queue_depth)
+    result_queue = mp.Queue(maxsize=queue_depth)
+    output_queue = mp.Queue(maxsize=queue_depth)
+
+    parse_initializer, parse_initargs, parse = parse_stage
+    embed_initializer, embed_initargs, embed, size, finish = embed_stage
+
+    parse_processes = [
+        mp.Process(target=_parse_worker, args=(parse_initializer, parse_initargs, parse, task_queue, result_queue), daemon=True)
+        for _ in range(parse_workers)
+    ]
+    embed_processes = [
+        mp.Process(target=_embed_worker, args=(embed_initializer, embed_initargs + (i,), embed, size, finish, batch_size, result_queue, output_queue), daemon=True)
+        for i in range(embed_workers)
+    ]
+    for p in parse_processes + embed_processes:
+        p.start()
+
+    feeder = threading.Thread(target=_feed, args=(tasks, task_queue, result_queue, parse_processes, embed_workers), daemon=True)
+    feeder.start()
+
+    try:
+        running = embed_workers
+        while running > 0:
+            try:
+                result = output_queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                _check_workers(parse_processes, "parse")
+                _check_workers(embed_processes, "embed")
+                continue
+            if result is STOP:
+                running -= 1
+            elif isinstance(result, WorkerFailure):
+                raise result.error
+            elif isinstance(result, WorkerSummary):
+                if summaries is not None:
+                    summaries.append(result.summary)
+            else:
+                yield result
+        # The feeder joins the parse workers before it stops the embed workers, so a parse worker
+        # that died silently has an exit code by now even though the embed stage ended normally
+        _check_workers(parse_processes, "parse")
+    finally:
+        for p in parse_processes + embed_processes:
+            if p.is_alive():
+                p.terminate()
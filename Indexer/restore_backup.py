@@ -0,0 +1,213 @@
+import argparse
+import gzip
+import importlib
+import json
+import multiprocessing as mp
+import os
+import time
+from queue import Empty
+import numpy as np
+from elasticsearch import Elasticsearch
+from tqdm import tqdm
+
+from setup import ADDRESS, API_KEY, BACKUP_FOLDER, RESTORE_WORKERS
+from bulk_sink import BulkSink
+from throttle import AdaptiveThrottle
+from vector_codec import encode_vector
+from backup_indicies import MANIFEST_NAME, sha256_file
+from index_versions import start_builds, finish_builds
+
+# Restores or replays a backup made by backup_indicies.py. Every slice is sent by one worker
+# process through its own BulkSink. Progress is kept per slice as the number of lines sent,
+# written only after everything before it was accepted, so a restart continues where the last
+# one stopped. A gzip stream can not be entered in the middle, the restart seeks to the member
+# of the slice its line is in. Backups made before slices were written in members are read
+# from the start again, skipping the lines that were sent.
+#
+# --transform module:function changes what is sent. The function gets {"_id", "_source"} with
+# the vectors put back in _source and returns a bulk action or None to skip the document, e.g.
+# the old vector -> new_vector migration: --transform old_tools.reindex_vector:to_new_vector
+
+CHECKPOINT_EVERY = 1000 # Documents between two progress checkpoints and throttle checks
+RESTORE_BUILD_FILE = "restore_build.json"
+
+client = None
+progress = None
+
+
+def restore_document(doc):
+    """The default transform, indexes the document as it was."""
+    return dict(doc["_source"], _id=doc["_id"])
+
+
+def load_transform(spec):
+    if spec is None:
+        return restore_document
+    module, _, function = spec.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def progress_path(folder, index, slice_file, target):
+    return os.path.join(folder, index, f"{slice_file}.restore_{target}")
+
+
+def read_progress(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        # Older progress files start with a byte offset that is not used anymore
+        return int(f.read().split()[-1])
+
+
+def write_progress(path, lines):
+    with open(path + ".tmp", "w") as f:
+        f.write(f"{lines}")
+    os.replace(path + ".tmp", path)
+
+
+def read_lines(path, members, first_line):
+    """The lines of a slice file from first_line on, decompressing from the member it is in."""
+    (offset, line_number) = (0, 0)
+    for member in members:
+        if member[1] > first_line:
+            break
+        (offset, line_number) = member
+    with open(path, "rb") as raw:
+        raw.seek(offset)
+        with gzip.GzipFile(fileobj=raw, mode="rb") as f:
+            for line in f:
+                if line_number >= first_line:
+                    yield line
+                line_number += 1
+
+
+def init_worker(progress_queue):
+    global client, progress
+    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=120)
+    progress = progress_queue
+
+
+def restore_slice(task):
+    """Sends one slice from its last checkpoint, returns (slice file, documents sent, seconds paused, errors)."""
+    (folder, index, target, entry, transform_spec) = task
+    transform = load_transform(transform_spec)
+    path = progress_path(folder, index, entry["file"], target)
+    lines = read_progress(path)
+    start_lines = lines
+    reported = 0
+    vectors = {field: np.load(os.path.join(folder, index, spec["file"]), mmap_mode="r") for field, spec in entry.get("vectors", {}).items()}
+
+    with BulkSink(client, index=target) as sink:
+        throttle = AdaptiveThrottle(client, sink)
+
+        def checkpoint(lines):
+            # Progress is a watermark, once something failed it must not move past it
+            if len(sink.failed_requests) == 0:
+                write_progress(path, lines)
+
+        sent = 0
+        for line in read_lines(os.path.join(folder, index, entry["file"]), entry.get("members", []), lines):
+            doc = json.loads(line)
+            for field, rows in vectors.items():
+                vector = rows[lines]
+                if not np.isnan(vector).any():
+                    doc["_source"][field] = encode_vector(vector)
+            lines += 1
+
+            action = transform(doc)
+            if action is not None:
+                sink.add(action)
+                sent += 1
+
+            if lines % CHECKPOINT_EVERY == 0:
+                sink.checkpoint(lambda lines=lines: checkpoint(lines))
+                progress.put(lines - start_lines - reported)
+                reported = lines - start_lines
+                throttle.wait()
+
+        sink.checkpoint(lambda lines=lines: checkpoint(lines))
+        sink.flush()
+        progress.put(lines - start_lines - reported)
+        return (entry["file"], sent, throttle.paused, sink.take_errors())
+
+
+def restore_index(folder, index, manifest_entry, target, transform, workers, verify):
+    if (verify):
+        for entry in manifest_entry["slices"]:
+            files = [(entry["file"], entry["sha256"])] + [(spec["file"], spec["sha256"]) for spec in entry.get("vectors", {}).values()]
+            for file_name, checksum in files:
+                if sha256_file(os.path.join(folder, index, file_name)) != checksum:
+                    raise RuntimeError(f"Checksum of {os.path.join(folder, index, file_name)} does not match the manifest")
+
+    if not client.indices.exists(index=target):
+        client.indices.create(index=target, mappings=manifest_entry["mappings"])
+        print(f"Index '{target}' created successfully.")
+
+    done = sum(read_progress(progress_path(folder, index, entry["file"], target)) for entry in manifest_entry["slices"])
+    tasks = [(folder, index, target, entry, transform) for entry in manifest_entry["slices"]]
+    progress_queue = mp.Queue()
+    start = time.time()
+    with mp.Pool(workers, initializer=init_worker, initargs=(progress_queue,)) as pool:
+        results = pool.map_async(restore_slice, tasks, chunksize=1)
+        with tqdm(total=manifest_entry["count"], initial=done, desc=f"Restoring {index} to {target}", unit="docs") as tqdm_bar:
+            while not results.ready() or not progress_queue.empty():
+                try:
+                    tqdm_bar.update(progress_queue.get(timeout=1))
+                except Empty:
+                    pass
+                tqdm_bar.set_postfix(docs_per_s=int((tqdm_bar.n - done) / max(1e-9, time.time() - start)))
+
+    failed = 0
+    for (slice_file, sent, paused, errors) in results.get():
+        if (len(errors) > 0):
+            failed += 1
+            log_errors(f"Error restoring {index}/{slice_file} to {target}: " + str(errors))
+        if (paused > 0):
+            print(f"{slice_file}: throttled for {paused:.0f}s")
+    return failed
+
+
+def log_errors(error):
+    with open("logs.txt", "a") as f:
+        f.write(error + "\n\n")
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("indices", nargs="*", help="Indices of the backup to restore, all of them by default")
+    parser.add_argument("--folder", default=BACKUP_FOLDER)
+    parser.add_argument("--target", help="Index to restore into, only with a single index. Defaults to the backed up name")
+    parser.add_argument("--transform", help="module:function applied to every document")
+    parser.add_argument("--workers", type=int, default=RESTORE_WORKERS)
+    parser.add_argument("--restart", action="store_true", help="Ignore earlier progress and send everything again")
+    parser.add_argument("--verify", action="store_true", help="Check the sha256 of every file before restoring")
+    parser.add_argument("--build", action="store_true", help="Restore into new versions behind aliases named like the backed up indices and swap them in when done")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.folder, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    indices = args.indices or list(manifest["indices"])
+    if (args.target is not None and (len(indices) != 1 or args.build)):
+        parser.error("--target needs exactly one index and no --build")
+
+    client = Elasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, request_timeout=120)
+    builds = None
+    if (args.build):
+        (builds, _) = start_builds(client, os.path.join(args.folder, RESTORE_BUILD_FILE), {index: manifest["indices"][index]["mappings"] for index in indices})
+
+    failed = 0
+    for index in indices:
+        target = args.target or (builds[index] if builds is not None else index)
+        if (args.restart):
+            for entry in manifest["indices"][index]["slices"]:
+                path = progress_path(args.folder, index, entry["file"], target)
+                if os.path.exists(path):
+                    os.remove(path)
+        failed += restore_index(args.folder, index, manifest["indices"][index], target, args.transform, args.workers, args.verify)
+
+    if (failed > 0):
+        print(f"{failed} slices had errors, see logs.txt. Run again to continue from the last accepted document")
+    else:
+        print("Restore finished")
+        if (args.build):
+            finish_builds(client, os.path.join(args.folder, RESTORE_BUILD_FILE))
@@ -0,0 +1,175 @@
+import os
+import pickle
+import xml.etree.ElementTree as ET
+from xml.etree.ElementTree import ParseError
+from multiprocessing import Pool
+from tqdm import tqdm
+
+from setup import DATASET_FOLDER, PARSE_WORKERS
+from metadata_store import load_metadata
+
+SHOW_FEEDS_CACHE_NAME = "show_rss.pkl"
+
+
+def parse_feed(rss_path):
+    """Reads image, link, pod_link and the item title -> enclosure url map from one RSS feed.
+
+    The feed is parsed incrementally and every item is thrown away once it has been read.
+    Picks the same elements as the old tree based code: the first <image> (its first child
+    holds the url), the first <link>, the first <item><link> cut to the show page and the
+    <item>s directly in <channel>. Raises ParseError for broken feeds.
+    """
+    image = None
+    link = None
+    pod_link = None
+    audio_links = {}
+
+    path = []
+    for event, elem in ET.iterparse(rss_path, events=("start", "end")):
+        if event == "start":
+            path.append(elem.tag)
+            continue
+        path.pop()
+
+        if elem.tag == "image" and image is None and len(elem) != 0:
+            image = elem[0].text
+        elif elem.tag == "link":
+            if link is None:
+                link = elem.text
+            if pod_link is None and len(path) != 0 and path[-1] == "item" and elem.text is not None:
+                pod_link = "/".join(elem.text.split("/")[:4])
+        elif elem.tag == "item" and len(path) == 2:
+            enclosure = elem.find("enclosure")
+            if enclosure is not None and "url" in enclosure.attrib:
+                audio_links[elem.findtext("title")] = enclosure.attrib["url"]
+            elem.clear()
+
+    return (image, link, pod_link, audio_links)
+
+
+def _extract_show(task):
+    (show_id, rss_path, episode_names) = task
+    try:
+        (image, link, pod_link, audio_links) = parse_feed(rss_path)
+    except (ParseError, OSError) as e:
+        return (show_id, None, f"Parse error at: {rss_path}, skipping adding data to show\n{e}")
+    # Only the titles of episodes in the dataset are kept, feeds list far more items than that
+    audio_links = {title: url for title, url in audio_links.items() if title in episode_names}
+    return (show_id, (image, link, pod_link, audio_links), None)
+
+
+class ShowFeeds:
+    """What the indexer needs from every show's RSS feed, keyed by show_filename_prefix.
+
+    Shows without a feed or with a broken one are missing, their links read as "".
+    """
+
+    def __init__(self, shows):
+        self.shows = shows
+
+    def __len__(self):
+        return len(self.shows)
+
+    def __contains__(self, show_id):
+        return show_id in self.shows
+
+    def get_show(self, show_id):
+        """Returns the image, link and pod_link of a show as a dict."""
+        (image, link, pod_link, _) = self.shows.get(show_id, (None, None, None, None))
+        return {"image": image or "", "link": link or "", "pod_link": pod_link or ""}
+
+    def get_audio_link(self, show_id, episode_name):
+        feed = self.shows.get(show_id)
+        if feed is None:
+            return ""
+        return feed[3].get(episode_name) or ""
+
+    @classmethod
+    def extract(cls, folder_path, metadata, workers=PARSE_WORKERS):
+        """Parses the feed of every show in metadata once, in parallel."""
+        rss_folder = os.path.join(folder_path, "show-rss")
+        rss_paths = {}
+        for root, dirs, files in os.walk(rss_folder):
+            for file_name in files:
+                if file_name.endswith(".xml"):
+                    rss_paths[os.path.splitext(file_name)[0]] = os.path.join(root, file_name)
+
+        episode_names = metadata.columns["episode_name"]
+        tasks = [
+            (show_id, rss_paths[show_id], {episode_names[row] for row in metadata.show_rows[show_id]})
+            for show_id in metadata.shows() if show_id in rss_paths
+        ]
+
+        shows = {}
+        errors = []
+        with Pool(workers) as pool:
+            for (show_id, feed, error) in tqdm(pool.imap_unordered(_extract_show, tasks, chunksize=64), total=len(tasks), desc="Parsing feeds"):
+                if feed is None:
+                    errors.append(error)
+                else:
+                    shows[show_id] = feed
+
+        missing = len(metadata.show_rows) - len(tasks)
+        if (missing > 0):
+            errors.append(f"No feed found for {missing} shows in {rss_folder}")
+        if (len(errors) > 0):
+            print(f"{len(errors)} feeds could not be read, see logs.txt")
+            log_errors("\n\n".join(errors))
+        return cls(shows)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.shows, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls(pickle.load(f))
+
+
+def sources_mtime(folder_path):
+    """The newest modification time of metadata.tsv, the show-rss folders and the feeds in them.
+
+    A folder changes when a feed is added to it or removed from it.
+    """
+    newest = os.path.getmtime(os.path.join(folder_path, "metadata.tsv"))
+    rss_folder = os.path.join(folder_path, "show-rss")
+    if not os.path.isdir(rss_folder):
+        return newest
+    newest = max(newest, os.path.getmtime(rss_folder))
+    folders = [rss_folder]
+    while len(folders) != 0:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    folders.append(entry.path)
+                newest = max(newest, entry.stat().st_mtime)
+    return newest
+
+
+def load_show_feeds(folder_path, metadata=None, rebuild=False):
+    """Loads the show feed table of a dataset folder, extracting it from show-rss the first time.
+
+    The table is extracted again when a feed or metadata.tsv is newer than show_rss.pkl, or with rebuild=True.
+    """
+    cache_path = os.path.join(folder_path, SHOW_FEEDS_CACHE_NAME)
+    if os.path.exists(cache_path) and not rebuild and os.path.getmtime(cache_path) >= sources_mtime(folder_path):
+        return ShowFeeds.load(cache_path)
+
+    if metadata is None:
+        metadata = load_metadata(folder_path)
+    feeds = ShowFeeds.extract(folder_path, metadata)
+    feeds.save(cache_path)
+    return feeds
+
+
+def log_errors(error):
+    with open("logs.txt", "a") as f:
+        f.write(error + "\n\n")
+
+
+if (__name__ == "__main__"):
+    feeds = load_show_feeds(DATASET_FOLDER, rebuild=True)
+    print(f"Extracted the feeds of {len(feeds)} shows to {os.path.join(DATASET_FOLDER, SHOW_FEEDS_CACHE_NAME)}")
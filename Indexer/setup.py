@@ -5,7 +5,36 @@ INDEX_EPISODES = "podcast_episodes"
 INDEX_SHOWS = "podcast_shows"
 DATASET_FOLDER = "dataset/spotify/spotify-podcasts-2020/" # Make sure this is path to the folder containing "podcasts-transcripts", "show-rss" and "metadata.tsv"
 TRANSCRIPT_LENGTH = 125
+CHECKPOINT_FILE = "indexed_files.txt" # Journal of indexed files, delete it to index everything again
+BUILD_STATE_FILE = "index_build.json" # The versioned indices being built, see index_versions.py
+LIVE_REPLICAS = 0 # Replicas once a build is finished, 0 on a single node cluster
+LIVE_REFRESH_INTERVAL = "1s"
+KEEP_VERSIONS = 2 # Versions of every index kept by index_versions.py prune, the live one included
+TRANSCRIPT_JSON_BACKEND = "auto" # "orjson", "ijson" (streaming, lowest memory) or "json", auto picks the fastest one installed
+BULK_MAX_BYTES = 10 * 1024 * 1024 # Bulk requests are cut at about this many bytes
+BULK_THREADS = 4 # Bulk requests sent at the same time
+BULK_MAX_RETRIES = 8 # Retries for items rejected by an overloaded cluster (429)
+OFFLINE_SHARD_FOLDER = None # Set to a folder to write bulk shards there instead of sending to the cluster, load them with load_shards.py
+SHARD_MAX_BYTES = 256 * 1024 * 1024 # Uncompressed size of one offline shard
+LOAD_WORKERS = 4 # Processes sending shards in load_shards.py, each with BULK_THREADS requests in flight
+BACKUP_FOLDER = "elastic_backup" # Where backup_indicies.py writes and restore_backup.py reads backups
+BACKUP_WORKERS = 8 # Slices of an index backed up in parallel, one process each
+BACKUP_PAGE_SIZE = 1000 # Documents per search request of a backup slice
+RESTORE_WORKERS = 4 # Backup slices restored in parallel, one process each
 MATRYOSHKA_DIM = 256
+PACKED_VECTORS = False # Send vectors as base64 float32 instead of a list of numbers, about 3.7x smaller bulk requests. Needs Elasticsearch 8.19/9.1 or newer
+EMBEDDING_MODEL = "nomic-ai/nomic-embed-text-v1.5"
+EMBEDDING_BACKEND = "torch" # "torch" or "onnx", onnx runs ONNX_MODEL_FILE with onnxruntime on the CPU without PyTorch
+ONNX_MODEL_FILE = "onnx/model_quantized.onnx" # File in the model repository (int8 weights) or a local file made by export_onnx.py
+EMBEDDING_CACHE_FOLDER = "embedding_cache" # Set to None to always run the model
+EMBEDDING_CACHE_MAX_BYTES = 16 * 1024**3 # Per embedding worker, the whole index is about 8.6 GB of vectors
+PARSE_WORKERS = 4 # Processes reading and chunking transcript files
+EMBED_WORKERS = 1 # Processes running the embedding model, each loads its own copy of the model
+QUEUE_DEPTH = 64 # Max number of files waiting between two stages of the pipeline
+EMBED_BUFFER = 2000 # Chunks collected from many episodes before they are embedded together
+EMBEDDING_BATCH_SIZE = 64 # Chunks from different episodes are sorted by length and encoded this many at a time
+VOCABULARY_FILE = "../SearchGUI/vocabulary.tsv.gz" # Written by export_vocabulary.py, read by the spelling correction of the search GUI
+VOCABULARY_MIN_DF = 3 # Terms in fewer transcript chunks are left out of the vocabulary
 
 ### INDEX MAPPINGS
 
@@ -22,7 +51,7 @@ transcript_mappings = {
                 }
             },
             "show_id": {
-                "type": "text",
+                "type": "keyword", # Search results are collapsed on it to get one per show
             },
             "vector": {
                 "type": "dense_vector",
@@ -0,0 +1,135 @@
+import gzip
+import json
+import os
+from elasticsearch import helpers
+
+from setup import SHARD_MAX_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SHARD_SUFFIX = ".ndjson.gz"
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def list_shards(folder):
+    """Finished shards in a folder, in the order they were written."""
+    return sorted(f for f in os.listdir(folder) if f.endswith(SHARD_SUFFIX))
+
+
+class ShardWriter:
+    """Writes bulk actions to gzipped NDJSON shards on disk instead of sending them to a cluster.
+
+    Works as a drop in replacement of BulkSink. Every shard is exactly the body of a bulk
+    request with _index set on every action, so load_shards.py can send it as it is. A shard
+    is closed once about max_bytes of uncompressed NDJSON has been written to it, it is
+    written as a .tmp file and only renamed when it is complete so a crash never leaves a
+    half written shard behind. Checkpoints fire when the shard holding their actions has been
+    closed.
+    """
+
+    def __init__(self, folder, max_bytes=SHARD_MAX_BYTES, compresslevel=3):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.compresslevel = compresslevel
+
+        # Shards of earlier runs are kept, numbering continues after them. Unfinished ones are removed
+        for f in os.listdir(folder):
+            if f.endswith(SHARD_SUFFIX + ".tmp"):
+                os.remove(os.path.join(folder, f))
+        shards = list_shards(folder)
+        self.next_shard = int(shards[-1][len("shard_"):-len(SHARD_SUFFIX)]) + 1 if len(shards) != 0 else 0
+
+        self.file = None
+        self.raw = None
+        self.path = None
+        self.shard_bytes = 0
+        self.checkpoints = []
+        self.errors = []
+        self.sent = 0
+        self.rejections = 0
+
+    def add(self, action, index=None):
+        if index is not None:
+            action = dict(action, _index=index)
+        meta, data = helpers.expand_action(action)
+        item = [dumps(meta)]
+        if data is not None:
+            item.append(dumps(data))
+        self.add_lines(item)
+
+    def add_lines(self, item):
+        item_bytes = sum(len(line) + 1 for line in item)
+        if self.file is not None and self.shard_bytes + item_bytes > self.max_bytes:
+            self._close_shard()
+        if self.file is None:
+            self._open_shard()
+
+        self.file.write(b"\n".join(item) + b"\n")
+        self.shard_bytes += item_bytes
+        self.sent += 1
+
+    def extend(self, actions, index=None):
+        for action in actions:
+            self.add(action, index)
+
+    def checkpoint(self, callback):
+        """Calls callback once every action added before it has been written to a finished shard."""
+        if self.file is None:
+            callback()
+        else:
+            self.checkpoints.append(callback)
+
+    def take_errors(self):
+        errors = self.errors
+        self.errors = []
+        return errors
+
+    def flush(self):
+        """Closes the current shard, the next action starts a new one."""
+        if self.file is not None:
+            self._close_shard()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.file is not None:
+            # The unfinished shard is dropped, its files are not in any checkpoint yet
+            self.file.close()
+            self.raw.close()
+            os.remove(self.path + ".tmp")
+            self.file = None
+
+    def _open_shard(self):
+        self.path = os.path.join(self.folder, f"shard_{self.next_shard:06d}{SHARD_SUFFIX}")
+        self.next_shard += 1
+        self.raw = open(self.path + ".tmp", "wb")
+        self.file = gzip.GzipFile(filename="", mode="wb", compresslevel=self.compresslevel, fileobj=self.raw)
+        self.shard_bytes = 0
+
+    def _close_shard(self):
+        self.file.close()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.raw.close()
+        os.replace(self.path + ".tmp", self.path)
+        self.file = None
+
+        checkpoints = self.checkpoints
+        self.checkpoints = []
+        for callback in checkpoints:
+            callback()
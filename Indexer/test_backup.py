@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+
+import backup_indicies
+from restore_backup import read_lines
+
+
+class Progress(list):
+    def put(self, item):
+        self.append(item)
+
+
+def fake_elasticsearch(pages, fail_at=None):
+    class FakeElasticsearch:
+        def __init__(self, *args, **kwargs):
+            self.page = 0
+
+        def search(self, **kwargs):
+            if self.page == fail_at:
+                raise ConnectionError("The cluster went away")
+            hits = pages[self.page] if self.page < len(pages) else []
+            self.page += 1
+            return {"hits": {"hits": hits}}
+
+    return FakeElasticsearch
+
+
+def hit(i):
+    return {"_id": str(i), "_source": {"transcript": f"text {i}", "vector": [float(i)] * 4}, "sort": [i]}
+
+
+PAGES = [[hit(0), hit(1)], [hit(2)]]
+
+
+def test_slice_is_published_after_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_indicies, "Elasticsearch", fake_elasticsearch(PAGES))
+    progress = Progress()
+    backup_indicies.backup_slice("pit", 0, 1, str(tmp_path), {"vector": 4}, 2, progress)
+    (kind, _, entry) = progress[-1]
+    assert kind == "done"
+    assert sorted(os.listdir(tmp_path)) == ["slice_000.ndjson.gz.tmp", "slice_000.vector.npy.tmp"]
+
+    backup_indicies.publish_slices(str(tmp_path), {"slices": [entry]})
+    assert sorted(os.listdir(tmp_path)) == ["slice_000.ndjson.gz", "slice_000.vector.npy"]
+    assert entry["sha256"] == backup_indicies.sha256_file(str(tmp_path / "slice_000.ndjson.gz"))
+    lines = [json.loads(line) for line in read_lines(str(tmp_path / "slice_000.ndjson.gz"), entry["members"], 0)]
+    assert [line["_id"] for line in lines] == ["0", "1", "2"]
+    assert np.load(tmp_path / "slice_000.vector.npy")[:, 0].tolist() == [0.0, 1.0, 2.0]
+
+
+def test_failed_slice_leaves_no_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_indicies, "Elasticsearch", fake_elasticsearch(PAGES, fail_at=1))
+    progress = Progress()
+    backup_indicies.backup_slice("pit", 0, 1, str(tmp_path), {"vector": 4}, 2, progress)
+    assert progress[-1][0] == "error"
+    assert os.listdir(tmp_path) == []
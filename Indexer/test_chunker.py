@@ -0,0 +1,35 @@
+import json
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+from bench_chunker import check_parity, legacy_get_transcripts, new_get_transcripts, synthetic_document
+from chunker import chunk_transcript
+from transcript_reader import available_backends, read_transcript
+
+
+def test_parity_with_the_old_chunker():
+    check_parity(documents=300, seed=0)
+
+
+def test_results_longer_than_a_chunk():
+    rng = random.Random(2)
+    document = synthetic_document(3000, rng, max_result_words=2000)
+    for t_len in (5, 125, 1000):
+        assert new_get_transcripts(document, t_len) == legacy_get_transcripts(document, t_len)
+
+
+def test_readers_keep_only_compact_word_arrays(tmp_path):
+    rng = random.Random(3)
+    document = synthetic_document(2000, rng)
+    path = tmp_path / "episode.json"
+    path.write_text(json.dumps(document))
+    words = [w for result in document["results"][:-1] for w in result["alternatives"][0]["words"]]
+    for backend in available_backends():
+        with open(path, "rb") as file:
+            transcript = read_transcript(file, backend=backend)
+        assert transcript.words == [w["word"] for w in words]
+        assert list(transcript.ends) == [float(w["endTime"][:-1]) for w in words]
+        assert list(transcript.starts) == [float(w["startTime"][:-1]) for w in words]
+        assert chunk_transcript(transcript, 125) == legacy_get_transcripts(document, 125)
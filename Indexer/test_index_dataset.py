@@ -0,0 +1,75 @@
+import gzip
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+from bench_chunker import synthetic_document
+import index_dataset
+from shard_writer import list_shards
+
+EPISODES = ["episode_a", "episode_b", "episode_c"]
+METADATA_HEADER = ["show_uri", "show_name", "show_description", "publisher", "language", "rss_link", "episode_uri", "episode_name", "episode_description", "duration", "show_filename_prefix", "episode_filename_prefix"]
+FEED = """<?xml version="1.0"?>
+<rss><channel><link>https://example.com</link><image><url>https://example.com/image.png</url></image>
+<item><title>Name of episode_a</title><link>https://example.com/show/episode_a</link><enclosure url="https://example.com/episode_a.mp3"/></item>
+</channel></rss>"""
+
+
+class FakeBackend:
+    cache_name = "fake"
+
+    def token_lengths(self, texts):
+        return [len(text) for text in texts]
+
+    def encode(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32) / 2
+
+
+def write_dataset(folder):
+    rng = random.Random(0)
+    os.makedirs(os.path.join(folder, "show-rss"))
+    with open(os.path.join(folder, "show-rss", "show_1.xml"), "w") as f:
+        f.write(FEED)
+    transcripts = os.path.join(folder, "podcasts-transcripts", "0", "A")
+    os.makedirs(transcripts)
+    with open(os.path.join(folder, "metadata.tsv"), "w") as f:
+        f.write("\t".join(METADATA_HEADER) + "\n")
+        for episode in EPISODES:
+            row = {column: "" for column in METADATA_HEADER}
+            row.update(show_name="Show", episode_name="Name of " + episode, show_filename_prefix="show_1", episode_filename_prefix=episode)
+            f.write("\t".join(row[column] or "x" for column in METADATA_HEADER) + "\n")
+            with open(os.path.join(transcripts, episode + ".json"), "w") as t:
+                json.dump(synthetic_document(400, rng), t)
+
+
+def read_shards(folder):
+    lines = []
+    for shard in list_shards(folder):
+        with gzip.open(os.path.join(folder, shard), "rt") as f:
+            lines.extend(json.loads(line) for line in f)
+    return lines
+
+
+def test_offline_run_into_a_new_folder(tmp_path, monkeypatch):
+    dataset = str(tmp_path / "dataset")
+    shards = str(tmp_path / "shards" / "not_made_yet")
+    write_dataset(dataset)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(index_dataset, "OFFLINE_SHARD_FOLDER", shards)
+    monkeypatch.setattr(index_dataset, "EMBEDDING_CACHE_FOLDER", None)
+    monkeypatch.setattr(index_dataset, "PARSE_WORKERS", 1)
+    monkeypatch.setattr(index_dataset, "load_embedding_backend", lambda threads=None: FakeBackend())
+
+    assert index_dataset.index_transcripts_with_metadata_from_folder(dataset, "transcripts", "episodes", "shows", 125)
+
+    lines = read_shards(shards)
+    indices = [line["index"]["_index"] for line in lines if "index" in line]
+    assert indices.count("episodes") == len(EPISODES)
+    assert indices.count("shows") == 1
+    assert indices.count("transcripts") > 0
+    with open(os.path.join(shards, index_dataset.CHECKPOINT_FILE)) as f:
+        assert sorted(f.read().split()) == EPISODES
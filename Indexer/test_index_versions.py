@@ -0,0 +1,64 @@
+import json
+
+import index_dataset
+from index_versions import start_builds
+
+MAPPINGS = {"transcripts": {}, "episodes": {}}
+
+
+class FakeIndices:
+    def __init__(self, indices):
+        self.indices = set(indices)
+
+    def exists(self, index):
+        return index in self.indices
+
+    def exists_alias(self, name):
+        return False
+
+    def get(self, index, **kwargs):
+        prefix = index.rstrip("*")
+        return {name: {} for name in self.indices if name.startswith(prefix)}
+
+    def create(self, index, mappings, settings):
+        self.indices.add(index)
+
+
+class FakeClient:
+    def __init__(self, indices=()):
+        self.indices = FakeIndices(indices)
+
+
+def test_continues_builds_that_exist(tmp_path):
+    state_file = tmp_path / "index_build.json"
+    state_file.write_text(json.dumps({"transcripts": "transcripts_v2", "episodes": "episodes_v2"}))
+    client = FakeClient(["transcripts_v2", "episodes_v2"])
+    assert start_builds(client, str(state_file), MAPPINGS) == ({"transcripts": "transcripts_v2", "episodes": "episodes_v2"}, False)
+
+
+def test_new_builds_when_the_state_file_lists_missing_indices(tmp_path):
+    state_file = tmp_path / "index_build.json"
+    state_file.write_text(json.dumps({"transcripts": "transcripts_v2", "episodes": "episodes_v2"}))
+    client = FakeClient(["transcripts_v1", "episodes_v1"])
+    (builds, created) = start_builds(client, str(state_file), MAPPINGS)
+    assert created
+    assert builds == {"transcripts": "transcripts_v2", "episodes": "episodes_v2"}
+    assert json.loads(state_file.read_text()) == builds
+    assert client.indices.exists("transcripts_v2")
+
+
+def test_journal_of_missing_builds_is_put_aside(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_dataset, "start_builds", lambda client, state_file: start_builds(client, state_file, MAPPINGS))
+    state_file = tmp_path / "index_build.json"
+    state_file.write_text(json.dumps({"transcripts": "transcripts_v1", "episodes": "episodes_v1"}))
+    checkpoint_file = tmp_path / "indexed_files.txt"
+    checkpoint_file.write_text("episode_a\n")
+
+    index_dataset.start_index_builds(FakeClient(), str(state_file), str(checkpoint_file))
+    assert not checkpoint_file.exists()
+    assert (tmp_path / "indexed_files.txt.old").read_text() == "episode_a\n"
+
+    # A second start continues the builds and keeps the new journal
+    checkpoint_file.write_text("episode_b\n")
+    index_dataset.start_index_builds(FakeClient(["transcripts_v1", "episodes_v1"]), str(state_file), str(checkpoint_file))
+    assert checkpoint_file.read_text() == "episode_b\n"
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import pipeline
+from pipeline import run_pipeline
+
+
+def init_worker(*args):
+    return None
+
+
+def parse_task(state, task):
+    if task == "kill":
+        os._exit(1)
+    if task == "exit":
+        exit(1)
+    return task
+
+
+def embed_results(state, results):
+    for result in results:
+        if result == "kill embed":
+            os._exit(1)
+        if result == "exit embed":
+            exit(1)
+    return results
+
+
+def result_size(result):
+    return 1
+
+
+def finish_worker(state):
+    return None
+
+
+def run(tasks):
+    parse_stage = (init_worker, (), parse_task)
+    embed_stage = (init_worker, (), embed_results, result_size, finish_worker)
+    return list(run_pipeline(tasks, parse_stage, embed_stage, 2, 2, 4, 1))
+
+
+@pytest.fixture(autouse=True)
+def short_poll(monkeypatch):
+    monkeypatch.setattr(pipeline, "POLL_SECONDS", 0.2)
+
+
+def test_all_results_arrive():
+    assert sorted(run([str(i) for i in range(20)])) == sorted(str(i) for i in range(20))
+
+
+@pytest.mark.parametrize("task", ["kill", "exit"])
+def test_parse_worker_that_dies_fails_the_run(task):
+    with pytest.raises(RuntimeError):
+        run([str(i) for i in range(10)] + [task] + [str(i) for i in range(10)])
+
+
+@pytest.mark.parametrize("task", ["kill embed", "exit embed"])
+def test_embed_worker_that_dies_fails_the_run(task):
+    with pytest.raises(RuntimeError):
+        run([str(i) for i in range(10)] + [task] + [str(i) for i in range(10)])
@@ -0,0 +1,61 @@
+import time
+
+MAX_DELAY = 30 # Longest pause between two batches in seconds
+CHECK_EVERY = 10 # Seconds between two looks at the cluster
+MAX_WRITE_QUEUE = 2000 # Queued write tasks on the busiest node before slowing down
+
+
+class AdaptiveThrottle:
+    """Slows a producer down when the cluster has trouble keeping up, instead of fixed sleeps.
+
+    Call wait() between batches. The pause doubles whenever the sink saw new rejections or a
+    node's write thread pool queue is longer than max_write_queue and shrinks again while the
+    cluster keeps up. While the cluster is red nothing is sent at all.
+    """
+
+    def __init__(self, client, sink, max_write_queue=MAX_WRITE_QUEUE, check_every=CHECK_EVERY, max_delay=MAX_DELAY):
+        self.client = client
+        self.sink = sink
+        self.max_write_queue = max_write_queue
+        self.check_every = check_every
+        self.max_delay = max_delay
+        self.delay = 0
+        self.rejections = sink.rejections
+        self.last_check = 0
+        self.paused = 0
+
+    def wait(self):
+        overloaded = self.sink.rejections > self.rejections
+        self.rejections = self.sink.rejections
+
+        if time.time() - self.last_check > self.check_every:
+            self.last_check = time.time()
+            overloaded = overloaded or self._write_queue() > self.max_write_queue
+            self._wait_while_red()
+
+        if overloaded:
+            self.delay = min(self.max_delay, max(0.05, self.delay * 2))
+        elif self.delay > 0:
+            self.delay = self.delay * 0.8 if self.delay > 0.01 else 0
+        if self.delay > 0:
+            time.sleep(self.delay)
+            self.paused += self.delay
+
+    def _write_queue(self):
+        try:
+            pools = self.client.cat.thread_pool(thread_pool_patterns="write", h="queue", format="json")
+            return max((int(pool["queue"]) for pool in pools), default=0)
+        except Exception:
+            return 0
+
+    def _wait_while_red(self):
+        while True:
+            try:
+                status = self.client.cluster.health(filter_path="status")["status"]
+            except Exception:
+                return
+            if status != "red":
+                return
+            print("Cluster is red, waiting 30s before sending more")
+            time.sleep(30)
+            self.paused += 30
@@ -1,137 +1,89 @@
-import json
-from sentence_transformers import SentenceTransformer
-import torch.nn.functional as F
-from setup import MATRYOSHKA_DIM
+from chunker import chunk_transcript
+from transcript_reader import read_transcript
+from embedding_cache import cache_key
+from vector_codec import encode_vector
+from setup import MATRYOSHKA_DIM, EMBEDDING_BATCH_SIZE
+
+DOCUMENT_PREFIX = "search_document: "
 
 def get_transcripts(file, t_len):
-    document = json.load(file)
-    alternatives = document["results"]
+    try:
+        return chunk_transcript(read_transcript(file), t_len)
+    except IndexError as e:
+        # Raised instead of exiting, this runs in a pipeline worker that forwards the error
+        raise ValueError(f"Could not chunk {file.name}: {e}") from e
 
-    episode_word_count = 0
-    for alt in alternatives:
-        try:
-            episode_word_count += len(alt["alternatives"][0]["transcript"].split())
-        except KeyError:
-            pass
-
-    #t_len = 250
-    remainder = 0
-    if(episode_word_count < t_len):
-        t_len = episode_word_count
-    else:
-        extra = (episode_word_count%t_len) // (episode_word_count//t_len)
-        remainder = episode_word_count % (t_len+extra)
-        t_len = t_len+extra
-
-    transcripts = []
-    starttimes = []
-    endtimes = []
-    
-    transcriptbuilder_len = 0
-    transcriptbuilder = ""
-    final_t_iterator = 0
-    if(remainder == 0):
-        r = 0
-    else:
-        r = 1
-    
-    starttimes.append(float(alternatives[-1]["alternatives"][0]["words"][0]["startTime"][:-1]))
-    for alt in alternatives:
-        try:
-            transcript = alt["alternatives"][0]["transcript"]
-            t_split = transcript.split()
-            transcript_len = len(t_split)
-            if(transcriptbuilder_len + transcript_len <= t_len+r):
-                transcriptbuilder_len += transcript_len
-                if(transcript[0] == " "):
-                    transcriptbuilder += transcript
-                else:
-                    transcriptbuilder += " " + transcript
-            else: # complete new transcript + extra
-                offset = (t_len+r - transcriptbuilder_len)
-                finaltranscript = transcriptbuilder + " " + " ".join(t_split[:offset])
-                endtime = alt["alternatives"][0]["words"][offset-1]["endTime"]
-                transcriptbuilder = " ".join(t_split[offset:]) #reset builder
-                transcriptbuilder_len = len(transcriptbuilder.split())
-                transcripts.append(finaltranscript)
-                endtimes.append(float(endtime[:-1]))
-                starttimes.append(float(endtime[:-1])) #good enough
-                final_t_iterator += 1
-                if(final_t_iterator >= remainder):
-                    r = 0
-
-                while(transcriptbuilder_len > t_len+r):
-                    builderExtraList = transcriptbuilder.split()
-                    transcripts.append(" ".join(builderExtraList[:(t_len+r)])) #extra bit of transcript that was too long
-                    offset = offset+t_len+r
-                    endtime = alt["alternatives"][0]["words"][offset-1]["endTime"]
-                    endtimes.append(float(endtime[:-1]))
-                    starttimes.append(float(endtime[:-1]))
-                    transcriptbuilder = " ".join(builderExtraList[(t_len+r):]) #reset builder
-                    transcriptbuilder_len = len(transcriptbuilder.split())
-                    final_t_iterator += 1
-                    if(final_t_iterator >= remainder):
-                        r = 0
-        except KeyError:
-            pass
-        except NotImplementedError as e:
-            print(e)
-            exit(1)
-        except IndexError as e:
-            print(e)
-            print("In file: ", file.name)
-            print(len(alt["alternatives"][0]["words"]))
-            print("Offset: ", offset)
-            exit(1)
+def get_transcript_actions(file, episode_filename: str, showID: str, transcript_length: int):
+    """Creates the transcript actions of an episode, the vectors are added later by embed_actions."""
+    actions = []
 
-    #ugly
-    transcripts.append(transcriptbuilder)
-    endtimes.append(float(alternatives[-1]["alternatives"][0]["words"][-1]["endTime"][:-1]))
+    (transcripts, starttimes, endtimes) = get_transcripts(file, transcript_length)
 
-    assert all((len(transcripts) == len(endtimes), len(transcripts) == len(starttimes))), f"Transcripts, endtimes and starttimes are not the same length! {len(transcripts)} {len(endtimes)} {len(starttimes)}"
+    for i in range(len(transcripts)):
+        contents = {
+            "_id": episode_filename + "_" + str(i),
+            "transcript": transcripts[i],
+            "show_id": showID,
+            "starttime": starttimes[i],
+            "endtime": endtimes[i],
+            "vector": None
+        }
 
-    return (transcripts, starttimes, endtimes)
+        actions.append(contents)
 
-def get_transcript_actions(file, model: SentenceTransformer, episode_filename: str, showID: str, transcript_length: int):
-    actions = []
+    return actions
 
-    (transcripts, starttimes, endtimes) = get_transcripts(file, transcript_length)
-    encode_transcripts = ["search_document: " + t for t in transcripts]
+def encode_documents(model, documents):
+    """Encodes documents with an embedding backend, see embedding_backend.py."""
     attempts = 0
     success = False
     while attempts < 5 and not success:
         try:
-            embeddings = model.encode(encode_transcripts, convert_to_tensor=True)
-            embeddings = F.layer_norm(embeddings, normalized_shape=(embeddings.shape[1],))
-            embeddings = embeddings[:, :MATRYOSHKA_DIM]
-            vectors = F.normalize(embeddings, p=2, dim=1)
+            vectors = model.encode(documents)
             success = True
         except Exception as e:
             print(f"Error with transcripts")
             print(e)
             attempts += 1
-    
+
     if not success:
-        print("Not success, exiting")
-        exit(1)
+        raise RuntimeError(f"Could not encode {len(documents)} documents after {attempts} attempts")
 
-    assert len(vectors) == len(transcripts), f"Transcripts and vectors are not the same length! {len(transcripts)} {len(vectors)}"
+    assert len(vectors) == len(documents), f"Transcripts and vectors are not the same length! {len(documents)} {len(vectors)}"
+    return vectors
 
-    for i in range(len(transcripts)):
-        transcript = transcripts[i]
-        starttime = starttimes[i]
-        endtime = endtimes[i]
-        vector = vectors[i].tolist()
+def embed_actions(model, actions, batch_size: int = EMBEDDING_BATCH_SIZE, cache=None):
+    """Sets the vector of transcript actions that can come from any number of episodes.
 
-        contents = {
-            "_id": episode_filename + "_" + str(i),
-            "transcript": transcript,
-            "show_id": showID,
-            "starttime": starttime,
-            "endtime": endtime,
-            "vector": vector
-        }
+    Chunks found in the cache are not encoded again. The rest are sorted by token length and
+    encoded in batches of batch_size, so every batch is padded to about the same length no
+    matter how long the episodes are, and then added to the cache.
+    """
+    if len(actions) == 0:
+        return actions
 
-        actions.append(contents)
+    documents = [DOCUMENT_PREFIX + action["transcript"] for action in actions]
+    missing = list(range(len(documents)))
+    if cache is not None:
+        keys = [cache_key(model.cache_name, DOCUMENT_PREFIX, action["transcript"], MATRYOSHKA_DIM) for action in actions]
+        missing = []
+        for i, vector in enumerate(cache.get_many(keys)):
+            if vector is None:
+                missing.append(i)
+            else:
+                actions[i]["vector"] = encode_vector(vector)
+        if len(missing) == 0:
+            return actions
+
+    lengths = model.token_lengths([documents[i] for i in missing])
+    order = [missing[j] for j in sorted(range(len(missing)), key=lengths.__getitem__)]
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        vectors = encode_documents(model, [documents[i] for i in batch])
+        for i, vector in zip(batch, vectors):
+            actions[i]["vector"] = encode_vector(vector)
+        if cache is not None:
+            cache.put_many([keys[i] for i in batch], vectors)
 
-    return actions
\ No newline at end of file
+    return actions
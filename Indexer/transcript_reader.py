@@ -0,0 +1,51 @@
+import json
+from chunker import TranscriptWords
+from setup import TRANSCRIPT_JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+    # The pure python backend of ijson is slower than json.load, only stream with a compiled one
+    if ijson.backend not in ("yajl2_c", "yajl2_cffi"):
+        ijson = None
+except ImportError:
+    ijson = None
+
+
+def available_backends():
+    """Installed backends, fastest first."""
+    backends = []
+    if orjson is not None:
+        backends.append("orjson")
+    if ijson is not None:
+        backends.append("ijson")
+    backends.append("json")
+    return backends
+
+
+def default_backend():
+    if TRANSCRIPT_JSON_BACKEND != "auto":
+        return TRANSCRIPT_JSON_BACKEND
+    return available_backends()[0]
+
+
+def read_transcript(file, backend=None):
+    """Reads a Spotify transcript file (opened in binary mode) into TranscriptWords.
+
+    ijson streams the file one result at a time, orjson and json load the whole document first
+    and drop it once it is read. Either way only the transcript texts and the word, startTime
+    and endTime of their words are kept, in the flat arrays of TranscriptWords.
+    """
+    backend = backend or default_backend()
+    if backend == "ijson":
+        # Only one result at a time is held in memory, its dicts are built by the C backend of ijson
+        return TranscriptWords.from_results(ijson.items(file, "results.item"))
+    if backend == "orjson":
+        return TranscriptWords.from_document(orjson.loads(file.read()))
+    if backend == "json":
+        return TranscriptWords.from_document(json.load(file))
+    raise ValueError(f"{backend} is not a valid transcript json backend, available: {available_backends()}")
@@ -0,0 +1,65 @@
+import base64
+import struct
+import numpy as np
+
+from setup import PACKED_VECTORS
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+NPY_HEADER_BYTES = 128 # Fixed so the header can be rewritten with the final row count
+
+
+def pack_vector(vector):
+    """Base64 of the vector as big-endian float32, the binary dense_vector input of Elasticsearch."""
+    return base64.b64encode(np.asarray(vector, dtype=">f4").tobytes()).decode("ascii")
+
+
+def unpack_vector(value):
+    """Reads a vector from _source, either a list of floats or a string made by pack_vector."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return np.frombuffer(base64.b64decode(value), dtype=">f4").astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_vector(vector):
+    """The vector as it is put in a bulk action."""
+    if PACKED_VECTORS:
+        return pack_vector(vector)
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class NpyWriter:
+    """Appends float32 rows to a .npy file without knowing the number of rows up front.
+
+    The header is written with room to spare and rewritten with the real shape on close,
+    the file can then be read with np.load(path, mmap_mode="r").
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.file.write(self._header(0))
+
+    def _header(self, rows):
+        header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, self.dim)
+        header = header.ljust(NPY_HEADER_BYTES - len(NPY_MAGIC) - 2 - 1) + "\n"
+        return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+    def write(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype="<f4").reshape(-1, self.dim)
+        self.file.write(vectors.tobytes())
+        self.rows += len(vectors)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(self._header(self.rows))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,26 +1,55 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, g, Response
 import search
+import async_search
+import metrics
+from setup import RESULTS_PER_PAGE
 import re
 app = Flask(__name__)
 
+metrics.register("query_cache", search.query_cache.stats)
+metrics.register("metadata_cache", search.metadata_cache.stats)
+metrics.register("response_cache", search.response_cache.stats)
 
-def search_query(query, query_type, slider_values):
-    query = search.generate_query(query, query_type, slider_values)
-    number_of_responses = 50
-    query_response = search.execute_query(query, n=number_of_responses)
-    results, ids = search.get_first_n_results(query_response, n=number_of_responses)
-    unique_results = []
-    unique_show_ids = []
-    unique_ids = []
-    for res, res_id in zip(results, ids):
-        if res["show_id"] not in unique_show_ids:
-            unique_results.append(res)
-            unique_show_ids.append(res["show_id"])
-            unique_ids.append(res_id)
 
-    results = unique_results
+@app.before_request
+def start_timings():
+    g.timings = metrics.begin()
 
-    metadata = search.get_transcript_metadata(results, unique_ids)
+
+@app.after_request
+def server_timing(response):
+    header = metrics.end(g.pop("timings"), request.endpoint or "none")
+    if header:
+        response.headers["Server-Timing"] = header
+    return response
+
+
+@app.teardown_request
+def end_timings(error):
+    # Requests that failed before after_request
+    if "timings" in g:
+        metrics.end(g.pop("timings"), request.endpoint or "none")
+
+
+def search_query(query, query_type, slider_values, page=0, pit_id=None):
+    key = search.response_cache.key(query, query_type, slider_values, page)
+    with metrics.stage("response_cache"):
+        results = search.response_cache.get(key)
+    if results is not None:
+        return results, pit_id
+    results, pit_id = make_results(query, query_type, slider_values, page, pit_id)
+    search.response_cache.put(key, results)
+    return results, pit_id
+
+
+def make_results(query, query_type, slider_values, page, pit_id):
+    results, ids, metadata, pit_id = async_search.search_page(query, query_type, slider_values, (page + 1) * RESULTS_PER_PAGE, RESULTS_PER_PAGE, page, pit_id)
+    with metrics.stage("format"):
+        format_results(results, metadata)
+    return results, pit_id
+
+
+def format_results(results, metadata):
     for res, data in zip(results, metadata):
         res["transcript"] = str("...") + res["transcript"] + str("...")
         res["podcast_name"] = data["podcast_name"]
@@ -31,14 +60,11 @@ def search_query(query, query_type, slider_values):
         res["image"] = data["image"]
         res["audio_link"] = data["audio_link"] + f"#t={res['starttime']},{res['endtime']}"
         res["pod_link"] = data["pod_link"]
-        m, s = divmod(res["starttime"], 60)
-        h, m = divmod(m, 60)
-        time_string = ""
-        if h != 0:
-            time_string += f"{int(h)}h:"
-        time_string += f"{int(m)}m:"
-        time_string += f"{int(s)}s"
-        res["starttime"] = time_string
+        res["starttime"] = format_time(res["starttime"])
+        for segment in res.get("more_segments", []):
+            segment["transcript"] = "..." + segment["transcript"] + "..."
+            segment["audio_link"] = data["audio_link"] + f"#t={segment['starttime']},{segment['endtime']}"
+            segment["starttime"] = format_time(segment["starttime"])
 
         url_pattern = re.compile(
             r'(^(?:http|https)://)?'  # http:// or https://
@@ -59,7 +85,16 @@ def search_query(query, query_type, slider_values):
             else:
                 res["pod_link"] = data["pod_link"]
 
-    return results
+
+def format_time(seconds):
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    time_string = ""
+    if h != 0:
+        time_string += f"{int(h)}h:"
+    time_string += f"{int(m)}m:"
+    time_string += f"{int(s)}s"
+    return time_string
 
 
 @app.route('/result', methods=['POST', 'GET'])
@@ -71,7 +106,8 @@ def result():
         return render_template('result.html', results=[], old_query="", sliderPositions=default_sliders,
                                showSliders=False,
                                searchOptions=[search.QueryType.smart_query, search.QueryType.combi_query],
-                               searchOptionNames=query_names, selectedQueryType=default_query_type)
+                               searchOptionNames=query_names, selectedQueryType=default_query_type,
+                               page=0, pitId=None, hasNextPage=False)
 
     query = request.form['query']
 
@@ -93,11 +129,45 @@ def result():
         query_type = request.form['query_type']
     except KeyError:
         query_type = default_query_type
-    results = search_query(query, query_type, normalized_sliders)
-    return render_template('result.html', results=results, old_query=query, sliderPositions=slider_values,
-                           showSliders=sliders_found,
-                           searchOptions=[search.QueryType.smart_query, search.QueryType.combi_query],
-                           searchOptionNames=query_names, selectedQueryType=query_type)
+    # Elasticsearch does not page past index.max_result_window (10000) hits
+    page = min(max(0, int(request.form.get('page', 0))), 10000 // RESULTS_PER_PAGE - 1)
+    pit_id = request.form.get('pit_id') or None
+    if request.form.get('end_pit_id'):
+        # A new search, the point in time of the one before is not paged any more
+        async_search.close_point_in_time(request.form['end_pit_id'])
+    results, pit_id = search_query(query, query_type, normalized_sliders, page, pit_id)
+    has_next_page = len(results) == RESULTS_PER_PAGE and (page + 2) * RESULTS_PER_PAGE <= 10000
+    if pit_id is not None and not has_next_page:
+        # The last page, nothing more is read from the point in time
+        async_search.close_point_in_time(pit_id)
+        pit_id = None
+    with metrics.stage("render"):
+        return render_template('result.html', results=results, old_query=query, sliderPositions=slider_values,
+                               showSliders=sliders_found,
+                               searchOptions=[search.QueryType.smart_query, search.QueryType.combi_query],
+                               searchOptionNames=query_names, selectedQueryType=query_type,
+                               page=page, pitId=pit_id, hasNextPage=has_next_page)
+
+
+@app.route('/stats')
+def stats():
+    stats = {"query_cache": search.query_cache.stats(), "metadata_cache": search.metadata_cache.stats(), "response_cache": search.response_cache.stats()}
+    if hasattr(search.model, "stats"):
+        stats["embedding_server"] = search.model.stats() # None when the server does not answer
+    return jsonify(stats)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    extra = {}
+    counters = {}
+    # The embedding server is one process for all workers
+    server = search.model.stats() if hasattr(search.model, "stats") else None
+    if server is not None:
+        extra = {"search_embedding_mean_batch": server["mean_batch"]}
+        counters = {"search_embedding_batches_total": server["batches"], "search_embedding_texts_total": server["texts"],
+                    "search_embedding_encode_seconds_total": server["encode_seconds"]}
+    return Response(metrics.prometheus(extra, counters), mimetype="text/plain; version=0.0.4")
 
 
 @app.route('/')
@@ -106,4 +176,5 @@ def index():
 
 
 if __name__ == '__main__':
+    # Development server, run gunicorn -c gunicorn.conf.py app:app in production
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from elasticsearch import AsyncElasticsearch, NotFoundError
+
+import search
+import metrics
+from setup import ADDRESS, API_KEY, INDEX, PIT_KEEP_ALIVE, ENCODE_THREADS, ES_CONNECTIONS
+from query_cache import normalize_query
+
+# The search of a result page as one coroutine on an event loop thread of its own, so a WSGI
+# worker thread only waits for the result. Every worker process has one loop, one
+# AsyncElasticsearch with its connection pool and one executor for the CPU bound encoding:
+#
+#   spelling  ----------------------------+
+#   encode the query as typed (executor) -+-> search -> mget of what the metadata cache misses
+#
+# The query is encoded while its spelling is checked. Usually nothing is corrected and that
+# vector is used, otherwise the corrected query is encoded afterwards. Without a vocabulary the
+# words are looked up in Elasticsearch at the same time instead of one after another.
+
+loop = None
+client = None
+executor = None
+pid = None
+lock = threading.Lock()
+
+
+def start():
+    """Starts the loop, client and executor of this process, again after a fork."""
+    global loop, client, executor, pid
+    with lock:
+        if pid == os.getpid():
+            return
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        # The client has to be made on the loop it is used from
+        client = asyncio.run_coroutine_threadsafe(make_client(), loop).result()
+        executor = ThreadPoolExecutor(ENCODE_THREADS, thread_name_prefix="encode")
+        pid = os.getpid()
+
+
+async def make_client():
+    return AsyncElasticsearch(ADDRESS, api_key=API_KEY, verify_certs=False, ssl_show_warn=False, connections_per_node=ES_CONNECTIONS)
+
+
+def run(coroutine):
+    start()
+    return asyncio.run_coroutine_threadsafe(metrics.carry(coroutine), loop).result()
+
+
+def close_point_in_time(pit_id):
+    """Closes a point in time that is not paged any more, in the background so the request does not wait."""
+    start()
+    asyncio.run_coroutine_threadsafe(_close_point_in_time(pit_id), loop)
+
+
+async def _close_point_in_time(pit_id):
+    try:
+        await client.close_point_in_time(id=pit_id)
+    except NotFoundError:
+        pass # Expired already
+
+
+def search_page(query_string, query_type, slider_values, depth, n, page, pit_id):
+    """Returns (results, ids, metadata, pit_id) of one result page, like search.generate_query,
+    search.execute_query, search.get_first_n_results and search.get_transcript_metadata."""
+    return run(_search_page(query_string, query_type, slider_values, depth, n, page, pit_id))
+
+
+async def _search_page(query_string, query_type, slider_values, depth, n, page, pit_id):
+    current_loop = asyncio.get_running_loop()
+    if query_type == search.QueryType.combi_query and not search.check_char(query_string):
+        # With the context of the request, so the executor thread adds its stages to the request
+        encoding = current_loop.run_in_executor(executor, metrics.in_context(search.query_cache.get, query_string))
+        with metrics.stage("spelling"):
+            corrected = await check_spelling(query_string)
+        if normalize_query(corrected) == normalize_query(query_string):
+            vector = await encoding
+        else:
+            vector = await current_loop.run_in_executor(executor, metrics.in_context(search.query_cache.get, corrected))
+        query = search.generate_query(corrected, query_type, slider_values, depth, vector=vector)
+    else:
+        query = search.generate_query(query_string, query_type, slider_values, depth)
+
+    start = time.perf_counter()
+    response = await execute_query(query, n, page, pit_id)
+    # What Elasticsearch spent on the search and what the client waited for it
+    seconds = time.perf_counter() - start
+    metrics.record("search", seconds)
+    metrics.record("es_took", response["took"] / 1000)
+    metrics.record("es_overhead", max(0.0, seconds - response["took"] / 1000))
+    results, ids = search.get_first_n_results(response, n=n, page=page)
+    # The first page is not searched in the point in time, it is kept for the pages after it
+    pit_id = response.get("pit_id", pit_id)
+    if len(results) == 0:
+        return (results, ids, [], pit_id)
+
+    episode_ids, show_ids = search.metadata_ids(results, ids)
+    (episodes, shows, docs) = search.metadata_cache.lookup(episode_ids, show_ids)
+    if len(docs) > 0:
+        # Episodes and shows in the same request
+        with metrics.stage("mget"):
+            found = await client.mget(docs=docs)
+        search.metadata_cache.fill(episodes, shows, docs, found)
+    metadata = search.format_metadata(*search.metadata_cache.result(episodes, shows, episode_ids, show_ids))
+    return (results, ids, metadata, pit_id)
+
+
+async def check_spelling(query_string):
+    """search.check_spelling without blocking the loop."""
+    if search.speller is not None:
+        query_string, unknown = search.speller.correct(query_string)
+        if len(unknown) == 0:
+            return query_string
+    else:
+        words = query_string.split()
+        counts = await asyncio.gather(*(client.count(index=INDEX, query={"match": {"transcript": word}}) for word in words))
+        if all(count["count"] > 0 for count in counts):
+            return query_string
+    return await asyncio.get_running_loop().run_in_executor(None, metrics.in_context(search.correct_with_llm, query_string))
+
+
+async def execute_query(query, n, page, pit_id):
+    """search.execute_query on the async client."""
+    if search.needs_point_in_time(page):
+        if pit_id is not None:
+            try:
+                return await client.search(**search.search_request(query, n, INDEX, page, pit_id))
+            except NotFoundError:
+                pass # The point in time expired, the next one starts now
+        pit_id = (await client.open_point_in_time(index=INDEX, keep_alive=PIT_KEEP_ALIVE))["id"]
+    return await client.search(**search.search_request(query, n, INDEX, page, pit_id))
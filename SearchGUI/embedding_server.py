@@ -0,0 +1,232 @@
+"""One copy of the embedding model for all web workers on a machine.
+
+python embedding_server.py [--socket embedding.sock] [--max-wait-ms 5] [--max-batch 64]
+
+Workers connect with EmbeddingClient over a Unix socket. Texts sent by different connections
+within max_wait_ms of the first one are encoded as one batch, up to max_batch texts, while the
+next batch is being collected. Every message is a 4 byte big endian length and a body. Requests
+are JSON: {"texts": [...]} is answered with the float32 vectors of the texts, row by row, and
+{"info": true} and {"stats": true} with JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from setup import EMBEDDING_SOCKET, EMBEDDING_MAX_WAIT_MS, EMBEDDING_MAX_BATCH, EMBEDDING_TIMEOUT
+
+HEADER = struct.Struct(">I")
+# How long a client that fell back to its own model waits before it asks the server again
+RETRY_SECONDS = 30
+
+
+class BatchingServer:
+    def __init__(self, model, max_wait_ms, max_batch):
+        self.model = model
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue()
+        # The model runs in one thread, it uses all cores for a batch by itself
+        self.executor = ThreadPoolExecutor(1)
+        self.batches = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+
+    async def batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            # Not awaited, so the next batch is collected while this one is encoded
+            asyncio.ensure_future(self.encode(batch))
+
+    async def encode(self, batch):
+        texts = [text for texts, _ in batch for text in texts]
+        try:
+            (vectors, seconds) = await asyncio.get_running_loop().run_in_executor(self.executor, self._encode, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.encode_seconds += seconds
+        self.batches += 1
+        self.texts += len(texts)
+        offset = 0
+        for texts, future in batch:
+            if not future.done(): # Cancelled if the client went away
+                future.set_result(np.asarray(vectors[offset:offset + len(texts)], dtype="<f4"))
+            offset += len(texts)
+
+    def _encode(self, texts):
+        start = time.perf_counter()
+        vectors = self.model.encode(texts)
+        return (vectors, time.perf_counter() - start)
+
+    def stats(self):
+        return {
+            "batches": self.batches, "texts": self.texts,
+            "mean_batch": self.texts / self.batches if self.batches else 0.0,
+            "encode_seconds": self.encode_seconds,
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                request = json.loads(await reader.readexactly(length))
+                if "texts" in request:
+                    future = asyncio.get_running_loop().create_future()
+                    await self.queue.put((request["texts"], future))
+                    body = (await future).tobytes()
+                elif "info" in request:
+                    body = json.dumps({"dim": self.model.dim, "cache_name": self.model.cache_name}).encode()
+                else:
+                    body = json.dumps(self.stats()).encode()
+                writer.write(HEADER.pack(len(body)) + body)
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass # The client closed the connection
+        finally:
+            writer.close()
+
+
+async def serve(path, max_wait_ms, max_batch):
+    # Shared with the indexer, it reads the model settings from this folder's setup.py
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Indexer"))
+    from embedding_backend import load_embedding_backend
+    server = BatchingServer(load_embedding_backend(), max_wait_ms, max_batch)
+    if os.path.exists(path):
+        os.remove(path)
+    unix_server = await asyncio.start_unix_server(server.handle, path=path)
+    print(f"Embedding server listening on {path}")
+    asyncio.ensure_future(server.batch_loop())
+    async with unix_server:
+        await unix_server.serve_forever()
+
+
+def recv_exactly(sock, length):
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError("The embedding server closed the connection")
+        data += chunk
+    return bytes(data)
+
+
+class EmbeddingClient:
+    """Stands in for an embedding backend (encode, dim, cache_name) and asks the server.
+
+    Every thread has its own connection, the server batches their requests together. A request
+    that gets no answer in timeout seconds fails, and so does one to a server that is gone. If
+    fallback is given, it is called once to load a backend of this process that encodes instead
+    until the server is asked again RETRY_SECONDS later, otherwise the error is raised.
+    """
+
+    def __init__(self, path=EMBEDDING_SOCKET, timeout=EMBEDDING_TIMEOUT, fallback=None):
+        self.path = path
+        self.timeout = timeout
+        self.fallback = fallback
+        self.fallback_model = None
+        self.fallback_lock = threading.Lock()
+        self.retry_at = 0.0
+        self.local = threading.local()
+        info = self._request({"info": True})
+        self.dim = info["dim"]
+        self.cache_name = info["cache_name"]
+
+    def _connection(self):
+        if getattr(self.local, "socket", None) is None or self.local.pid != os.getpid():
+            self.local.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.local.socket.settimeout(self.timeout)
+            self.local.socket.connect(self.path)
+            self.local.pid = os.getpid()
+        return self.local.socket
+
+    def _close(self):
+        sock = getattr(self.local, "socket", None)
+        self.local.socket = None
+        if sock is not None and self.local.pid == os.getpid():
+            sock.close()
+
+    def _call(self, request):
+        body = json.dumps(request).encode()
+        for attempt in range(2):
+            try:
+                sock = self._connection()
+                sock.sendall(HEADER.pack(len(body)) + body)
+                (length,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+                return recv_exactly(sock, length)
+            except TimeoutError:
+                # The answer may still come and would be read as the answer to the next request
+                self._close()
+                raise
+            except (ConnectionError, OSError):
+                # A restarted server, connect once more
+                self._close()
+                if attempt == 1:
+                    raise
+
+    def _request(self, request):
+        return json.loads(self._call(request))
+
+    def encode(self, texts):
+        if self.fallback is None or time.monotonic() >= self.retry_at:
+            try:
+                return np.frombuffer(self._call({"texts": list(texts)}), dtype="<f4").reshape(len(texts), self.dim)
+            except (ConnectionError, OSError) as e:
+                if self.fallback is None:
+                    raise
+                print(f"The embedding server on {self.path} failed ({e!r}), encoding in this process for {RETRY_SECONDS} s")
+                self.retry_at = time.monotonic() + RETRY_SECONDS
+        return self._fallback_model().encode(texts)
+
+    def _fallback_model(self):
+        with self.fallback_lock:
+            if self.fallback_model is None:
+                self.fallback_model = self.fallback()
+            return self.fallback_model
+
+    def stats(self):
+        """The stats of the server, None if it does not answer."""
+        try:
+            return self._request({"stats": True})
+        except (ConnectionError, OSError):
+            return None
+
+
+def wait_for_server(path, timeout):
+    """True once the server answers on path, False after timeout seconds."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            EmbeddingClient(path)
+            return True
+        except (ConnectionError, OSError):
+            time.sleep(0.5)
+    return False
+
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=EMBEDDING_SOCKET)
+    parser.add_argument("--max-wait-ms", type=float, default=EMBEDDING_MAX_WAIT_MS)
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_MAX_BATCH)
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket, args.max_wait_ms, args.max_batch))
@@ -0,0 +1,56 @@
+import multiprocessing
+import shutil
+import subprocess
+import sys
+from setup import EMBEDDING_SOCKET, METRICS_DIR
+
+# gunicorn -c gunicorn.conf.py app:app
+#
+# The embedding model runs once in embedding_server.py, started before the workers. Every worker
+# process has its own caches, AsyncElasticsearch connection pool and event loop (async_search.py).
+# The app is not preloaded because thread pools do not survive a fork, the warm-up snapshot and
+# spelling index files keep the start of a worker fast.
+# Threads only wait for the event loop and Elasticsearch, so a few workers serve many requests.
+
+bind = "0.0.0.0:8000"
+workers = min(4, multiprocessing.cpu_count())
+worker_class = "gthread"
+threads = 16
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+preload_app = False
+max_requests = 10000 # Restart workers now and then so memory does not creep up
+max_requests_jitter = 1000
+accesslog = "-"
+
+embedding_server = None
+
+
+def on_starting(server):
+    global embedding_server
+    if METRICS_DIR is not None:
+        # The files of the workers of the last run, /metrics starts counting from zero
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    if EMBEDDING_SOCKET is None:
+        return
+    from embedding_server import wait_for_server
+    embedding_server = subprocess.Popen([sys.executable, "embedding_server.py", "--socket", EMBEDDING_SOCKET])
+    if not wait_for_server(EMBEDDING_SOCKET, timeout=300):
+        server.log.warning("The embedding server did not start, every worker loads its own model")
+
+
+def worker_exit(server, worker):
+    # The last requests of the worker, before the master merges its metrics in child_exit
+    import metrics
+    metrics.flush()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if embedding_server is not None:
+        embedding_server.terminate()
@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from elasticsearch import helpers
+
+EPISODE_FIELDS = ("episode_name", "episode_description", "audio_link")
+SHOW_FIELDS = ("show_name", "show_description", "publisher", "link", "image", "pod_link")
+
+
+def index_version(client, indices):
+    """The concrete indices behind the aliases and their _meta.links_version, changes when either does."""
+    mappings = client.indices.get_mapping(index=indices)
+    return tuple(sorted((index, str(m.get("mappings", {}).get("_meta", {}).get("links_version"))) for index, m in mappings.items()))
+
+
+class MetadataCache:
+    """Show and episode metadata for the result pages without a round trip per search.
+
+    All shows are loaded into a table of tuples when the cache is made, episodes are kept in an
+    LRU of max_episodes. Whatever is missing is fetched with one mget for both indices.
+    Every check_interval seconds a background thread looks at the concrete indices behind the
+    aliases and their _meta.links_version, which Indexer/fix_show_links.py bumps when it changes
+    links. When either changed, the shows are loaded again and the episodes dropped.
+    """
+
+    def __init__(self, client, episodes_index, shows_index, max_episodes, check_interval=60):
+        self.client = client
+        self.episodes_index = episodes_index
+        self.shows_index = shows_index
+        self.max_episodes = max_episodes
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.episodes = OrderedDict()
+        self.shows = {}
+        self.hits = 0
+        self.misses = 0
+        self.pid = None
+        try:
+            self.version = self._version()
+            self.shows = self._load_shows()
+        except Exception as e:
+            # Search still works, shows are then fetched like episodes
+            self.version = None
+            print(f"Could not preload the shows: {e}")
+
+    def _version(self):
+        return index_version(self.client, [self.episodes_index, self.shows_index])
+
+    def _load_shows(self):
+        start = time.time()
+        shows = {}
+        for hit in helpers.scan(self.client, index=self.shows_index, _source=list(SHOW_FIELDS), size=5000):
+            shows[hit["_id"]] = tuple(hit["_source"].get(field) for field in SHOW_FIELDS)
+        print(f"Loaded {len(shows)} shows in {time.time() - start:.1f}s")
+        return shows
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                version = self._version()
+                if version != self.version:
+                    self.invalidate(version)
+            except Exception as e:
+                print(f"Could not check the metadata version: {e}")
+
+    def invalidate(self, version=None):
+        """Loads the shows again and forgets all episodes."""
+        version = version if version is not None else self._version()
+        shows = self._load_shows()
+        with self.lock:
+            self.shows = shows
+            self.episodes.clear()
+            self.version = version
+
+    def get(self, episode_ids, show_ids):
+        """Metadata dicts of the episodes and shows, None for the ones that do not exist."""
+        (episodes, shows, docs) = self.lookup(episode_ids, show_ids)
+        if len(docs) > 0:
+            self.fill(episodes, shows, docs, self.client.mget(docs=docs))
+        return self.result(episodes, shows, episode_ids, show_ids)
+
+    def lookup(self, episode_ids, show_ids):
+        """What the cache has, and the mget docs for the rest. For callers that send the mget themselves."""
+        if self.pid != os.getpid():
+            # Threads do not survive a fork, every worker process starts its own watcher
+            self.pid = os.getpid()
+            threading.Thread(target=self._watch, daemon=True).start()
+
+        with self.lock:
+            episodes = {}
+            for episode_id in episode_ids:
+                if episode_id in self.episodes:
+                    self.episodes.move_to_end(episode_id)
+                    episodes[episode_id] = self.episodes[episode_id]
+            shows = {show_id: self.shows[show_id] for show_id in show_ids if show_id in self.shows}
+            self.hits += len(episodes) + len(shows)
+
+        docs = [{"_index": self.episodes_index, "_id": i, "_source": list(EPISODE_FIELDS)} for i in dict.fromkeys(episode_ids) if i not in episodes]
+        docs += [{"_index": self.shows_index, "_id": i, "_source": list(SHOW_FIELDS)} for i in dict.fromkeys(show_ids) if i not in shows]
+        return (episodes, shows, docs)
+
+    def fill(self, episodes, shows, docs, response):
+        """Adds the mget response for docs to the cache and to episodes and shows."""
+        with self.lock:
+            self.misses += len(docs)
+            # In the order they were asked for, _index is the concrete index and not the alias
+            for request, doc in zip(docs, response["docs"]):
+                is_episode = request["_index"] == self.episodes_index
+                fields = EPISODE_FIELDS if is_episode else SHOW_FIELDS
+                value = tuple(doc["_source"].get(field) for field in fields) if doc.get("found") else None
+                if is_episode:
+                    episodes[doc["_id"]] = self.episodes[doc["_id"]] = value
+                else:
+                    shows[doc["_id"]] = self.shows[doc["_id"]] = value
+            while len(self.episodes) > self.max_episodes:
+                self.episodes.popitem(last=False)
+
+    def result(self, episodes, shows, episode_ids, show_ids):
+        return ([self._as_dict(EPISODE_FIELDS, episodes[i]) for i in episode_ids], [self._as_dict(SHOW_FIELDS, shows[i]) for i in show_ids])
+
+    @staticmethod
+    def _as_dict(fields, value):
+        return None if value is None else {field: v for field, v in zip(fields, value) if v is not None}
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"shows": len(self.shows), "episodes": len(self.episodes), "hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,321 @@
+import bisect
+import contextvars
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+from setup import METRICS_ENABLED, METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+# Latency of the stages of a search. Every stage is added to a histogram of the worker process
+# and to the timings of the request it belongs to, which go back in a Server-Timing header. The
+# request is found through a context variable, so code on the event loop or in an executor thread
+# has to be run with the context of the request (carry and in_context). Every worker writes its
+# histograms and counters to METRICS_DIR, /metrics adds up the files of all workers. When a
+# worker exits, the gunicorn master adds its file to dead.json and removes it (mark_process_dead),
+# so the counters keep counting without a file for every worker there ever was.
+
+DEAD_FILE = "dead.json"
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+current = contextvars.ContextVar("timings", default=None)
+
+lock = threading.Lock()
+histograms = {} # (metric, label) -> counts per bucket, the last one is +Inf, then the sum
+in_flight = 0
+sources = {} # Name -> function that returns the counters of a cache
+pid = None
+file_name = None # <pid>-<start time>.json, so a later worker with a reused pid gets a file of its own
+
+
+class Timings:
+    """The stages of one request."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def header(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+def observe(metric, label, seconds):
+    start_process()
+    with lock:
+        counts = histograms.get((metric, label))
+        if counts is None:
+            counts = histograms[(metric, label)] = [0] * (len(BUCKETS) + 1) + [0.0]
+        counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        counts[-1] += seconds
+
+
+def record(name, seconds):
+    """Adds a stage that took seconds to the histograms and the current request."""
+    if not METRICS_ENABLED:
+        return
+    observe("stage", name, seconds)
+    timings = current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+class stage:
+    """with stage(name): records the time the block takes."""
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+
+
+def timed(name):
+    """Decorator that records every call of the function as the stage name."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def carry(coroutine):
+    """The coroutine, run with the timings of the calling thread. For run_coroutine_threadsafe."""
+    timings = current.get()
+
+    async def run():
+        current.set(timings)
+        return await coroutine
+    return run()
+
+
+def in_context(function, *args):
+    """function(*args) with the context of the caller, for run_in_executor."""
+    return functools.partial(contextvars.copy_context().run, function, *args)
+
+
+def begin():
+    """Starts the timings of a request."""
+    global in_flight
+    start_process()
+    timings = Timings()
+    with lock:
+        in_flight += 1
+    return (timings, current.set(timings))
+
+
+def end(request, endpoint):
+    """Finishes the request begin returned, the Server-Timing header or None."""
+    global in_flight
+    (timings, token) = request
+    current.reset(token)
+    with lock:
+        in_flight -= 1
+    if not METRICS_ENABLED:
+        return None
+    seconds = time.perf_counter() - timings.start
+    observe("request", endpoint, seconds)
+    timings.add("total", seconds)
+    return timings.header()
+
+
+def register(name, stats):
+    """stats() returns the hits, misses and entries of a cache for /metrics."""
+    sources[name] = stats
+
+
+def snapshot():
+    caches = {}
+    for name, stats in sources.items():
+        try:
+            s = stats()
+            caches[name] = {key: s.get(key, 0) for key in ("hits", "disk_hits", "misses", "entries")}
+        except Exception as e:
+            print(f"Could not read the stats of {name}: {e}")
+    with lock:
+        return {
+            "histograms": [[metric, label, counts[:]] for (metric, label), counts in histograms.items()],
+            "in_flight": in_flight,
+            "caches": caches,
+        }
+
+
+def flush():
+    """Writes the metrics of this process to METRICS_DIR."""
+    if METRICS_DIR is None:
+        return
+    start_process()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, file_name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError as e:
+            print(f"Could not write the metrics: {e}")
+
+
+def start_process():
+    """Forgets what a forked process copied from its parent and starts its flush thread."""
+    global pid, in_flight, file_name
+    if pid == os.getpid():
+        return
+    with lock:
+        if pid == os.getpid():
+            return
+        if pid is not None:
+            histograms.clear()
+            in_flight = 0
+        pid = os.getpid()
+        file_name = f"{pid}-{time.time_ns()}.json"
+    if METRICS_DIR is not None:
+        # Threads do not survive a fork, every worker process starts its own
+        threading.Thread(target=_flush_loop, daemon=True).start()
+
+
+def is_alive(process_id):
+    try:
+        os.kill(process_id, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_dead():
+    try:
+        with open(os.path.join(METRICS_DIR, DEAD_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": [], "histograms": [], "in_flight": 0, "caches": {}}
+
+
+def mark_process_dead(process_id):
+    """Adds the counters of a worker that exited to dead.json and removes its file.
+
+    Called by the gunicorn master only. Gauges of the worker (in_flight, cache entries) are
+    dropped, histograms and hit counters are kept so the totals never go down.
+    """
+    if METRICS_DIR is None:
+        return
+    for path in glob.glob(os.path.join(METRICS_DIR, f"{process_id}-*.json")):
+        try:
+            with open(path) as f:
+                s = json.load(f)
+        except (OSError, ValueError):
+            continue
+        dead = read_dead()
+        merged = add_snapshots([dead, dict(s, in_flight=0, caches={name: dict(c, entries=0) for name, c in s["caches"].items()})])
+        # dead.json names the file before it goes, collect skips the files that were merged. Only
+        # a /metrics that was reading while this ran needs the name, so the last ones are enough
+        merged["files"] = (dead["files"] + [os.path.basename(path)])[-100:]
+        dead_path = os.path.join(METRICS_DIR, DEAD_FILE)
+        with open(dead_path + ".tmp", "w") as f:
+            json.dump(merged, f)
+        os.replace(dead_path + ".tmp", dead_path)
+        os.remove(path)
+
+
+def collect():
+    """The snapshots of all workers, and of the ones that exited. Exited workers are not in flight."""
+    if METRICS_DIR is None:
+        return [snapshot()]
+    flush()
+    snapshots = {}
+    for path in glob.glob(os.path.join(METRICS_DIR, "*-*.json")):
+        name = os.path.basename(path)
+        try:
+            with open(path) as f:
+                s = json.load(f)
+        except (OSError, ValueError):
+            continue # Being replaced or merged into dead.json
+        if not is_alive(int(name.split("-")[0])):
+            s["in_flight"] = 0
+        snapshots[name] = s
+    # Read after the files, a worker merged in the meantime is then counted once, by dead.json
+    dead = read_dead()
+    merged = set(dead["files"])
+    return [s for name, s in snapshots.items() if name not in merged] + [dead]
+
+
+def add_snapshots(snapshots):
+    """One snapshot with the sums of all of them."""
+    histogram_sums = {}
+    caches = {}
+    in_flight_sum = 0
+    for s in snapshots:
+        in_flight_sum += s["in_flight"]
+        for metric, label, counts in s["histograms"]:
+            total = histogram_sums.setdefault((metric, label), [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+        for name, counters in s["caches"].items():
+            total = caches.setdefault(name, {})
+            for key, value in counters.items():
+                total[key] = total.get(key, 0) + value
+    return {"histograms": [[metric, label, counts] for (metric, label), counts in histogram_sums.items()], "in_flight": in_flight_sum, "caches": caches}
+
+
+def prometheus(extra=None, counters=None):
+    """The metrics of all workers in the Prometheus text format.
+
+    extra maps more gauge names to values and counters more counter names, ending in _total, to values.
+    """
+    total = add_snapshots(collect())
+    histogram_sums = {(metric, label): counts for metric, label, counts in total["histograms"]}
+    caches = total["caches"]
+    in_flight_sum = total["in_flight"]
+
+    lines = []
+    for metric, label_name, help_text in (("stage", "stage", "Time spent in a stage of a search"), ("request", "endpoint", "Time to answer a request")):
+        lines.append(f"# HELP search_{metric}_seconds {help_text}")
+        lines.append(f"# TYPE search_{metric}_seconds histogram")
+        for (m, label), counts in sorted(histogram_sums.items()):
+            if m != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts[:-1]):
+                cumulative += count
+                lines.append(f'search_{metric}_seconds_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'search_{metric}_seconds_sum{{{label_name}="{label}"}} {counts[-1]}')
+            lines.append(f'search_{metric}_seconds_count{{{label_name}="{label}"}} {cumulative}')
+
+    lines.append("# HELP search_requests_in_flight Requests being answered")
+    lines.append("# TYPE search_requests_in_flight gauge")
+    lines.append(f"search_requests_in_flight {in_flight_sum}")
+
+    for key, kind in (("hits", "counter"), ("disk_hits", "counter"), ("misses", "counter"), ("entries", "gauge")):
+        name = f"search_cache_{key}_total" if kind == "counter" else f"search_cache_{key}"
+        lines.append(f"# TYPE {name} {kind}")
+        for cache, counters in sorted(caches.items()):
+            lines.append(f'{name}{{cache="{cache}"}} {counters.get(key, 0)}')
+    lines.append("# TYPE search_cache_hit_ratio gauge")
+    for cache, counters in sorted(caches.items()):
+        hits = counters.get("hits", 0) + counters.get("disk_hits", 0)
+        lookups = hits + counters.get("misses", 0)
+        lines.append(f'search_cache_hit_ratio{{cache="{cache}"}} {hits / lookups if lookups else 0.0}')
+
+    for name, value in (extra or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    for name, value in (counters or {}).items():
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_query(query_string):
+    """Cache key of a query. The nomic tokenizer is uncased, so case and extra spaces give the same vector."""
+    return " ".join(query_string.lower().split())
+
+
+class QueryVectorCache:
+    """LRU cache of query vectors with an optional time to live, shared by the threads of a worker.
+
+    encode gets a list of query strings and returns their vectors. Filling the cache with
+    prewarm() before the web server forks its workers (gunicorn --preload) shares the warm
+    entries between all of them. hits, misses and saved_ms (encoding time hits did not spend,
+    estimated from the average miss) are kept for the metrics.
+    """
+
+    def __init__(self, encode, max_entries, ttl=None, name=""):
+        self.encode = encode
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.name = name
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.miss_ms = 0.0
+
+    def get(self, query_string):
+        key = normalize_query(query_string)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or time.time() - entry[1] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        start = time.perf_counter()
+        vector = self.encode([key])[0]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.misses += 1
+            self.miss_ms += elapsed_ms
+            self._put(key, vector)
+        return vector
+
+    def _put(self, key, vector, stamp=None):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        self.entries[key] = (vector, time.time() if stamp is None else stamp)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def prewarm(self, queries_file, snapshot_file=None, batch_size=32):
+        """Encodes the queries in queries_file, one per line with the most popular first.
+
+        With snapshot_file the vectors are saved and loaded from there next time, as long as
+        it is newer than queries_file and was made by the same model.
+        """
+        with open(queries_file, encoding="utf-8") as f:
+            queries = list(dict.fromkeys(normalize_query(line) for line in f if line.strip()))[:self.max_entries]
+
+        vectors = None
+        if snapshot_file is not None and os.path.exists(snapshot_file) and os.path.getmtime(snapshot_file) >= os.path.getmtime(queries_file):
+            snapshot = np.load(snapshot_file)
+            if str(snapshot["name"]) == self.name and snapshot["queries"].tolist() == queries:
+                vectors = snapshot["vectors"]
+        if vectors is None:
+            vectors = np.concatenate([self.encode(queries[i:i + batch_size]) for i in range(0, len(queries), batch_size)]) if queries else []
+            if snapshot_file is not None:
+                np.savez(snapshot_file, name=self.name, queries=np.array(queries), vectors=vectors)
+
+        # Inserted least popular first so the most popular queries are evicted last. They do not expire
+        with self.lock:
+            for query, vector in reversed(list(zip(queries, vectors))):
+                self._put(query, vector, stamp=float("inf") if self.ttl is not None else None)
+        print(f"Query vector cache warmed up with {len(queries)} queries")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_ms": self.hits * self.miss_ms / self.misses if self.misses else 0.0,
+            }
@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from query_cache import normalize_query
+
+
+class ResponseCache:
+    """Finished result pages, so a repeated search skips spelling, encoding, search and metadata.
+
+    The key is the normalized query, the query type, the slider values, the page and the
+    version of the indices. version() returns that version and is checked every check_interval
+    seconds by a background thread, when it changed all pages are forgotten. Pages are kept in
+    an LRU of max_entries per worker and expire after ttl seconds. With path they are also kept
+    in an SQLite file that all workers on the machine share, so a page one worker made is a hit
+    for the others.
+    """
+
+    def __init__(self, max_entries, ttl=None, path=None, version=None, check_interval=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.version_function = version
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.pid = None
+        try:
+            self.version = json.dumps(version()) if version is not None else ""
+        except Exception as e:
+            # Nothing is cached until the version is known
+            self.version = None
+            print(f"Could not get the index version: {e}")
+        if path is not None:
+            with self._connection() as connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, version TEXT, stamp REAL, body TEXT)")
+                connection.execute("CREATE INDEX IF NOT EXISTS responses_stamp ON responses (stamp)")
+
+    def _connection(self):
+        # SQLite connections can not be used after a fork or from other threads
+        if getattr(self.local, "connection", None) is None or self.local.pid != os.getpid():
+            self.local.connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            self.local.connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                version = json.dumps(self.version_function())
+                if version != self.version:
+                    self.invalidate(version)
+            except Exception as e:
+                print(f"Could not check the index version: {e}")
+
+    def invalidate(self, version=None):
+        """Forgets all pages, and in the file the pages of other versions."""
+        with self.lock:
+            self.entries.clear()
+            self.version = version if version is not None else self.version
+        if self.path is not None:
+            self._connection().execute("DELETE FROM responses WHERE version != ?", (self.version,))
+
+    def key(self, query_string, query_type, slider_values, page):
+        return json.dumps([normalize_query(query_string), query_type, [float(v) for v in slider_values], page, self.version])
+
+    def get(self, key):
+        """The cached page for key, or None. The page is shared, it must not be changed."""
+        if self.pid != os.getpid() and self.version_function is not None:
+            # Threads do not survive a fork, every worker process starts its own watcher
+            self.pid = os.getpid()
+            threading.Thread(target=self._watch, daemon=True).start()
+        if self.version is None:
+            return None
+
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or now - entry[1] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.path is not None:
+            try:
+                row = self._connection().execute("SELECT stamp, body FROM responses WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Could not read the response cache: {e}")
+                row = None
+            if row is not None and (self.ttl is None or now - row[0] < self.ttl):
+                page = json.loads(row[1])
+                with self.lock:
+                    self.disk_hits += 1
+                    self._put(key, page, row[0])
+                return page
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, page):
+        if self.version is None or json.loads(key)[-1] != self.version:
+            return # Made with indices that are no longer live
+        now = time.time()
+        with self.lock:
+            self._put(key, page, now)
+            self.puts += 1
+            prune = self.puts % 100 == 0
+        if self.path is not None:
+            try:
+                connection = self._connection()
+                connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, self.version, now, json.dumps(page)))
+                if prune:
+                    # The file keeps ten times as many pages as a worker, the oldest go first
+                    if self.ttl is not None:
+                        connection.execute("DELETE FROM responses WHERE stamp < ?", (now - self.ttl,))
+                    connection.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY stamp DESC LIMIT -1 OFFSET ?)", (10 * self.max_entries,))
+            except sqlite3.Error as e:
+                print(f"Could not write the response cache: {e}")
+
+    def _put(self, key, page, stamp):
+        self.entries[key] = (page, stamp)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
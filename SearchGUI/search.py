@@ -1,12 +1,20 @@
 import json
-from elasticsearch import Elasticsearch, client as cl
+from elasticsearch import Elasticsearch, NotFoundError, client as cl
 import os
-from setup import ADDRESS, API_KEY, INDEX
+import sys
+from setup import ADDRESS, API_KEY, INDEX, QUERY_CACHE_SIZE, QUERY_CACHE_TTL, TOP_QUERIES_FILE, TOP_QUERIES_SNAPSHOT, VOCABULARY_FILE, SPELLING_MAX_TERMS, SPELLING_LLM_TIMEOUT, INDEX_EPISODES, INDEX_SHOWS, EPISODE_CACHE_SIZE, METADATA_CHECK_INTERVAL, COLLAPSE_FIELD, INNER_HITS, PIT_KEEP_ALIVE, EMBEDDING_SOCKET, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE
+# Modules shared with the indexer, whose setup.py constants come from this folder's setup.py
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Indexer"))
+from embedding_server import EmbeddingClient
+from query_cache import QueryVectorCache
+from analyzer import analyze
+from spelling import Speller
+from metadata_cache import MetadataCache, index_version
+import metrics
+from response_cache import ResponseCache
 import re
 import openai
-from sentence_transformers import SentenceTransformer
 from datetime import datetime
-import torch.nn.functional as F
 
 import warnings
 from urllib3.exceptions import InsecureRequestWarning
@@ -28,9 +36,34 @@ chat_client = openai.OpenAI(
 """sentences = ["This is an example sentence", "Each sentence is converted"]
 model = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')"""
 
-matryoshka_dim = 256 #Nyhet
+def load_local_model():
+    # Only imported here, with the embedding server the workers do not load PyTorch
+    from embedding_backend import load_embedding_backend
+    return load_embedding_backend() # EMBEDDING_BACKEND in setup.py picks PyTorch or ONNX
 
-model = SentenceTransformer("nomic-ai/nomic-embed-text-v1.5", trust_remote_code=True) #Nyhet
+
+model = None
+if EMBEDDING_SOCKET is not None and os.path.exists(EMBEDDING_SOCKET):
+    try:
+        # One model for every worker, see embedding_server.py. The worker only loads its own if the server stops answering
+        model = EmbeddingClient(EMBEDDING_SOCKET, fallback=load_local_model)
+    except (ConnectionError, OSError):
+        print(f"No embedding server on {EMBEDDING_SOCKET}, loading the model in this process")
+if model is None:
+    model = load_local_model()
+
+
+@metrics.timed("encode")
+def encode_queries(queries):
+    return model.encode(["search_query: " + q for q in queries])
+
+
+query_cache = QueryVectorCache(encode_queries, QUERY_CACHE_SIZE, QUERY_CACHE_TTL, name=model.cache_name)
+if os.path.exists(TOP_QUERIES_FILE):
+    query_cache.prewarm(TOP_QUERIES_FILE, TOP_QUERIES_SNAPSHOT)
+speller = Speller(VOCABULARY_FILE, SPELLING_MAX_TERMS) if os.path.exists(VOCABULARY_FILE) else None
+metadata_cache = MetadataCache(client, INDEX_EPISODES, INDEX_SHOWS, EPISODE_CACHE_SIZE, METADATA_CHECK_INTERVAL)
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_FILE, lambda: index_version(client, [INDEX, INDEX_EPISODES, INDEX_SHOWS]), METADATA_CHECK_INTERVAL)
 
 
 class QueryType:
@@ -45,91 +78,40 @@ class QueryType:
 def get_transcript_metadata(results, ids):
     if len(results) == 0:
         return []
-    metadata = []
-    shows = []
-    episodes = []
-    for res, res_id in zip(results, ids):
-        show = res["show_id"]
-        shows.append(show)
-        episode = res_id.split("_")[0]
-        episodes.append(episode)
-
-    episode_bulk_response = client.mget(index="podcast_episodes", body={"ids": episodes})
-
-    show_bulk_response = client.mget(index="podcast_shows", body={"ids": shows})
-    for episode_response, show_response in zip(episode_bulk_response["docs"], show_bulk_response["docs"]):
-        this_metadata = {}
-        if episode_response["found"]:
-            episode = episode_response["_source"]
-
-            if "episode_name" in episode:
-                this_metadata["episode_name"] = episode["episode_name"]
-            else:
-                this_metadata["episode_name"] = "null"
-
-            if "episode_name" in episode:
-                this_metadata["episode_description"] = episode["episode_description"]
-            else:
-                this_metadata["episode_description"] = "null"
-
-            if "audio_link" in episode:
-                this_metadata["audio_link"] = episode["audio_link"]
-            else:
-                this_metadata["audio_link"] = "null"
-        else:
-            this_metadata["episode_name"] = "null"
-            this_metadata["episode_description"] = "null"
-            this_metadata["audio_link"] = "null"
-
-        if show_response["found"]:
-            show = show_response["_source"]
-            if "show_name" in show:
-                this_metadata["podcast_name"] = show["show_name"]
-            else:
-                this_metadata["podcast_name"] = "null"
-
-            if "show_description" in show:
-                this_metadata["podcast_description"] = show["show_description"]
-            else:
-                this_metadata["podcast_description"] = "null"
-
-            if "publisher" in show:
-                this_metadata["publisher"] = show["publisher"]
-            else:
-                this_metadata["publisher"] = "null"
-
-            if "link" in show:
-                this_metadata["link"] = show["link"].lstrip(" ").rstrip(" ")
-            else:
-                this_metadata["link"] = "null"
-
-            if "image" in show:
-                this_metadata["image"] = show["image"]
-            else:
-                this_metadata["image"] = "null"
-
-            if "pod_link" in show:
-                this_metadata["pod_link"] = show["pod_link"]
-            else:
-                this_metadata["pod_link"] = "null"
+    episodes, shows = metadata_ids(results, ids)
+    return format_metadata(*metadata_cache.get(episodes, shows))
 
-        else:
-            this_metadata["podcast_name"] = "null"
-            this_metadata["podcast_description"] = "null"
-            this_metadata["publisher"] = "null"
-            this_metadata["link"] = "null"
-            this_metadata["image"] = "null"
-            this_metadata["pod_link"] = "null"
 
+def metadata_ids(results, ids):
+    shows = [res["show_id"] for res in results]
+    episodes = [res_id.split("_")[0] for res_id in ids]
+    return episodes, shows
+
+
+def format_metadata(episode_metadata, show_metadata):
+    metadata = []
+    for episode, show in zip(episode_metadata, show_metadata):
+        episode = episode or {}
+        show = show or {}
+        this_metadata = {field: episode.get(field, "null") for field in ("episode_name", "episode_description", "audio_link")}
+        this_metadata["podcast_name"] = show.get("show_name", "null")
+        this_metadata["podcast_description"] = show.get("show_description", "null")
+        this_metadata["publisher"] = show.get("publisher", "null")
+        this_metadata["link"] = show["link"].lstrip(" ").rstrip(" ") if "link" in show else "null"
+        this_metadata["image"] = show.get("image", "null")
+        this_metadata["pod_link"] = show.get("pod_link", "null")
         metadata.append(this_metadata)
 
     return metadata
 
 
-def generate_query(query_string, query_type, slider_values):
-    """Här är värdena som går att ändra"""
+@metrics.timed("generate_query")
+def generate_query(query_string, query_type, slider_values, depth=20, vector=None):
+    """Här är värdena som går att ändra. depth is how many hits the knn part has to reach, at least the hits of all pages up to the current one.
+    A caller that already corrected the spelling of a combi query and encoded it passes the vector"""
     intersection_boost, phrase_boost, union_boost, semantic_boost = slider_values
-    num_candidates = 100  # Kan vara mycket större
+    knn_k = max(20, depth)
+    num_candidates = max(100, knn_k)  # Kan vara mycket större
 
     # title_boost = 0.1
     auto = True  # Ta bort
@@ -171,15 +153,13 @@ def generate_query(query_string, query_type, slider_values):
             query = generate_smart_query(query_string)
         else:
 
-            query_string = check_spelling(query_string)
+            if vector is None:
+                query_string = check_spelling(query_string)
+                vector = query_cache.get(query_string)  # Layer norm, Matryoshka truncation and normalization, cached
 
             #cl.IndicesClient(client).refresh() #Tror inte denna behövs ?
             tokens = get_tokens(query_string)
             must_occur_list = [{"term": {"transcript": token}} for token in tokens]
-            embeddings = model.encode("search_query: " + query_string, convert_to_tensor=True)  # Nyhet
-            embeddings = F.layer_norm(embeddings, normalized_shape=(embeddings.shape[0],))  # Nyhet
-            embeddings = embeddings[:matryoshka_dim]  # Nyhet
-            vector = F.normalize(embeddings, p=2, dim=0)  # Nyhet
             query = {  # Vill söka i titel här
 
                 "query": {
@@ -216,7 +196,7 @@ def generate_query(query_string, query_type, slider_values):
                 "knn": {
                     "field": "vector",  # Field containing the vectors
                     "query_vector": vector.tolist(),  # Vector for similarity search, kanske ska vara .toList()
-                    "k": 20,
+                    "k": knn_k,
                     "num_candidates": num_candidates,
                     "boost": semantic_boost
 
@@ -269,6 +249,16 @@ def check_char(string):
 
 
 def check_spelling(query_string):
+    """Corrects the query against the vocabulary of the transcripts, the LLM only gets words with no close term"""
+    if speller is None:
+        return check_spelling_remote(query_string)
+    query_string, unknown = speller.correct(query_string)
+    if len(unknown) > 0:
+        query_string = correct_with_llm(query_string)
+    return query_string
+
+
+def check_spelling_remote(query_string):
     # Börja med att kolla om querien innehåller något specialtecken - isf kör special
     """Gå igenom alla ord, om någon returnerar 0 kan vi tolka det som att det är felstavat -> kör in hela querien i chatGPT"""
     string_list = query_string.split(" ")
@@ -278,46 +268,126 @@ def check_spelling(query_string):
                 "match": {"transcript": string}
             }
         }
-        res = client.search(index=INDEX, body=spelling_query, size=50)
+        res = client.search(index=INDEX, body=spelling_query, size=0)
         if res['hits']['total']['value'] == 0:
-            # Sätt query_string till_chat-gpt
-            messages = [ {"role": "system", "content":"Correct any spelling mistakes"} ]
-            messages.append(
-                {"role": "user", "content": query_string},
-            )
-            chat = chat_client.chat.completions.create(
-                messages=messages,
-                temperature=0.1,
-                model="gpt-3.5-turbo",
-            )
-            query_string = chat.choices[0].message.content
-
-            break
+            return correct_with_llm(query_string)
     return query_string
 
 
-def execute_query(query, n=10, index=INDEX):
-    return client.search(index=index, body=query, size=n, source=["show_id", "transcript", "starttime", "endtime"])
-
-
-def get_first_n_results(response, n=10):
+@metrics.timed("spelling_llm")
+def correct_with_llm(query_string):
+    """Asks the chat model to correct the query, gives up after SPELLING_LLM_TIMEOUT seconds"""
+    if SPELLING_LLM_TIMEOUT is None:
+        return query_string
+    messages = [ {"role": "system", "content":"Correct any spelling mistakes"} ]
+    messages.append(
+        {"role": "user", "content": query_string},
+    )
+    try:
+        chat = chat_client.with_options(timeout=SPELLING_LLM_TIMEOUT, max_retries=0).chat.completions.create(
+            messages=messages,
+            temperature=0.1,
+            model="gpt-3.5-turbo",
+        )
+    except openai.OpenAIError:
+        return query_string
+    return chat.choices[0].message.content
+
+
+def keyword_field(field):
+    """field if it is a keyword field in every index behind INDEX, else None.
+
+    Collapsing on a text field fails, indices built before show_id became a keyword are then
+    searched without collapsing until they are rebuilt and the workers restarted.
+    """
+    if field is None:
+        return None
+    try:
+        mappings = client.indices.get_field_mapping(index=INDEX, fields=field)
+        types = [m["mappings"].get(field, {}).get("mapping", {}).get(field.split(".")[-1], {}).get("type") for m in mappings.values()]
+    except Exception as e:
+        print(f"Could not read the mapping of {field}, results are not collapsed: {e}")
+        return None
+    if len(types) == 0 or any(t != "keyword" for t in types):
+        print(f"{field} is not a keyword field in {INDEX} ({types}), results are deduplicated after the search instead")
+        return None
+    return field
+
+
+collapse_field = keyword_field(COLLAPSE_FIELD)
+
+
+def collapse_clause():
+    collapse = {"field": collapse_field}
+    if INNER_HITS > 0:
+        # The first inner hit is the top hit itself
+        collapse["inner_hits"] = {"name": "more_segments", "size": INNER_HITS + 1, "_source": ["transcript", "starttime", "endtime"]}
+    return collapse
+
+
+SOURCE = ["show_id", "transcript", "starttime", "endtime"]
+
+
+def search_request(query, n=10, index=INDEX, page=0, pit_id=None):
+    """The keyword arguments of client.search for page (from 0) of n results, one per show.
+
+    Used by execute_query and async_search.execute_query so both send the same search. A page
+    after the first is searched in the point in time pit_id, see needs_point_in_time.
+    """
+    if collapse_field is None:
+        # Indices where show_id is text can not be collapsed, the shows are deduplicated afterwards from three hits per show
+        return {"index": index, "body": query, "size": 3 * n * (page + 1), "source": SOURCE}
+
+    body = dict(query, collapse=collapse_clause())
+    if page == 0:
+        return {"index": index, "body": body, "size": n, "source": SOURCE}
+    return {"body": body, "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}, "from_": page * n, "size": n, "source": SOURCE}
+
+
+def needs_point_in_time(page):
+    return collapse_field is not None and page > 0
+
+
+def execute_query(query, n=10, index=INDEX, page=0, pit_id=None):
+    """Searches page (from 0) of n results, one per show.
+
+    Pages after the first are searched in a point in time so they do not change while the user
+    pages, it is opened when the second page is asked for and its id is in the response.
+    search_after would need the sort to be on the collapse field, so pages use from and size.
+    """
+    if needs_point_in_time(page):
+        if pit_id is not None:
+            try:
+                return client.search(**search_request(query, n, index, page, pit_id))
+            except NotFoundError:
+                pass # The point in time expired, the next one starts now
+        pit_id = client.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+    return client.search(**search_request(query, n, index, page, pit_id))
+
+
+def get_first_n_results(response, n=10, page=0):
     results = []
     ids = []
-    for hit in response['hits']['hits'][:n]:
+    hits = response['hits']['hits']
+    if collapse_field is None:
+        seen = set()
+        unique_hits = []
+        for hit in hits:
+            if hit['_source']['show_id'] not in seen:
+                seen.add(hit['_source']['show_id'])
+                unique_hits.append(hit)
+        hits = unique_hits[page * n:]
+    for hit in hits[:n]:
         result = hit['_source']
         result_id = hit['_id']
+        if 'inner_hits' in hit:
+            result['more_segments'] = [inner['_source'] for inner in hit['inner_hits']['more_segments']['hits']['hits'] if inner['_id'] != result_id][:INNER_HITS]
         results.append(result)
         ids.append(result_id)
     return results, ids
 
 
+@metrics.timed("analyze")
 def get_tokens(text):
-    analyze_body = {
-        "text": text,
-        "analyzer": "standard"  # You can specify the name of the analyzer here
-    }
-    response = client.indices.analyze(index=INDEX, body=analyze_body)
-
-    # Extract and print the tokens
-    tokens = [token['token'] for token in response['tokens']]
-    return tokens
+    # Same tokens as the standard analyzer of the transcript field, without asking Elasticsearch
+    return analyze(text)
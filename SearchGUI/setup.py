@@ -1,4 +1,35 @@
 ADDRESS = "https://129.151.196.60:9200/"  # "http://localhost:9200"
 API_KEY = "eElrOE9vOEJoZHJJOEFESlVKT2E6aFJLNVBqRHhTcFd0NjR6dkxZbE13QQ==" #"VjdHRnBJNEJCX1ZpajJxeXp6RXQ6cjhfTzdFb2FUcnVNTVVwalYxLUNJdw=="
-INDEX = "podcast_transcripts"
+INDEX = "podcast_transcripts" # Alias of the live version of the index, see Indexer/index_versions.py
+INDEX_EPISODES = "podcast_episodes"
+INDEX_SHOWS = "podcast_shows"
 DATASET_FOLDER = "../dataset/"
+EMBEDDING_MODEL = "nomic-ai/nomic-embed-text-v1.5"
+MATRYOSHKA_DIM = 256
+EMBEDDING_BACKEND = "torch" # "torch" or "onnx", onnx runs ONNX_MODEL_FILE with onnxruntime on the CPU without PyTorch
+ONNX_MODEL_FILE = "onnx/model_quantized.onnx" # File in the model repository (int8 weights) or a local file made by Indexer/export_onnx.py
+QUERY_CACHE_SIZE = 10000 # Query vectors kept per worker, about 1 KB each
+QUERY_CACHE_TTL = None # Seconds until a cached query vector is encoded again, None keeps them until they are evicted
+TOP_QUERIES_FILE = "top_queries.txt" # Popular queries, one per line with the most popular first, encoded at startup if the file exists
+TOP_QUERIES_SNAPSHOT = "top_queries.npz" # Vectors of TOP_QUERIES_FILE, so a restart does not encode them again
+VOCABULARY_FILE = "vocabulary.tsv.gz" # Term dictionary written by Indexer/export_vocabulary.py, without it every word is looked up in Elasticsearch
+SPELLING_MAX_TERMS = 100000 # Most frequent terms of the vocabulary used for corrections
+SPELLING_LLM_TIMEOUT = 2.0 # Seconds the LLM gets to correct words with no close term, None to never ask it
+EPISODE_CACHE_SIZE = 200000 # Episodes whose metadata is kept per worker, all shows are always kept
+METADATA_CHECK_INTERVAL = 60 # Seconds between checks whether the indices or their links changed
+RESULTS_PER_PAGE = 20 # Shows on one result page
+COLLAPSE_FIELD = "show_id" # Field with one result per value, only used if it is a keyword field in the index (checked at startup). None to never collapse
+INNER_HITS = 0 # More segments of the same show returned with every result
+PIT_KEEP_ALIVE = "5m" # How long the point in time of a paged search lives between two pages
+ENCODE_THREADS = 2 # Queries encoded at the same time per worker process
+ES_CONNECTIONS = 16 # Connections to every Elasticsearch node per worker process
+EMBEDDING_SOCKET = "embedding.sock" # Unix socket of embedding_server.py, workers load their own model when nothing listens there. None to always load it
+EMBEDDING_MAX_WAIT_MS = 5 # How long the embedding server waits for more queries to encode them together
+EMBEDDING_MAX_BATCH = 64 # Most texts the embedding server encodes at once
+EMBEDDING_TIMEOUT = 5 # Seconds a worker waits for the embedding server before it encodes the query itself
+RESPONSE_CACHE_SIZE = 2000 # Result pages kept per worker
+RESPONSE_CACHE_TTL = 600 # Seconds until a cached result page is searched again, None keeps it until the index changes
+RESPONSE_CACHE_FILE = "response_cache.sqlite" # Result pages shared by the workers on this machine, None to only keep them in memory
+METRICS_ENABLED = True # Time the stages of every search for the Server-Timing header and /metrics
+METRICS_DIR = "metrics" # Where every worker writes its metrics for /metrics to add up, None to only report the worker that answers
+METRICS_FLUSH_INTERVAL = 5 # Seconds between writes of the metrics of a worker
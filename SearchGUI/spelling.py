@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import os
+import sys
+from itertools import islice
+import numpy as np
+
+# analyzer.py is in the indexer, which also builds the vocabulary with it
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Indexer"))
+from analyzer import analyze
+
+# Spelling correction against the vocabulary of the transcripts (Indexer/export_vocabulary.py)
+# with symmetric deletes: every term is stored under the strings that are left when up to
+# max_distance characters are deleted from its first prefix_length characters. Deleting
+# characters from a misspelled word reaches the same strings, so the candidates are a few sorted
+# array lookups and only they are compared with an edit distance. The delete index is kept as
+# two arrays of 8 byte hashes and term numbers, built once and saved next to the vocabulary.
+
+
+def delete_hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def deletes(word, max_distance):
+    """word and every string made by deleting up to max_distance characters from it."""
+    result = {word}
+    edges = {word}
+    for _ in range(max_distance):
+        edges = {w[:i] + w[i + 1:] for w in edges for i in range(len(w))} - result
+        result |= edges
+    return result
+
+
+def edit_distance(a, b, max_distance):
+    """Optimal string alignment distance (a swap of neighbours counts as one), or max_distance + 1 if it is larger."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class Speller:
+    """Corrects words to the closest and then most frequent term of the vocabulary.
+
+    Every term of the vocabulary is a known word that is left as it is, kept as a sorted array
+    of hashes. Only the max_terms most frequent terms are suggested as corrections.
+    """
+
+    def __init__(self, path, max_terms=100000, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        index_path = path + ".index.npz"
+        index = None
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(path):
+            index = np.load(index_path)
+            if "known" not in index.files or not np.array_equal(index["settings"], [max_terms, max_distance, prefix_length]):
+                index = None
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            # All terms are only read when the known words are not in the index file yet
+            lines = f if index is None else islice(f, max_terms)
+            rows = [line.rstrip("\n").split("\t") for line in lines]
+        self.terms = [term for term, _ in rows[:max_terms]]
+        self.df = np.array([int(df) for _, df in rows[:max_terms]], dtype=np.int64)
+        self.term_ids = {term: i for i, term in enumerate(self.terms)}
+
+        if index is not None:
+            self.known, self.hashes, self.ids = index["known"], index["hashes"], index["ids"]
+            return
+        self.known = np.unique(np.array([delete_hash(term) for term, _ in rows], dtype=np.uint64))
+        self._build()
+        np.savez(index_path, settings=np.array([max_terms, max_distance, prefix_length]), known=self.known, hashes=self.hashes, ids=self.ids)
+
+    def is_known(self, word):
+        """True if the word is any term of the vocabulary, also one too rare to be suggested."""
+        if word in self.term_ids:
+            return True
+        key = np.uint64(delete_hash(word))
+        i = np.searchsorted(self.known, key)
+        return i < len(self.known) and self.known[i] == key
+
+    def _build(self):
+        hashes = []
+        ids = []
+        for i, term in enumerate(self.terms):
+            for delete in deletes(term[:self.prefix_length], self.max_distance):
+                hashes.append(delete_hash(delete))
+                ids.append(i)
+        hashes = np.array(hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")
+        self.hashes = hashes[order]
+        self.ids = np.array(ids, dtype=np.uint32)[order]
+
+    def correct_word(self, word):
+        """The word if it is known or not a word, else the best term within the edit distance, else None."""
+        if len(word) <= 2 or not word.isalpha() or self.is_known(word):
+            return word
+        max_distance = 1 if len(word) <= 4 else self.max_distance
+        keys = np.array([delete_hash(d) for d in deletes(word[:self.prefix_length], max_distance)], dtype=np.uint64)
+        starts = np.searchsorted(self.hashes, keys, side="left")
+        ends = np.searchsorted(self.hashes, keys, side="right")
+        candidates = {int(i) for start, end in zip(starts, ends) for i in self.ids[start:end]}
+
+        best = None
+        for i in candidates:
+            distance = edit_distance(word, self.terms[i], max_distance)
+            if distance <= max_distance and (best is None or (distance, -self.df[i]) < best[0]):
+                best = ((distance, -self.df[i]), self.terms[i])
+        return best[1] if best is not None else None
+
+    def correct(self, query_string):
+        """Returns the corrected query and the words that had no term close enough."""
+        words = []
+        unknown = []
+        for word in query_string.split():
+            tokens = analyze(word)
+            corrections = [self.correct_word(token) for token in tokens]
+            unknown.extend(token for token, correction in zip(tokens, corrections) if correction is None)
+            if all(correction == token for token, correction in zip(tokens, corrections)):
+                words.append(word)
+            else:
+                words.append(" ".join(correction or token for token, correction in zip(tokens, corrections)))
+        return (" ".join(words), unknown)
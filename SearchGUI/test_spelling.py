@@ -0,0 +1,20 @@
+import gzip
+from spelling import Speller
+
+
+def write_vocabulary(path, rows):
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for term, df in rows:
+            f.write(f"{term}\t{df}\n")
+
+
+def test_known_word_beyond_max_terms_is_not_corrected(tmp_path):
+    path = str(tmp_path / "vocabulary.tsv.gz")
+    # "histories" is one edit from "history" but too rare to be among the suggested terms
+    write_vocabulary(path, [("history", 900), ("podcast", 800), ("sweden", 700), ("histories", 3)])
+    for _ in range(2): # Built, then loaded from the index file
+        speller = Speller(path, max_terms=3)
+        assert speller.correct_word("histories") == "histories"
+        assert speller.correct("histories of podcsat") == ("histories of podcast", [])
+        assert speller.correct_word("histroy") == "history"
+        assert speller.correct_word("qzxvw") is None